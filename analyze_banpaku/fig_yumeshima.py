@@ -1,27 +1,48 @@
+import argparse
+import sys
+from pathlib import Path
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import japanize_matplotlib
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import business_calendar
+import od_cube
 
-df = pd.read_csv('sorted_output.csv', encoding='cp932')
-df['data_date'] = pd.to_datetime(df['data_date'])
 
-mask_nkz_to_ym = (df['depature_station'] == 'なかもず') & (df['arrival_station'] == '夢洲')
-mask_ym_to_nkz = (df['depature_station'] == '夢洲') & (df['arrival_station'] == 'なかもず')
+p = argparse.ArgumentParser(description='2駅間の1日ごと・方向別の利用者数をグラフ化する')
+p.add_argument('--source', default='sorted_output.csv', help='OD data (default: sorted_output.csv)')
+p.add_argument('--origin', default='なかもず')
+p.add_argument('--dest', default='夢洲')
+p.add_argument('--save', default=None, help='Save the figure to this path instead of showing it')
+p.add_argument('--shade-holidays', action='store_true', help='Shade weekends and public holidays')
+args = p.parse_args()
 
-df_nkz_to_ym = df[mask_nkz_to_ym]
-df_ym_to_nkz = df[mask_ym_to_nkz]
+# 日付×出発駅×到着駅の集計キューブ（sorted_output_cube.npy）を読み込む．
+# 無い・古い場合は sorted_output.csv（または .parquet）から1回の集計で作り直す
+cube = od_cube.cube_for(args.source)
 
-cnt_nkz_to_ym = df_nkz_to_ym.groupby('data_date').size()
-cnt_ym_to_nkz = df_ym_to_nkz.groupby('data_date').size()
+a, b = args.origin, args.dest
+cnt_a_to_b = cube.pair_series(a, b)
+cnt_b_to_a = cube.pair_series(b, a)
 
 plt.figure(figsize=(10, 5))
-plt.plot(cnt_nkz_to_ym.index, cnt_nkz_to_ym.values, label='なかもず→夢洲', marker='o')
-plt.plot(cnt_ym_to_nkz.index, cnt_ym_to_nkz.values, label='夢洲→なかもず', marker='o')
+plt.plot(cnt_a_to_b.index, cnt_a_to_b.values, label=f'{a}→{b}', marker='o')
+plt.plot(cnt_b_to_a.index, cnt_b_to_a.values, label=f'{b}→{a}', marker='o')
+if args.shade_holidays:
+    # 土日祝の日付を網掛けする（営業日表は日付範囲ごとに1回だけ作る）
+    days = business_calendar.business_days(cube.dates[0], cube.dates[-1])
+    for day in days.index[~days.to_numpy()]:
+        plt.axvspan(day - pd.Timedelta(hours=12), day + pd.Timedelta(hours=12), color='0.9', zorder=0)
 plt.xlabel('日付')
 plt.ylabel('人数')
-plt.title('なかもず〜夢洲間の利用者数（1日ごと・方向別）')
+plt.title(f'{a}〜{b}間の利用者数（1日ごと・方向別）')
 plt.legend()
 plt.grid(True)
 plt.tight_layout()
-plt.show()
+if args.save:
+    plt.savefig(args.save)
+    print(f'Saved: {args.save}')
+else:
+    plt.show()
@@ -1,49 +1,119 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import argparse
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # 画面表示しないので非対話バックエンドで描画する
+import matplotlib.pyplot as plt
 import japanize_matplotlib
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import od_cube
+
 csv_file = 'sorted_output.csv'
 output_dir = 'figs_nakamozu_pairs'
-os.makedirs(output_dir, exist_ok=True)
+default_hub = 'なかもず'
+
+
+# ワーカーごとに1つだけ作って使い回す Figure / Axes / Line2D
+_cube = None
+_fig = None
+_ax = None
+_line_out = None
+_line_in = None
+
+
+def _init_worker(cube_path):
+    """キューブを mmap で開き，描画用の Figure を1つ用意する．"""
+    global _cube, _fig, _ax, _line_out, _line_in
+    _cube = od_cube.load_cube(cube_path)
+    dates = _cube.dates
+    zeros = np.zeros(len(dates))
+
+    _fig, _ax = plt.subplots(figsize=(10, 5))
+    (_line_out,) = _ax.plot(dates, zeros, marker='o')
+    (_line_in,) = _ax.plot(dates, zeros, marker='o')
+    _ax.set_xlabel('日付')
+    _ax.set_ylabel('人数')
+    _ax.grid(True)
+
+
+def render_pair(hub, station, out_dir):
+    """線のデータだけを差し替えて「hub〜station」のグラフを保存する．"""
+    cnt_hub_to_other = _cube.pair_series(hub, station)
+    cnt_other_to_hub = _cube.pair_series(station, hub)
+
+    _line_out.set_ydata(cnt_hub_to_other.values)
+    _line_out.set_label(f'{hub}→{station}')
+    _line_in.set_ydata(cnt_other_to_hub.values)
+    _line_in.set_label(f'{station}→{hub}')
+    _ax.relim()
+    _ax.autoscale_view()
+    _ax.set_title(f'{hub}〜{station}間の利用者数（1日ごと・方向別）')
+    _ax.legend()
+    _fig.tight_layout()
 
+    path = os.path.join(out_dir, f'{hub}-{station}.png')
+    _fig.savefig(path)
+    return path
 
-df = pd.read_csv(csv_file, encoding='cp932')
-df['data_date'] = pd.to_datetime(df['data_date'])
 
+def render_all(cube_path, pairs, out_dir, *, workers):
+    """(hub, station) ごとのグラフを workers 個のプロセスに振り分けて描画する．"""
+    hubs = [h for h, _ in pairs]
+    stations = [s for _, s in pairs]
+    if workers <= 1:
+        _init_worker(cube_path)
+        return [render_pair(h, s, out_dir) for h, s in pairs]
 
-all_stations = set(df['depature_station'].unique()) | set(df['arrival_station'].unique())
-all_stations.discard('なかもず') 
+    chunksize = max(1, len(pairs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cube_path,)) as ex:
+        return list(ex.map(render_pair, hubs, stations, [out_dir] * len(pairs), chunksize=chunksize))
 
-for station in all_stations:
-    mask_nkz_to_other = (df['depature_station'] == 'なかもず') & (df['arrival_station'] == station)
-    mask_other_to_nkz = (df['depature_station'] == station) & (df['arrival_station'] == 'なかもず')
-    df_nkz_to_other = df[mask_nkz_to_other]
-    df_other_to_nkz = df[mask_other_to_nkz]
 
+def write_table(table, path):
+    """駅ペア×日付の集計表を CSV（utf-8-sig）または Parquet で保存する．"""
+    if str(path).endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False, encoding='utf-8-sig')
+    print(f'Saved: {path} ({len(table)} rows)')
 
-    cnt_nkz_to_other = df_nkz_to_other.groupby('data_date').size()
-    cnt_other_to_nkz = df_other_to_nkz.groupby('data_date').size()
 
+def main():
+    p = argparse.ArgumentParser(description='ハブ駅と各駅の間の日別利用者数グラフ・集計表を一括生成する')
+    p.add_argument('--source', default=csv_file, help=f'OD data (default: {csv_file})')
+    p.add_argument('--hub', action='append', default=None,
+                   help=f'Hub station (repeatable, default: {default_hub})')
+    p.add_argument('--all-pairs', action='store_true', help='Tabulate every origin/destination pair (no charts)')
+    p.add_argument('--table', default=None, help='Write the tidy data_date/origin/dest/trips table (.csv or .parquet)')
+    p.add_argument('--no-charts', dest='charts', action='store_false', help='Skip PNG rendering')
+    p.add_argument('-o', '--output-dir', default=output_dir, help=f'Output directory (default: {output_dir})')
+    p.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='Number of rendering processes')
+    args = p.parse_args()
+    if args.all_pairs and not args.table:
+        p.error('--all-pairs writes a table only; give --table PATH')
 
-    all_dates = pd.date_range(df['data_date'].min(), df['data_date'].max())
-    cnt_nkz_to_other = cnt_nkz_to_other.reindex(all_dates, fill_value=0)
-    cnt_other_to_nkz = cnt_other_to_nkz.reindex(all_dates, fill_value=0)
+    # 日付×出発駅×到着駅の集計キューブ．全ハブ分をこの1回の集計でまかなう
+    cube = od_cube.cube_for(args.source)
+    cube_path = od_cube.cube_path_for(args.source)
 
+    hubs = args.hub or ([] if args.all_pairs else [default_hub])
+    unknown = [h for h in hubs if h not in cube.stations]
+    if unknown:
+        raise SystemExit(f"❌ hub station(s) not found in data: {', '.join(unknown)}")
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(all_dates, cnt_nkz_to_other, label=f'なかもず→{station}', marker='o')
-    plt.plot(all_dates, cnt_other_to_nkz, label=f'{station}→なかもず', marker='o')
-    plt.xlabel('日付')
-    plt.ylabel('人数')
-    plt.title(f'なかもず〜{station}間の利用者数（1日ごと・方向別）')
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
+    if args.table:
+        write_table(cube.pair_table(None if args.all_pairs else hubs), args.table)
 
+    if args.charts and hubs:
+        os.makedirs(args.output_dir, exist_ok=True)
+        pairs = [(h, s) for h in hubs for s in sorted(set(cube.stations) - {h})]
+        render_all(cube_path, pairs, args.output_dir, workers=args.workers)
+        print(f"グラフ画像を「{args.output_dir}」フォルダに全駅分保存しました。")
 
-    filename = f'なかもず-{station}.png'
-    plt.savefig(os.path.join(output_dir, filename))
-    plt.close()
 
-print(f"グラフ画像を「{output_dir}」フォルダに全駅分保存しました。")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+ceremony_sweep.py
+=================
+Evaluate a whole grid of ceremony-detector parameters in one run.
+
+Tuning ``--window`` / ``--multiplier`` / ``--min_count`` /
+``--exclude-weekend-holiday`` used to mean re-running the prediction script
+(CSV load and daily aggregation included) once per combination.  This script
+loads and aggregates once, builds one station matrix per weekend/holiday
+setting and one rolling-median baseline per window (see ``spike_engine.py``);
+every multiplier / min_count pair is then a couple of array comparisons.
+
+Rules
+-----
+* ``strict``    – ``school_celemony_prediction.py`` (first spike, fallbacks)
+* ``max_ratio`` – ``school_celemony_prediction_2.py`` (max ratio day).  It
+  ignores multiplier / min_count, so it is evaluated once per window and
+  those columns are left empty.
+
+Outputs
+-------
+* ``--outfile``  long table: one row per parameter set × station
+* ``--summary``  one row per parameter set with the ``choose_overall_date``
+  result and how many stations agree with it
+
+Usage
+-----
+    python ceremony_sweep.py --rides sorted_output.csv --schools schools_within_800m.csv \
+        --windows 5 7 10 --multipliers 1.3 1.5 2.0 --min-counts 20 50 \
+        --exclude-weekend-holiday both --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+import school_celemony_prediction_2 as scp
+import spike_engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import business_calendar  # noqa: E402
+
+RULES = ("strict", "max_ratio")
+PARAM_COLUMNS = ["exclude_weekend_holiday", "rule", "window", "multiplier", "min_count"]
+
+# ---------------------------------------------------------------------------
+# Grid evaluation
+# ---------------------------------------------------------------------------
+
+def evaluate_window(
+    mat: spike_engine.StationMatrix,
+    window: int,
+    *,
+    exclude: bool,
+    rules: Sequence[str],
+    multipliers: Sequence[float],
+    min_counts: Sequence[int],
+    guarantee: bool,
+) -> pd.DataFrame:
+    """All grid points sharing *window* (one baseline computation)."""
+    base = spike_engine.compute_baseline(mat, window)
+    frames: List[pd.DataFrame] = []
+
+    def add(preds: pd.DataFrame, rule: str, multiplier, min_count) -> None:
+        preds.insert(0, "min_count", min_count)
+        preds.insert(0, "multiplier", multiplier)
+        preds.insert(0, "window", window)
+        preds.insert(0, "rule", rule)
+        preds.insert(0, "exclude_weekend_holiday", exclude)
+        frames.append(preds)
+
+    if "strict" in rules:
+        for m in multipliers:
+            for c in min_counts:
+                add(spike_engine.strict_dates(base, multiplier=m, min_count=c, guarantee=guarantee), "strict", m, c)
+    if "max_ratio" in rules:
+        add(spike_engine.max_ratio_dates(base, guarantee=guarantee), "max_ratio", None, None)
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarise(results: pd.DataFrame) -> pd.DataFrame:
+    """Overall date (``choose_overall_date``) and agreement per parameter set."""
+    recs = []
+    for params, preds in results.groupby(PARAM_COLUMNS, sort=False, dropna=False):
+        overall = scp.choose_overall_date(preds)
+        predicted = int(preds["pred_ceremony_date"].notna().sum())
+        agree = int((preds["pred_ceremony_date"] == overall).sum()) if overall is not None else 0
+        recs.append({
+            **dict(zip(PARAM_COLUMNS, params)),
+            "overall_date": overall,
+            "stations": len(preds),
+            "predicted": predicted,
+            "agree": agree,
+            "agreement": agree / predicted if predicted else float("nan"),
+        })
+    return pd.DataFrame(recs)
+
+
+def run_grid(
+    daily: pd.DataFrame,
+    *,
+    windows: Sequence[int],
+    multipliers: Sequence[float],
+    min_counts: Sequence[int],
+    excludes: Sequence[bool],
+    rules: Sequence[str],
+    guarantee: bool,
+    closures: Optional[Iterable] = None,
+    workers: int = 1,
+) -> pd.DataFrame:
+    matrices = {}
+    for exclude in excludes:
+        subset = daily
+        if exclude:
+            subset = subset[business_calendar.business_day_mask(subset["data_date"], closures=closures)]
+        matrices[exclude] = spike_engine.build_matrix(subset)
+
+    tasks = [(exclude, w) for exclude in excludes for w in windows]
+    kwargs = dict(rules=rules, multipliers=multipliers, min_counts=min_counts, guarantee=guarantee)
+    if workers <= 1 or len(tasks) <= 1:
+        frames = [evaluate_window(matrices[e], w, exclude=e, **kwargs) for e, w in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(evaluate_window, matrices[e], w, exclude=e, **kwargs) for e, w in tasks]
+            frames = [f.result() for f in futures]
+    out = pd.concat(frames, ignore_index=True)
+    out["min_count"] = out["min_count"].astype("Int64")
+    return out
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    p = argparse.ArgumentParser(description="Sweep ceremony-detector parameters over a grid (data loaded once)")
+    p.add_argument("--rides", type=Path, required=True)
+    p.add_argument("--schools", type=Path, required=True)
+    p.add_argument("--encoding")
+    p.add_argument("--windows", type=int, nargs="+", default=[7])
+    p.add_argument("--multipliers", type=float, nargs="+", default=[1.5])
+    p.add_argument("--min-counts", type=int, nargs="+", default=[50])
+    p.add_argument("--rules", nargs="+", choices=RULES, default=list(RULES))
+    p.add_argument("--exclude-weekend-holiday", choices=["no", "yes", "both"], default="no")
+    p.add_argument("--closures", type=Path, default=None, help="Extra closure dates (one per line) for the excluded runs")
+    p.add_argument("--guarantee", dest="guarantee", action="store_true", default=True, help="Always output a date (fallback mode)")
+    p.add_argument("--no-guarantee", dest="guarantee", action="store_false", help="Disable fallback date")
+    p.add_argument("--workers", type=int, default=1, help="Evaluate windows in this many processes")
+    p.add_argument("-o", "--outfile", type=Path, default=Path("ceremony_sweep.csv"))
+    p.add_argument("--summary", type=Path, default=Path("ceremony_sweep_summary.csv"))
+    args = p.parse_args()
+
+    rides, schools = scp.load_data(args.rides, args.schools, encoding=args.encoding)
+    daily = scp.aggregate_daily_counts(rides)
+    daily = daily[daily["station"].isin(schools["station"].unique())]
+
+    excludes = {"no": [False], "yes": [True], "both": [False, True]}[args.exclude_weekend_holiday]
+    results = run_grid(
+        daily,
+        windows=args.windows,
+        multipliers=args.multipliers,
+        min_counts=args.min_counts,
+        excludes=excludes,
+        rules=args.rules,
+        guarantee=args.guarantee,
+        closures=business_calendar.read_dates(args.closures) if args.closures else None,
+        workers=args.workers,
+    )
+    summary = summarise(results)
+
+    results.to_csv(args.outfile, index=False, encoding="utf-8-sig")
+    print(f"Saved: {args.outfile} ({len(results)} rows)")
+    summary.to_csv(args.summary, index=False, encoding="utf-8-sig")
+    print(f"Saved: {args.summary}")
+    print()
+    print(summary.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,23 @@
 from __future__ import annotations
 
 import argparse
+import os
+import sys
 from pathlib import Path
 from typing import Optional, List
 
 import pandas as pd
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import csv_encoding  # noqa: E402
+import od_aggregates  # noqa: E402
+import od_bins  # noqa: E402
+import od_store  # noqa: E402
+import spike_engine  # noqa: E402
+import station_master  # noqa: E402
+import timeline_render  # noqa: E402
+
 FALLBACK_ENCODINGS: List[str] = [
     "utf-8",
     "utf-8-sig",
@@ -16,29 +27,44 @@ FALLBACK_ENCODINGS: List[str] = [
 ]
 
 def read_csv_with_fallback(path: Path, encoding: Optional[str] = None, **kwargs) -> pd.DataFrame:
-    encodings = [encoding] if encoding else []
-    encodings += [e for e in FALLBACK_ENCODINGS if e not in encodings]
+    # Sniff the encoding from the first bytes (cached per file) so the CSV is
+    # normally parsed once; the remaining encodings are only a safety net.
+    detected = encoding or csv_encoding.detect_encoding(path)
+    encodings = [detected] + [e for e in FALLBACK_ENCODINGS if e != detected]
     tried: List[str] = []
     for enc in encodings:
         try:
-            return pd.read_csv(path, encoding=enc, **kwargs)
+            df = pd.read_csv(path, encoding=enc, **kwargs)
         except UnicodeDecodeError:
             tried.append(enc or "(default)")
+            continue
+        if enc != detected:
+            csv_encoding.remember_encoding(path, enc)
+        return df
     raise UnicodeDecodeError("read_csv", bytes(), 0, 0, f"Unable to decode {path}; tried {tried}")
 
 def load_data(rides_path: Path, schools_path: Path, *, encoding: Optional[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
-    rides = read_csv_with_fallback(
-        rides_path,
-        encoding=encoding,
-        parse_dates=["data_date"],
-        dtype={
-            "depature_station": "string",
-            "arrival_station": "string",
-            "depature_station_time": "string",
-            "arrival_station_time": "string",
-        },
-    )
-    rides["depature_station"] = rides["depature_station"].str.strip().str.replace("　", "", regex=False)
+    columnar = od_store.columnar_source(rides_path)
+    if od_aggregates.is_store(rides_path):
+        # aggregate store (python od_aggregates.py ingest ...): daily departures are precomputed
+        rides = od_aggregates.departures(rides_path)
+    elif columnar is not None:
+        # Parquet cache (python od_store.py ...): station names are already normalised
+        rides = od_store.load_od(columnar, columns=["data_date", "depature_station", "depature_station_time"])
+    else:
+        rides = read_csv_with_fallback(
+            rides_path,
+            encoding=encoding,
+            parse_dates=["data_date"],
+            dtype={
+                "depature_station": "string",
+                "arrival_station": "string",
+                "depature_station_time": "string",
+                "arrival_station_time": "string",
+            },
+        )
+        # canonical master names as a categorical: masks and groupbys run on integer codes
+        rides["depature_station"] = station_master.canonical(rides["depature_station"])
 
     schools = read_csv_with_fallback(
         schools_path,
@@ -51,48 +77,23 @@ def load_data(rides_path: Path, schools_path: Path, *, encoding: Optional[str])
             "school_lon": "float64",
         },
     )
-    schools["station"] = schools["station"].str.strip().str.replace("　", "", regex=False)
+    schools["station"] = station_master.canonical(schools["station"])
     return rides, schools
 
-def aggregate_daily_counts(rides: pd.DataFrame) -> pd.DataFrame:
-    return (
-        rides.groupby(["data_date", "depature_station"], observed=True)
-        .size()
-        .reset_index(name="departures")
-        .rename(columns={"depature_station": "station"})
-    )
-
-def _fallback_date(df: pd.DataFrame) -> pd.Timestamp:
-    """Fallback: day with maximum departures (ties → earliest)."""
-    max_dep = df["departures"].max()
-    return df.loc[df["departures"] == max_dep, "data_date"].iloc[0]
-
-def detect_start_date(
-    df: pd.DataFrame,
-    *,
-    window: int,
-    multiplier: float,
-    min_count: int,
-    guarantee: bool,
-) -> pd.Timestamp:
-    df = df.sort_values("data_date").copy()
-    df["baseline"] = df["departures"].rolling(window, min_periods=window).median()
-    df["ratio"] = df["departures"] / df["baseline"]
-
-    # 1) strict spike
-    mask_spike = df["baseline"].ge(min_count) & df["ratio"].ge(multiplier)
-    if mask_spike.any():
-        return df.loc[mask_spike, "data_date"].iloc[0]
-
-    if not guarantee:
-        return pd.NaT
-
-    after_baseline = df[df["baseline"].notna()].copy()
-    if not after_baseline.empty and after_baseline["ratio"].notna().any():
-        idx = after_baseline["ratio"].idxmax()
-        return df.loc[idx, "data_date"]
-
-    return _fallback_date(df)
+def aggregate_daily_counts(rides: pd.DataFrame, *, bin_minutes: Optional[int] = None) -> pd.DataFrame:
+    """Departures per (data_date, station); with *bin_minutes* also per ``time_bin``."""
+    if "departures" in rides.columns:
+        # already aggregated (--rides pointed at an od_aggregates store)
+        if bin_minutes is not None:
+            raise ValueError("re-binning stored daily departures is not supported")
+        return rides
+    return od_bins.aggregate_bins(rides, by="departure", bin_minutes=bin_minutes, value_name="departures")
+
+def build_baseline(daily: pd.DataFrame, schools: pd.DataFrame, *, window: int) -> spike_engine.Baseline:
+    """Rolling-median baseline of every school station (see spike_engine.py)."""
+    target = schools["station"].unique()
+    subset = daily[daily["station"].isin(target)]
+    return spike_engine.compute_baseline(spike_engine.build_matrix(subset), window)
 
 def predict_ceremony_dates(
     daily: pd.DataFrame,
@@ -102,20 +103,11 @@ def predict_ceremony_dates(
     multiplier: float,
     min_count: int,
     guarantee: bool,
+    base: Optional[spike_engine.Baseline] = None,
 ) -> pd.DataFrame:
-    target = schools["station"].unique()
-    subset = daily[daily["station"].isin(target)]
-
-    recs = [
-        {
-            "station": s,
-            "pred_ceremony_date": detect_start_date(
-                g, window=window, multiplier=multiplier, min_count=min_count, guarantee=guarantee
-            ),
-        }
-        for s, g in subset.groupby("station", observed=True)
-    ]
-    return pd.DataFrame(recs)
+    # all stations in one pass; pass *base* to reuse it for the timelines
+    base = base if base is not None else build_baseline(daily, schools, window=window)
+    return spike_engine.strict_dates(base, multiplier=multiplier, min_count=min_count, guarantee=guarantee)
 
 def choose_overall_date(preds: pd.DataFrame) -> Optional[pd.Timestamp]:
     cnts = preds["pred_ceremony_date"].value_counts()
@@ -136,22 +128,6 @@ def save_bar_chart(preds: pd.DataFrame, out_path: Path):
     plt.close()
     print(f"Saved: {out_path}")
 
-def save_station_timeline(g: pd.DataFrame, date: pd.Timestamp, out_path: Path, *, window: int):
-    g = g.sort_values("data_date").copy()
-    g["baseline"] = g["departures"].rolling(window, min_periods=window).median()
-    plt.figure(figsize=(9, 4))
-    plt.plot(g["data_date"], g["departures"], label="Departures")
-    plt.plot(g["data_date"], g["baseline"], label="Baseline (median)")
-    plt.axvline(date, linestyle="--", label="Predicted", linewidth=1.2)
-    plt.title(f"{g.iloc[0]['station']} – daily departures")
-    plt.ylabel("Trips")
-    plt.xticks(rotation=45, ha="right")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
-    print(f"Saved: {out_path}")
-
 def save_date_summary(preds: pd.DataFrame, out_path: Path):
     grouped = (
         preds.groupby("pred_ceremony_date")["station"]
@@ -176,7 +152,10 @@ def main():
     p.add_argument("--guarantee", dest="guarantee", action="store_true", default=True, help="Always output a date (fallback mode)")
     p.add_argument("--no-guarantee", dest="guarantee", action="store_false", help="Disable fallback date")
     p.add_argument("--bar-chart", action="store_true")
-    p.add_argument("--timeline", action="store_true")
+    p.add_argument("--timeline", action="store_true", help="One PNG per station in outputs/")
+    p.add_argument("--timeline-pdf", type=Path, default=None, help="All station timelines in one small-multiples PDF")
+    p.add_argument("--per-page", type=int, default=12, help="Stations per page with --timeline-pdf")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes used for --timeline")
 
     args = p.parse_args()
 
@@ -186,6 +165,7 @@ def main():
 
     rides, schools = load_data(args.rides, args.schools, encoding=args.encoding)
     daily = aggregate_daily_counts(rides)
+    base = build_baseline(daily, schools, window=args.window)
     preds = predict_ceremony_dates(
         daily,
         schools,
@@ -193,6 +173,7 @@ def main():
         multiplier=args.multiplier,
         min_count=args.min_count,
         guarantee=args.guarantee,
+        base=base,
     )
 
     overall = choose_overall_date(preds)
@@ -215,10 +196,9 @@ def main():
 
     # タイムライン画像もoutputs内に保存
     if args.timeline:
-        for _, row in preds.iterrows():
-            g = daily[daily["station"] == row["station"]]
-            out = outdir / f"timeline_{row['station']}.png"
-            save_station_timeline(g, row["pred_ceremony_date"], out, window=args.window)
+        timeline_render.render_pngs(base, preds, outdir, workers=args.workers)
+    if args.timeline_pdf:
+        timeline_render.render_pdf(base, preds, args.timeline_pdf, per_page=args.per_page)
 
 if __name__ == "__main__":
     main()
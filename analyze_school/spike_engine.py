@@ -0,0 +1,200 @@
+"""
+spike_engine.py
+===============
+Vectorised ceremony-day detection for all stations at once.
+
+``predict_ceremony_dates`` used to loop over ``groupby("station")``, sorting a
+copy of every group and running a pandas rolling median per station.  Here
+the daily departures are pivoted once into a *positions × stations* matrix and
+the rolling-median baseline of every column is computed together (NumPy
+sliding-window views, in column blocks to bound memory).  The spike / ratio
+rules are then a few reductions along the position axis.
+
+Rows are *compacted* per station: ``values[i, j]`` is the i-th day on which
+station *j* has departures.  Days without departures are absent from the
+daily table, and the original per-station ``rolling(window)`` ran over rows,
+not calendar days, so the compacted layout keeps the results identical.
+
+Two rule sets mirror the two scripts:
+
+* :func:`predict_strict` (``school_celemony_prediction.py``) – first day with
+  ``baseline >= min_count`` and ``ratio >= multiplier``; with *guarantee* fall
+  back to the max-ratio day, then to the busiest day.
+* :func:`predict_max_ratio` (``school_celemony_prediction_2.py``) – the
+  max-ratio day; with *guarantee* fall back to the busiest day.
+
+Ties resolve to the earliest day, as ``idxmax`` did.
+
+Parameter sweeps reuse the expensive part: build the matrix once, call
+:func:`compute_baseline` once per window, then :func:`strict_dates` /
+:func:`max_ratio_dates` for every multiplier / min_count setting.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# upper bound on window-view elements materialised per block by np.median
+_BLOCK_ELEMENTS = 8_000_000
+
+# ---------------------------------------------------------------------------
+# Station matrix
+# ---------------------------------------------------------------------------
+
+@dataclass
+class StationMatrix:
+    """Daily counts of many stations, one compacted column per station."""
+
+    stations: pd.Index
+    dates: np.ndarray   # (positions, stations) datetime64, NaT padded
+    values: np.ndarray  # (positions, stations) float64, NaN padded
+    lengths: np.ndarray  # observed days per station
+
+    def column(self, station: str) -> pd.DataFrame:
+        """``data_date`` / ``departures`` rows of one station (chronological)."""
+        j = self.stations.get_loc(station)
+        n = self.lengths[j]
+        return pd.DataFrame({"data_date": self.dates[:n, j], "departures": self.values[:n, j]})
+
+
+def build_matrix(daily: pd.DataFrame, *, value: str = "departures") -> StationMatrix:
+    """Pivot a ``data_date, station, <value>`` table into a :class:`StationMatrix`.
+
+    Stations are ordered like ``groupby("station")`` (sorted / category order).
+    """
+    codes, stations = pd.factorize(daily["station"], sort=True)
+    keep = codes >= 0
+    codes = codes[keep]
+    dates = pd.to_datetime(daily["data_date"]).to_numpy()[keep]
+    vals = daily[value].to_numpy(dtype="float64")[keep]
+
+    order = np.lexsort((dates, codes))
+    codes, dates, vals = codes[order], dates[order], vals[order]
+    n_st = len(stations)
+    lengths = np.bincount(codes, minlength=n_st)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    pos = np.arange(len(codes)) - starts[codes]
+
+    n_pos = int(lengths.max(initial=0))
+    mat_dates = np.full((n_pos, n_st), np.datetime64("NaT"), dtype=dates.dtype)
+    mat_vals = np.full((n_pos, n_st), np.nan)
+    mat_dates[pos, codes] = dates
+    mat_vals[pos, codes] = vals
+    return StationMatrix(pd.Index(stations, name="station"), mat_dates, mat_vals, lengths)
+
+# ---------------------------------------------------------------------------
+# Baseline & ratio
+# ---------------------------------------------------------------------------
+
+def rolling_median(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing median over *window* rows for every column (NaN until full).
+
+    Matches ``Series.rolling(window, min_periods=window).median()`` column by
+    column; padding only ever sits below a column's last observed row.
+    """
+    n_pos, n_cols = values.shape
+    out = np.full(values.shape, np.nan)
+    if window < 1 or n_pos < window:
+        return out
+    block = max(1, _BLOCK_ELEMENTS // max(1, (n_pos - window + 1) * window))
+    for lo in range(0, n_cols, block):
+        view = sliding_window_view(values[:, lo:lo + block], window, axis=0)
+        out[window - 1:, lo:lo + block] = np.median(view, axis=-1)
+    return out
+
+
+@dataclass
+class Baseline:
+    """Rolling-median baseline and ratio of a :class:`StationMatrix` for one window.
+
+    Shared by every multiplier / min_count setting evaluated with that window.
+    """
+
+    matrix: StationMatrix
+    window: int
+    baseline: np.ndarray
+    ratio: np.ndarray
+
+    @cached_property
+    def max_ratio(self) -> Tuple[np.ndarray, np.ndarray]:
+        return _max_ratio_pos(self.ratio, self.baseline)
+
+    @cached_property
+    def busiest(self) -> np.ndarray:
+        return _busiest_pos(self.matrix.values)
+
+
+def compute_baseline(mat: StationMatrix, window: int) -> Baseline:
+    baseline = rolling_median(mat.values, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = mat.values / baseline
+    return Baseline(mat, window, baseline, ratio)
+
+# ---------------------------------------------------------------------------
+# Rules
+# ---------------------------------------------------------------------------
+
+def _first_true(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(row of the first True per column, whether the column has one)."""
+    return mask.argmax(axis=0), mask.any(axis=0)
+
+
+def _max_ratio_pos(ratio: np.ndarray, baseline: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    valid = ~np.isnan(baseline) & ~np.isnan(ratio)
+    filled = np.where(valid, ratio, -np.inf)
+    best = filled.max(axis=0, initial=-np.inf)
+    return _first_true(valid & (filled == best))
+
+
+def _busiest_pos(values: np.ndarray) -> np.ndarray:
+    filled = np.where(np.isnan(values), -np.inf, values)
+    return filled.argmax(axis=0)
+
+
+def _result(mat: StationMatrix, pos: np.ndarray, found: np.ndarray) -> pd.DataFrame:
+    if not len(mat.stations):
+        return pd.DataFrame({"station": [], "pred_ceremony_date": pd.Series([], dtype=mat.dates.dtype)})
+    dates = mat.dates[pos, np.arange(len(mat.stations))]
+    dates[~found] = np.datetime64("NaT")
+    return pd.DataFrame({"station": list(mat.stations), "pred_ceremony_date": dates})
+
+
+def strict_dates(base: Baseline, *, multiplier: float, min_count: int, guarantee: bool) -> pd.DataFrame:
+    """First strict spike per station (rules of ``school_celemony_prediction.py``)."""
+    pos, found = _first_true((base.baseline >= min_count) & (base.ratio >= multiplier))
+    if guarantee:
+        r_pos, r_found = base.max_ratio
+        pos = np.where(found, pos, np.where(r_found, r_pos, base.busiest))
+        found = base.matrix.lengths > 0
+    return _result(base.matrix, pos, found)
+
+
+def max_ratio_dates(base: Baseline, *, guarantee: bool) -> pd.DataFrame:
+    """Max ``departures / baseline`` day per station (rules of ``school_celemony_prediction_2.py``)."""
+    pos, found = base.max_ratio
+    if guarantee:
+        pos = np.where(found, pos, base.busiest)
+        found = base.matrix.lengths > 0
+    return _result(base.matrix, pos, found)
+
+
+def predict_strict(
+    daily: pd.DataFrame,
+    *,
+    window: int,
+    multiplier: float,
+    min_count: int,
+    guarantee: bool,
+) -> pd.DataFrame:
+    base = compute_baseline(build_matrix(daily), window)
+    return strict_dates(base, multiplier=multiplier, min_count=min_count, guarantee=guarantee)
+
+
+def predict_max_ratio(daily: pd.DataFrame, *, window: int, guarantee: bool) -> pd.DataFrame:
+    base = compute_baseline(build_matrix(daily), window)
+    return max_ratio_dates(base, guarantee=guarantee)
@@ -0,0 +1,117 @@
+"""
+timeline_render.py
+==================
+Per-station departure timelines for the ceremony scripts (``--timeline``).
+
+The timeline stage used to re-filter the full daily table once per station
+and recompute the rolling median inside ``save_station_timeline`` before
+rendering every PNG serially.  Here the series come straight from the
+:class:`spike_engine.Baseline` already computed for detection (one column per
+station, baseline included), and:
+
+* :func:`render_pngs` writes one ``timeline_<station>.png`` per station across
+  a process pool (same figure as before), or
+* :func:`render_pdf` packs *per_page* stations per page as small multiples
+  into one multi-page PDF.
+"""
+from __future__ import annotations
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_pdf import PdfPages
+
+import spike_engine
+
+# (station, dates, departures, baseline, predicted date)
+Series = Tuple[str, np.ndarray, np.ndarray, np.ndarray, pd.Timestamp]
+
+# ---------------------------------------------------------------------------
+# Data
+# ---------------------------------------------------------------------------
+
+def station_series(base: spike_engine.Baseline, preds: pd.DataFrame) -> Iterator[Series]:
+    """Series for every station in *preds*, taken from the detection matrix."""
+    mat = base.matrix
+    for station, date in zip(preds["station"], preds["pred_ceremony_date"]):
+        j = mat.stations.get_loc(station)
+        n = mat.lengths[j]
+        yield station, mat.dates[:n, j], mat.values[:n, j], base.baseline[:n, j], date
+
+
+def _draw(ax, series: Series, *, small: bool = False) -> None:
+    station, dates, values, baseline, date = series
+    ax.plot(dates, values, label="Departures")
+    ax.plot(dates, baseline, label="Baseline (median)")
+    ax.axvline(date, linestyle="--", label="Predicted", linewidth=1.2)
+    if small:
+        ax.set_title(station, fontsize=9)
+        ax.tick_params(labelsize=7)
+    else:
+        ax.set_title(f"{station} – daily departures")
+        ax.set_ylabel("Trips")
+    plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+
+# ---------------------------------------------------------------------------
+# PNG per station
+# ---------------------------------------------------------------------------
+
+def _render_png(series: Series, out_path: Path) -> Path:
+    fig, ax = plt.subplots(figsize=(9, 4))
+    _draw(ax, series)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+    return out_path
+
+
+def render_pngs(base: spike_engine.Baseline, preds: pd.DataFrame, outdir: Path, *, workers: int = 1) -> List[Path]:
+    """``outdir/timeline_<station>.png`` for every station, over *workers* processes."""
+    series = list(station_series(base, preds))
+    paths = [Path(outdir) / f"timeline_{s[0]}.png" for s in series]
+    if workers <= 1 or len(series) <= 1:
+        out = [_render_png(s, path) for s, path in zip(series, paths)]
+    else:
+        chunksize = max(1, len(series) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            out = list(ex.map(_render_png, series, paths, chunksize=chunksize))
+    for path in out:
+        print(f"Saved: {path}")
+    return out
+
+# ---------------------------------------------------------------------------
+# Small multiples PDF
+# ---------------------------------------------------------------------------
+
+def render_pdf(
+    base: spike_engine.Baseline,
+    preds: pd.DataFrame,
+    out_path: Path,
+    *,
+    per_page: int = 12,
+    cols: int = 3,
+) -> Path:
+    """All stations in one PDF, *per_page* small-multiple panels per page."""
+    series = list(station_series(base, preds))
+    cols = max(1, min(cols, per_page))
+    rows = math.ceil(per_page / cols)
+    with PdfPages(out_path) as pdf:
+        for lo in range(0, len(series), per_page):
+            fig, axes = plt.subplots(rows, cols, figsize=(cols * 4.5, rows * 2.6), squeeze=False)
+            for ax, s in zip(axes.flat, series[lo:lo + per_page]):
+                _draw(ax, s, small=True)
+            for ax in axes.flat[len(series[lo:lo + per_page]):]:
+                ax.set_visible(False)
+            handles, labels = axes.flat[0].get_legend_handles_labels()
+            fig.legend(handles, labels, loc="upper right", ncol=3, fontsize=8)
+            fig.tight_layout(rect=(0, 0, 1, 0.96))
+            pdf.savefig(fig)
+            plt.close(fig)
+    print(f"Saved: {out_path} ({len(series)} stations, {math.ceil(len(series) / per_page)} pages)")
+    return Path(out_path)
@@ -0,0 +1,252 @@
+"""
+make_synthetic.py
+=================
+Synthetic inputs for the benchmark suite (``run_bench.py``).
+
+The real ``202504-Nakamozu-OD.csv`` is not in the repository, so this script
+writes an OD file with the same columns and encoding (cp932)
+
+    data_date, depature_station, depature_station_time,
+    arrival_station, arrival_station_time, ticket
+
+plus station and school coordinate tables for ``get_school_loc``:
+
+  • trips per day follow the business calendar (weekends / holidays quieter);
+  • stations are Zipf-weighted, and a share of trips start or end at a hub
+    (``なかもず``), like the real extract;
+  • departure times mix a morning peak, an evening peak and a flat base;
+    arrivals may pass 24:00 (``24:07:50``) as in the real data;
+  • planted "ceremony" spikes – one business day per spike station with
+    ``--spike-factor`` times the usual departures – are written to
+    ``ceremonies.csv`` so predictions can be checked against them;
+  • a few station names carry a trailing full-width space.
+
+Rows are generated and written in chunks, so 100M-row files need no more
+memory than one chunk.
+
+Usage
+-----
+    python bench/make_synthetic.py -o bench/data --rows 1000000
+    python bench/make_synthetic.py -o bench/data --rows 100000000 --stations 300 --days 61
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import business_calendar  # noqa: E402
+import od_store  # noqa: E402
+import station_master  # noqa: E402
+
+OD_COLUMNS = ["data_date", od_store.STATION_COLUMNS[0], od_store.TIME_COLUMNS[0],
+              od_store.STATION_COLUMNS[1], od_store.TIME_COLUMNS[1], "ticket"]
+OD_FILENAME = "202504-Nakamozu-OD.csv"
+STATIONS_FILENAME = "station_coordinates.csv"
+SCHOOLS_FILENAME = "school_coordinates.csv"
+CEREMONIES_FILENAME = "ceremonies.csv"
+
+OSAKA_BOX = (34.55, 135.35, 34.85, 135.65)   # south, west, north, east – for stations without coordinates
+OFF_DAY_FACTOR = 0.55
+EARTH_RADIUS_M = 6_371_000.0
+
+
+@dataclass
+class SyntheticConfig:
+    rows: int = 1_000_000
+    stations: int = 170
+    start: str = "2025-04-01"
+    days: int = 30
+    hub: str = "なかもず"
+    hub_share: float = 0.5
+    spike_share: float = 0.3
+    spike_factor: float = 3.0
+    schools: int = 3000
+    dirty_share: float = 1e-5
+    chunksize: int = 1_000_000
+    seed: int = 0
+
+# ---------------------------------------------------------------------------
+# Stations & schools
+# ---------------------------------------------------------------------------
+
+def station_table(cfg: SyntheticConfig, rng: np.random.Generator) -> pd.DataFrame:
+    """``name, latitude, longitude`` for *cfg.stations* stations (hub first).
+
+    Master stations (``station_master.py``) come first with their real
+    coordinates; further stations are named ``合成駅0171``, … and, like the
+    off-map master stations, get random coordinates in the Osaka area.
+    """
+    master = station_master.load_master()
+    names = [cfg.hub] + [n for n in master["name"] if n != cfg.hub]
+    names += [f"合成駅{i:04d}" for i in range(len(names) + 1, cfg.stations + 1)]
+    names = names[:cfg.stations]
+    coords = master.set_index("name")[["latitude", "longitude"]].reindex(names)
+    missing = coords["latitude"].isna().to_numpy()
+    south, west, north, east = OSAKA_BOX
+    coords.loc[missing, "latitude"] = rng.uniform(south, north, missing.sum())
+    coords.loc[missing, "longitude"] = rng.uniform(west, east, missing.sum())
+    return coords.rename_axis("name").reset_index()
+
+
+def school_table(stations: pd.DataFrame, n: int, rng: np.random.Generator) -> pd.DataFrame:
+    """``name, lat, lon`` for *n* schools scattered up to 1.5 km around random stations.
+
+    About a quarter are elementary schools, which the name filter drops.
+    """
+    at = rng.integers(0, len(stations), n)
+    dist = 1500.0 * np.sqrt(rng.random(n))
+    bearing = rng.uniform(0, 2 * np.pi, n)
+    lat0 = stations["latitude"].to_numpy()[at]
+    lon0 = stations["longitude"].to_numpy()[at]
+    lat = lat0 + np.degrees(dist * np.cos(bearing) / EARTH_RADIUS_M)
+    lon = lon0 + np.degrees(dist * np.sin(bearing) / (EARTH_RADIUS_M * np.cos(np.radians(lat0))))
+    kinds = np.array(["中学校", "高等学校", "小学校"])[rng.choice(3, n, p=[0.45, 0.3, 0.25])]
+    names = [f"市立第{i + 1}{k}" for i, k in enumerate(kinds)]
+    return pd.DataFrame({"name": names, "lat": lat.round(7), "lon": lon.round(7)})
+
+# ---------------------------------------------------------------------------
+# OD rows
+# ---------------------------------------------------------------------------
+
+def _weights(cfg: SyntheticConfig, rng: np.random.Generator, n_st: int):
+    days = pd.date_range(cfg.start, periods=cfg.days, freq="D")
+    business = business_calendar.business_days(days[0], days[-1]).to_numpy()
+    day_w = np.where(business, 1.0, OFF_DAY_FACTOR)
+
+    st_w = 1.0 / np.arange(1, n_st + 1) ** 0.8
+    st_w[1:] = rng.permutation(st_w[1:])   # hub stays the busiest
+
+    # one planted spike (business day in the first half of the span) per spike station
+    n_spikes = int(round(cfg.spike_share * (n_st - 1)))
+    spike_st = rng.choice(np.arange(1, n_st), n_spikes, replace=False) if n_spikes else np.array([], dtype=int)
+    candidates = np.flatnonzero(business[: max(cfg.days // 2, 1)])
+    if not len(candidates):
+        candidates = np.arange(max(cfg.days // 2, 1))
+    spike_day = rng.choice(candidates, len(spike_st))
+    cell_w = np.outer(day_w, st_w)
+    cell_w[spike_day, spike_st] *= cfg.spike_factor
+    return days, cell_w / cell_w.sum(), st_w / st_w.sum(), pd.DataFrame({"spike_day": spike_day, "spike_st": spike_st})
+
+
+def _times(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Departure seconds: 35 % morning peak, 35 % evening peak, 30 % flat 05:00–24:00."""
+    kind = rng.choice(3, n, p=[0.35, 0.35, 0.3])
+    secs = np.where(kind == 0, rng.normal(8 * 3600, 3600, n),
+                    np.where(kind == 1, rng.normal(18 * 3600, 5400, n), rng.uniform(5 * 3600, 24 * 3600, n)))
+    return np.clip(secs, 5 * 3600, 24 * 3600 + 1800).astype(np.int64)
+
+
+def od_chunk(cfg: SyntheticConfig, rng: np.random.Generator, n: int, names: np.ndarray,
+             dates: np.ndarray, cell_p: np.ndarray, st_p: np.ndarray) -> pd.DataFrame:
+    n_st = len(names)
+    cell = rng.choice(cell_p.size, n, p=cell_p.ravel())
+    day, origin = np.divmod(cell, n_st)
+
+    dest = rng.choice(n_st, n, p=st_p)
+    to_hub = rng.random(n) < cfg.hub_share
+    dest[to_hub] = 0
+    same = dest == origin
+    dest[same] = (dest[same] + 1 + rng.integers(0, n_st - 1, same.sum())) % n_st
+
+    # the hub share applies to both directions: swap half of the hub-bound trips
+    swap = to_hub & (rng.random(n) < 0.5)
+    origin[swap], dest[swap] = dest[swap], origin[swap]
+
+    dep = _times(rng, n)
+    arr = dep + rng.integers(5 * 60, 60 * 60, n)
+
+    dep_names = names[origin].copy()
+    dirty = rng.random(n) < cfg.dirty_share
+    dep_names[dirty] = dep_names[dirty] + "　"
+    return pd.DataFrame({
+        "data_date": dates[day],
+        "depature_station": dep_names,
+        "depature_station_time": od_store.seconds_to_hms(pd.Series(dep)).to_numpy(),
+        "arrival_station": names[dest],
+        "arrival_station_time": od_store.seconds_to_hms(pd.Series(arr)).to_numpy(),
+        "ticket": np.where(rng.random(n) < 0.5, "普通", "定期"),
+    }, columns=OD_COLUMNS)
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+def generate(cfg: SyntheticConfig, out_dir: Path) -> Dict[str, Path]:
+    """Write the OD CSV, station / school tables and the planted ceremonies to *out_dir*."""
+    if cfg.stations < 2:
+        raise SystemExit("❌ --stations must be at least 2")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(cfg.seed)
+
+    stations = station_table(cfg, rng)
+    names = stations["name"].to_numpy(dtype=object)
+    days, cell_p, st_p, spikes = _weights(cfg, rng, len(names))
+    dates = np.array(days.strftime("%Y/%m/%d"), dtype=object)
+
+    paths = {
+        "od": out_dir / OD_FILENAME,
+        "stations": out_dir / STATIONS_FILENAME,
+        "schools": out_dir / SCHOOLS_FILENAME,
+        "ceremonies": out_dir / CEREMONIES_FILENAME,
+    }
+    stations.to_csv(paths["stations"], index=False, encoding="utf-8-sig")
+    school_table(stations, cfg.schools, rng).to_csv(paths["schools"], index=False, encoding="utf-8-sig")
+    pd.DataFrame({"station": names[spikes["spike_st"]], "date": days[spikes["spike_day"]].strftime("%Y-%m-%d")}) \
+        .sort_values(["date", "station"]).to_csv(paths["ceremonies"], index=False, encoding="utf-8-sig")
+
+    with open(paths["od"], "w", encoding="cp932", newline="") as fh:
+        for written in range(0, cfg.rows, cfg.chunksize):
+            n = min(cfg.chunksize, cfg.rows - written)
+            od_chunk(cfg, rng, n, names, dates, cell_p, st_p).to_csv(
+                fh, index=False, header=written == 0)
+    return paths
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def add_config_args(p: argparse.ArgumentParser) -> None:
+    d = SyntheticConfig()
+    p.add_argument("--rows", type=int, default=d.rows, help=f"OD rows (default {d.rows:,})")
+    p.add_argument("--stations", type=int, default=d.stations, help=f"Number of stations (default {d.stations})")
+    p.add_argument("--start", default=d.start, help=f"First date (default {d.start})")
+    p.add_argument("--days", type=int, default=d.days, help=f"Date span in days (default {d.days})")
+    p.add_argument("--hub", default=d.hub, help=f"Hub station (default {d.hub})")
+    p.add_argument("--hub-share", type=float, default=d.hub_share, help="Share of trips touching the hub")
+    p.add_argument("--spike-share", type=float, default=d.spike_share, help="Share of stations with a planted spike")
+    p.add_argument("--spike-factor", type=float, default=d.spike_factor, help="Departures multiplier on spike days")
+    p.add_argument("--schools", type=int, default=d.schools, help=f"Synthetic schools (default {d.schools})")
+    p.add_argument("--chunksize", type=int, default=d.chunksize, help="Rows generated per chunk")
+    p.add_argument("--seed", type=int, default=d.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> SyntheticConfig:
+    return SyntheticConfig(
+        rows=args.rows, stations=args.stations, start=args.start, days=args.days, hub=args.hub,
+        hub_share=args.hub_share, spike_share=args.spike_share, spike_factor=args.spike_factor,
+        schools=args.schools, chunksize=args.chunksize, seed=args.seed,
+    )
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Generate a synthetic OD CSV and station / school tables")
+    p.add_argument("-o", "--out-dir", type=Path, default=Path(__file__).resolve().parent / "data")
+    add_config_args(p)
+    args = p.parse_args()
+
+    paths = generate(config_from_args(args), args.out_dir)
+    for kind, path in paths.items():
+        print(f"✅ {kind:<10} {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+run_bench.py
+============
+End-to-end benchmark of the OD / school pipeline on synthetic data.
+
+Stages (each timed, with its peak memory):
+
+    generate                make_synthetic.py (only when the data is missing or the size changed)
+    sort                    sort.sort_in_memory
+    sort_external           sort.sort_external (runs of rows/4)
+    build_within_radius     get_school_loc: school table + schools within 800 m
+    kml                     get_school_loc/build_station_school_kml.py
+    load_rides              analyze_school load_data (sorted CSV)
+    aggregate_daily_counts  analyze_school aggregate_daily_counts
+    predict_ceremony_dates  analyze_school predict_ceremony_dates
+    pair_plots              analyze_banpaku/figs_nakamozu_pairs.py (cube built from scratch, 1 worker)
+
+Prerequisites of the selected stages are added automatically (see
+``REQUIRES``): stages that hand over in-memory results always, stages that
+write a file only when that file is missing or the data is regenerated.
+
+Peak memory is the growth of the process RSS over its value at the start of
+the stage, sampled every few milliseconds by a background thread (``psutil``
+if installed, otherwise ``/proc`` on Linux; elsewhere it is not reported).
+Sampling instead of ``tracemalloc`` keeps the timings realistic and also
+covers Arrow and other native buffers.
+
+Results are written as JSON; ``--baseline`` compares a run with an earlier
+one and exits with status 1 when a stage is slower or larger than
+``--tolerance`` allows.
+
+Usage
+-----
+    python bench/run_bench.py --rows 1000000 --save-baseline bench/baseline.json
+    python bench/run_bench.py --rows 1000000 --baseline bench/baseline.json
+    python bench/run_bench.py --rows 10000000 --stages sort,sort_external
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import runpy
+import sys
+import time
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+for _p in (ROOT, ROOT / "analyze_school", ROOT / "get_school_loc", BENCH_DIR):
+    sys.path.insert(0, str(_p))
+
+import make_synthetic  # noqa: E402
+import od_cube  # noqa: E402
+import od_store  # noqa: E402
+import sort  # noqa: E402
+
+STAGES = [
+    "generate", "sort", "sort_external", "build_within_radius", "kml",
+    "load_rides", "aggregate_daily_counts", "predict_ceremony_dates", "pair_plots",
+]
+# stage → stages whose output it reads
+REQUIRES: Dict[str, List[str]] = {
+    "sort": ["generate"],
+    "sort_external": ["generate"],
+    "build_within_radius": ["generate"],
+    "kml": ["build_within_radius"],
+    "load_rides": ["sort", "build_within_radius"],
+    "aggregate_daily_counts": ["load_rides"],
+    "predict_ceremony_dates": ["aggregate_daily_counts"],
+    "pair_plots": ["sort"],
+}
+# stages whose result stays in memory: needed in the same run, whatever is on disk
+IN_MEMORY = {"load_rides", "aggregate_daily_counts"}
+RADIUS_M = 800.0
+PARAMS_FILENAME = "params.json"
+
+# regressions smaller than this are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.05
+MIN_MB_DELTA = 5.0
+SAMPLE_INTERVAL = 0.005   # seconds between RSS samples
+
+
+@dataclass
+class StageResult:
+    stage: str
+    seconds: float
+    peak_mb: Optional[float]
+    detail: str = ""
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def _rss_reader() -> Optional[Callable[[], int]]:
+    """Current resident set size in bytes (psutil, else /proc on Linux)."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        proc = psutil.Process()
+        return lambda: proc.memory_info().rss
+    statm = Path("/proc/self/statm")
+    if statm.exists():
+        page = os.sysconf("SC_PAGE_SIZE")
+        return lambda: int(statm.read_text().split()[1]) * page
+    return None
+
+
+class PeakRss(threading.Thread):
+    """Samples the RSS every *interval* seconds and keeps the maximum."""
+
+    def __init__(self, read: Callable[[], int], interval: float = SAMPLE_INTERVAL) -> None:
+        super().__init__(daemon=True)
+        self.read, self.interval = read, interval
+        self.start_rss = self.peak = read()
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, self.read())
+
+    def stop(self) -> float:
+        """Stop sampling; peak growth over the starting RSS in MB."""
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, self.read())
+        return (self.peak - self.start_rss) / 2**20
+
+
+def measure(stage: str, fn: Callable[[], str], *, memory: bool) -> StageResult:
+    """Run *fn* (which returns a short detail string); time it and sample its peak RSS."""
+    gc.collect()
+    read = _rss_reader() if memory else None
+    sampler = PeakRss(read) if read is not None else None
+    if sampler is not None:
+        sampler.start()
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            detail = fn() or ""
+        seconds = time.perf_counter() - t0
+    finally:
+        peak = sampler.stop() if sampler is not None else None
+    return StageResult(stage, round(seconds, 3), None if peak is None else round(peak, 1), detail)
+
+
+def run_script(path: Path, argv: List[str]) -> None:
+    """Run a CLI script in-process (so its allocations are traced) with *argv*."""
+    saved = sys.argv
+    sys.argv = [str(path), *argv]
+    try:
+        runpy.run_path(str(path), run_name="__main__")
+    finally:
+        sys.argv = saved
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+
+class Pipeline:
+    """Holds the file paths and the in-memory results passed between stages."""
+
+    def __init__(self, cfg: make_synthetic.SyntheticConfig, work: Path) -> None:
+        self.cfg = cfg
+        self.work = work
+        self.od = work / make_synthetic.OD_FILENAME
+        self.stations = work / make_synthetic.STATIONS_FILENAME
+        self.schools_csv = work / make_synthetic.SCHOOLS_FILENAME
+        self.sorted = work / "sorted_output.csv"
+        self.sorted_ext = work / "sorted_output_external.csv"
+        self.within = work / "schools_within_800m.csv"
+        self.kml_path = work / "stations_schools_800m.kml"
+        self.pairs_dir = work / "figs_nakamozu_pairs"
+        self.rides = self.schools = self.daily = None
+
+    def generate(self) -> str:
+        make_synthetic.generate(self.cfg, self.work)
+        (self.work / PARAMS_FILENAME).write_text(json.dumps(params_of(self.cfg)), encoding="utf-8")
+        return f"{self.cfg.rows:,} rows"
+
+    def sort(self) -> str:
+        sort.sort_in_memory(str(self.od), str(self.sorted))
+        return f"{self.sorted.stat().st_size / 2**20:.0f} MB"
+
+    def sort_external(self) -> str:
+        chunksize = max(self.cfg.rows // 4, 10_000)
+        sort.sort_external(str(self.od), str(self.sorted_ext), chunksize=chunksize)
+        return f"runs of {chunksize:,}"
+
+    def build_within_radius(self) -> str:
+        import find_schools_within_radius as fs
+        import school_table
+
+        st_df = fs.normalise_station_df(pd.read_csv(self.stations))
+        sc_df = school_table.read_school_table(self.schools_csv, name_filter=fs.TARGET_RE)
+        out = fs.build_within_radius(st_df, sc_df, RADIUS_M)
+        out.to_csv(self.within, index=False, encoding="utf-8-sig")
+        return f"{len(out):,} pairs"
+
+    def kml(self) -> str:
+        run_script(ROOT / "get_school_loc" / "build_station_school_kml.py",
+                   ["-s", str(self.stations), "-w", str(self.within), "-o", str(self.kml_path)])
+        return f"{self.kml_path.stat().st_size / 2**20:.1f} MB"
+
+    def load_rides(self) -> str:
+        import school_celemony_prediction as scp
+
+        self.rides, self.schools = scp.load_data(self.sorted, self.within, encoding="cp932")
+        return f"{len(self.rides):,} rides"
+
+    def aggregate_daily_counts(self) -> str:
+        import school_celemony_prediction as scp
+
+        self.daily = scp.aggregate_daily_counts(self.rides)
+        return f"{len(self.daily):,} station-days"
+
+    def predict_ceremony_dates(self) -> str:
+        import school_celemony_prediction as scp
+
+        preds = scp.predict_ceremony_dates(self.daily, self.schools, window=7, multiplier=1.5,
+                                           min_count=50, guarantee=True)
+        # planted spikes (ceremonies.csv) that were found exactly
+        truth = pd.read_csv(self.work / make_synthetic.CEREMONIES_FILENAME, parse_dates=["date"])
+        got = preds.assign(station=preds["station"].astype(str)).merge(truth, on="station")
+        hits = int((got["pred_ceremony_date"] == got["date"]).sum())
+        return f"{len(preds)} stations, {hits}/{len(got)} planted spikes found"
+
+    def outputs(self, stage: str) -> List[Path]:
+        """Files a later stage reads from *stage*."""
+        return {
+            "generate": [self.od, self.stations, self.schools_csv],
+            "sort": [self.sorted],
+            "build_within_radius": [self.within],
+        }.get(stage, [])
+
+    def pair_plots(self) -> str:
+        # the cube and Parquet caches would turn the second run into a file read
+        cube = od_cube.cube_path_for(self.sorted)
+        cube.unlink(missing_ok=True)
+        cube.with_suffix(".json").unlink(missing_ok=True)
+        od_store.columnar_path_for(self.sorted).unlink(missing_ok=True)
+        run_script(ROOT / "analyze_banpaku" / "figs_nakamozu_pairs.py",
+                   ["--source", str(self.sorted), "-o", str(self.pairs_dir), "-j", "1", "--hub", self.cfg.hub])
+        return f"{len(list(self.pairs_dir.glob('*.png')))} charts"
+
+
+def with_prerequisites(stages: List[str], pipe: Pipeline) -> List[str]:
+    """*stages* plus the stages they depend on, in pipeline order.
+
+    A prerequisite that only writes a file is skipped when the file exists and
+    the data is not being regenerated.
+    """
+    selected = set(stages)
+    todo = list(stages)
+    while todo:
+        for dep in REQUIRES.get(todo.pop(), []):
+            if dep in selected:
+                continue
+            files = pipe.outputs(dep)
+            fresh = "generate" not in selected and files and all(f.exists() for f in files)
+            if dep in IN_MEMORY or not fresh:
+                selected.add(dep)
+                todo.append(dep)
+    return [s for s in STAGES if s in selected]
+
+
+def params_of(cfg: make_synthetic.SyntheticConfig) -> Dict[str, object]:
+    return asdict(cfg)
+
+
+def needs_data(cfg: make_synthetic.SyntheticConfig, work: Path) -> bool:
+    params = work / PARAMS_FILENAME
+    if not params.exists() or not (work / make_synthetic.OD_FILENAME).exists():
+        return True
+    return json.loads(params.read_text(encoding="utf-8")) != params_of(cfg)
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+
+def compare(results: List[StageResult], baseline: dict, tolerance: float) -> List[str]:
+    """Print new vs. baseline per stage; return the regressions."""
+    base = {s["stage"]: s for s in baseline.get("stages", [])}
+    regressions: List[str] = []
+    print(f"\n{'stage':<24}{'time [s]':>10}{'base':>10}{'Δ':>7}{'peak [MB]':>11}{'base':>10}{'Δ':>7}")
+    for r in results:
+        b = base.get(r.stage, {})
+        row = f"{r.stage:<24}"
+        for key, value, fmt, floor in (("seconds", r.seconds, ".3f", MIN_SECONDS_DELTA),
+                                       ("peak_mb", r.peak_mb, ".1f", MIN_MB_DELTA)):
+            old = b.get(key)
+            width = 10 if key == "seconds" else 11
+            row += f"{'-' if value is None else format(value, fmt):>{width}}{'-' if old is None else format(old, fmt):>10}"
+            if value is None or not old:
+                row += f"{'':>7}"
+                continue
+            change = (value - old) / old
+            row += f"{change:>+7.0%}"
+            if change > tolerance and value - old > floor:
+                regressions.append(f"{r.stage}: {key} {old} → {value} ({change:+.0%})")
+        print(row)
+    return regressions
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmark the OD / school pipeline on synthetic data")
+    p.add_argument("--work-dir", type=Path, default=BENCH_DIR / "data", help="Synthetic data and outputs (default: bench/data)")
+    p.add_argument("--stages", default=",".join(STAGES[1:]), help="Comma-separated stages to run (default: all but generate)")
+    p.add_argument("--regenerate", action="store_true", help="Regenerate the synthetic data even if it is up to date")
+    p.add_argument("--no-memory", dest="memory", action="store_false", help="Do not sample memory")
+    p.add_argument("--json", type=Path, default=None, help="Write results to this JSON (default: <work-dir>/results.json)")
+    p.add_argument("--baseline", type=Path, default=None, help="Compare with this results JSON")
+    p.add_argument("--save-baseline", type=Path, default=None, help="Also write the results here as the new baseline")
+    p.add_argument("--tolerance", type=float, default=0.25, help="Allowed slow-down / growth before failing (default 0.25)")
+    make_synthetic.add_config_args(p)
+    args = p.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"❌ unknown stage(s): {', '.join(unknown)}  (choose from {', '.join(STAGES)})")
+
+    cfg = make_synthetic.config_from_args(args)
+    work = args.work_dir
+    work.mkdir(parents=True, exist_ok=True)
+    if (args.regenerate or needs_data(cfg, work)) and "generate" not in stages:
+        stages.insert(0, "generate")
+    pipe = Pipeline(cfg, work)
+    requested = set(stages)
+    stages = with_prerequisites(stages, pipe)
+    added = [s for s in stages if s not in requested]
+    if added:
+        print(f"ℹ️  adding prerequisite stage(s): {', '.join(added)}")
+
+    results: List[StageResult] = []
+    for stage in stages:
+        r = measure(stage, getattr(pipe, stage), memory=args.memory)
+        results.append(r)
+        mem = f"{r.peak_mb:>9.1f} MB" if r.peak_mb is not None else ""
+        print(f"  {stage:<24}{r.seconds:>9.3f} s{mem}   {r.detail}")
+
+    report = {
+        "params": params_of(cfg),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "stages": [asdict(r) for r in results],
+    }
+    out = args.json or work / "results.json"
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8")
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8")
+        print(f"✅ baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("params") != report["params"]:
+            print("⚠️  baseline was recorded with different data parameters")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit("❌ regressions:\n  " + "\n  ".join(regressions))
+        print("✅ no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+business_calendar.py
+====================
+Weekday / holiday / closure calendar shared by the analysis scripts.
+
+Filtering OD aggregates with ``df["data_date"].apply(is_weekday_and_not_holiday)``
+calls ``jpholiday`` once per *row*, although a month of data has ~30 distinct
+dates.  Here the business-day table for a date range is built once (and
+cached), and rows are classified by looking their dates up in it:
+
+    mask = business_day_mask(daily["data_date"], closures=school_breaks)
+    daily = daily[mask]
+
+Extra closure days (school breaks, …) can be passed as dates, read from a
+text/CSV file with :func:`read_dates`, or taken from the event calendar in
+``analyze_banpaku/big_events.xlsx`` with :func:`read_event_calendar`.
+
+Usage
+-----
+    python business_calendar.py 2025-04-01 2025-05-31
+    python business_calendar.py 2025-04-01 2025-05-31 --events analyze_banpaku/big_events.xlsx
+"""
+from __future__ import annotations
+
+import argparse
+import re
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import jpholiday
+import numpy as np
+import pandas as pd
+
+import station_master
+
+# ---------------------------------------------------------------------------
+# Business-day table
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=32)
+def _holidays(start: date, end: date) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex([d for d, _ in jpholiday.between(start, end)])
+
+
+def business_days(start, end, *, closures: Optional[Iterable] = None) -> pd.Series:
+    """Boolean Series indexed by every date in [*start*, *end*]: True on
+    weekdays that are neither national holidays nor in *closures*."""
+    days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="D")
+    if days.empty:
+        return pd.Series(False, index=days, dtype=bool)
+    off = days.isin(_holidays(days[0].date(), days[-1].date())) | (days.dayofweek >= 5)
+    if closures is not None:
+        off |= days.isin(pd.DatetimeIndex(pd.to_datetime(list(closures))).normalize())
+    return pd.Series(~off, index=days, name="business_day")
+
+
+def business_day_mask(dates, *, closures: Optional[Iterable] = None) -> np.ndarray:
+    """Vectorised :func:`business_days` lookup for every value in *dates*.
+
+    Only the distinct dates are classified; missing dates map to False.
+    """
+    values = pd.DatetimeIndex(pd.to_datetime(dates)).normalize()
+    codes, uniques = pd.factorize(values)
+    if len(uniques) == 0:
+        return np.zeros(len(values), dtype=bool)
+    table = business_days(uniques.min(), uniques.max(), closures=closures)
+    flags = np.append(table.reindex(uniques).to_numpy(dtype=bool), False)
+    return flags[codes]
+
+
+def day_type(dates, *, closures: Optional[Iterable] = None) -> pd.Categorical:
+    """``"平日"`` / ``"土休日"`` label for every value in *dates*."""
+    mask = business_day_mask(dates, closures=closures)
+    return pd.Categorical.from_codes((~mask).astype(np.int8), categories=["平日", "土休日"])
+
+# ---------------------------------------------------------------------------
+# Closure / event sources
+# ---------------------------------------------------------------------------
+
+def read_dates(path: Path) -> pd.DatetimeIndex:
+    """Dates listed one per line (first CSV column; ``#`` comments allowed)."""
+    out: List[str] = []
+    for line in Path(path).read_text(encoding="utf-8-sig").splitlines():
+        field = line.split("#", 1)[0].split(",", 1)[0].strip()
+        if field:
+            out.append(field)
+    dates = pd.to_datetime(out, errors="coerce")
+    return pd.DatetimeIndex(dates[~dates.isna()]).normalize()
+
+
+_DAY_RE = re.compile(r"(?:(\d{4})\s*年)?\s*(?:(\d{1,2})\s*月)?\s*(\d{1,2})\s*日")
+_RANGE_SEPARATORS = ("～", "〜", "~", "－", "-")
+
+
+def parse_period(text: str) -> pd.DatetimeIndex:
+    """Days covered by a 開催期間 string.
+
+    Handles ``2025 年 4 月 13 日 ～ 10 月 13 日`` (range),
+    ``2025 年 4 月 24 日・26 日・27 日`` (list) and single days; year and month
+    carry over from the previous date when omitted.
+    """
+    days: List[pd.Timestamp] = []
+    year = month = None
+    prev_end = 0
+    prev: Optional[pd.Timestamp] = None
+    for m in _DAY_RE.finditer(str(text)):
+        year = int(m.group(1)) if m.group(1) else year
+        month = int(m.group(2)) if m.group(2) else month
+        if year is None or month is None:
+            continue
+        cur = pd.Timestamp(year, month, int(m.group(3)))
+        between = text[prev_end:m.start()]
+        if prev is not None and any(sep in between for sep in _RANGE_SEPARATORS):
+            days.extend(pd.date_range(prev + pd.Timedelta(days=1), cur, freq="D"))
+        else:
+            days.append(cur)
+        prev, prev_end = cur, m.end()
+    return pd.DatetimeIndex(days)
+
+
+def read_event_calendar(path: Path) -> pd.DataFrame:
+    """One row per (event, station, day) from a big_events.xlsx-style sheet.
+
+    Expects columns ``イベント名``, ``開催期間`` and ``最寄駅``; rows whose
+    最寄駅 is ``なし`` keep an empty station.
+    """
+    sheet = pd.read_excel(path)
+    recs = []
+    for _, row in sheet.iterrows():
+        station = str(row.get("最寄駅", "")).strip()
+        station = "" if station in ("なし", "nan") else station
+        for day in parse_period(row["開催期間"]):
+            recs.append({"event": row["イベント名"], "station": station, "data_date": day})
+    return pd.DataFrame(recs, columns=["event", "station", "data_date"])
+
+
+def drop_event_days(df: pd.DataFrame, events: pd.DataFrame, *, station_col: str = "station") -> pd.DataFrame:
+    """Anti-join: remove rows whose (station, data_date) has an event.
+
+    Both station columns go through :func:`station_master.canonical`, so an
+    alias in the sheet (``ドーム前``, ``OBP``, …) matches the master name.
+    """
+    keys = events.loc[events["station"] != "", ["station", "data_date"]]
+    keys = keys.assign(station=station_master.canonical(keys["station"]).astype(str)).drop_duplicates()
+    keys = keys.rename(columns={"station": station_col})
+    probe = pd.DataFrame({
+        station_col: station_master.canonical(df[station_col]).astype(str).to_numpy(),
+        "data_date": df["data_date"].to_numpy(),
+    })
+    hit = probe.merge(keys.assign(_event=True), how="left", on=[station_col, "data_date"])["_event"].notna()
+    return df[~hit.to_numpy()]
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Print the business-day calendar for a date range")
+    p.add_argument("start")
+    p.add_argument("end")
+    p.add_argument("--closures", type=Path, default=None, help="Text/CSV file with extra closure dates")
+    p.add_argument("--events", type=Path, default=None,
+                   help="Event calendar (big_events.xlsx); days of events without a station (最寄駅 なし) become closures")
+    args = p.parse_args()
+
+    closures = pd.DatetimeIndex([])
+    if args.closures:
+        closures = closures.union(read_dates(args.closures))
+    if args.events:
+        # station events (e.g. the Expo at 夢洲) only affect that station: see drop_event_days
+        events = read_event_calendar(args.events)
+        closures = closures.union(pd.DatetimeIndex(events.loc[events["station"] == "", "data_date"]))
+    table = business_days(args.start, args.end, closures=closures)
+    out = pd.DataFrame({"data_date": table.index.strftime("%Y-%m-%d"), "business_day": table.to_numpy()})
+    print(out.to_string(index=False))
+    print(f"\n{int(table.sum())} business days / {len(table)} days")
+
+
+if __name__ == "__main__":
+    main()
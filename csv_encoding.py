@@ -0,0 +1,99 @@
+"""
+csv_encoding.py
+===============
+Single-pass text-encoding detection for CSV inputs.
+
+``read_csv_with_fallback`` used to call ``pd.read_csv`` once per candidate
+encoding, re-parsing the whole file after every ``UnicodeDecodeError``.
+:func:`detect_encoding` instead looks at a bounded prefix of the raw bytes:
+
+  1. a byte-order mark decides immediately (``utf-8-sig`` / ``utf-16``);
+  2. otherwise the prefix is trial-decoded with each candidate in turn
+     (incremental decoders, so a multibyte character cut at the end of the
+     sample does not count as an error).
+
+The answer is cached per file in ``~/.cache/metro/encodings.json`` keyed by
+absolute path, mtime and size, so later runs skip detection entirely.
+Set ``METRO_CACHE_DIR`` to move the cache.
+"""
+from __future__ import annotations
+
+import codecs
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+CANDIDATES = ("utf-8", "cp932", "shift_jis", "latin1")
+SAMPLE_BYTES = 1 << 20  # 1 MiB
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def cache_path() -> Path:
+    base = os.environ.get("METRO_CACHE_DIR") or Path.home() / ".cache" / "metro"
+    return Path(base) / "encodings.json"
+
+# ---------------------------------------------------------------------------
+# Detection
+# ---------------------------------------------------------------------------
+
+def sniff_encoding(sample: bytes, candidates: Sequence[str] = CANDIDATES) -> str:
+    """Return the first encoding in *candidates* that decodes *sample*."""
+    for bom, name in BOMS:
+        if sample.startswith(bom):
+            return name
+    for enc in candidates:
+        try:
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        return enc
+    return "latin1"
+
+
+def _stamp(path: Path) -> list:
+    st = path.stat()
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _load_cache() -> Dict[str, dict]:
+    try:
+        return json.loads(cache_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def remember_encoding(path: Path, encoding: str) -> None:
+    """Record *encoding* for *path* (e.g. after a fallback found the real one)."""
+    path = Path(path).resolve()
+    cache = {k: v for k, v in _load_cache().items() if Path(k).exists()}
+    cache[str(path)] = {"stamp": _stamp(path), "encoding": encoding}
+    target = cache_path()
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(cache, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(target)
+    except OSError:
+        pass  # caching is best-effort; detection still works without it
+
+
+def detect_encoding(path: Path, *, sample_bytes: int = SAMPLE_BYTES, use_cache: bool = True) -> str:
+    """Guess the encoding of the file at *path* from its first *sample_bytes*."""
+    path = Path(path).resolve()
+    if use_cache:
+        hit: Optional[dict] = _load_cache().get(str(path))
+        if hit and hit.get("stamp") == _stamp(path):
+            return hit["encoding"]
+
+    with open(path, "rb") as f:
+        sample = f.read(sample_bytes)
+    encoding = sniff_encoding(sample)
+    if use_cache:
+        remember_encoding(path, encoding)
+    return encoding
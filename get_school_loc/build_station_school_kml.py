@@ -6,16 +6,41 @@ Generate a KML that combines
   • station placemarks
   • 800‑m radius circles around each station
   • school placemarks that fall inside each circle
+
+With a multi-radius table from ``find_schools_within_radius.py --radii``
+(``radius_m`` column) one ring per radius is drawn around every station from
+that same file; ``--radii`` picks the rings explicitly.
+
+The document is streamed to disk by ``kml_stream.KmlWriter`` (shared styles,
+one pass over the stations, schools grouped by station once); an output name
+ending in ``.kmz`` gives a compressed KMZ.
+
+``--tiles`` splits large maps into ``--tile-deg`` grid tiles with KML
+``<Region>``/``<Lod>``: far out only a label-less station layer is drawn,
+and each tile's stations, rings and schools are fetched through a
+NetworkLink once the tile covers ``--lod-pixels`` on screen.  With a ``.kml``
+name the tiles go to ``<name>_tiles/`` next to it; with ``.kmz`` everything is
+packed into the one archive.  ``--export`` also writes the same features as
+GeoJSON or FlatGeobuf (``geo_export.py``).
 """
 from __future__ import annotations
 
 import argparse
-import math
-import pandas as pd
-import simplekml
+import contextlib
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Callable
+
 import numpy as np
+import pandas as pd
+
+import geo_export
+import geodesy
+import kml_stream
 
-EARTH_RADIUS_M = 6371000.0  # WGS‑84 mean radius
+STATION_ICON = "https://maps.google.com/mapfiles/kml/paddle/blu-circle-lv.png"
+SCHOOL_ICON = "https://maps.google.com/mapfiles/kml/paddle/red-circle-lv.png"
 
 
 # ---------------------------------------------------------------------------
@@ -24,21 +49,110 @@ EARTH_RADIUS_M = 6371000.0  # WGS‑84 mean radius
 
 def destination_point(lat: float, lon: float, bearing_deg: float, distance_m: float) -> tuple[float, float]:
     """Return lat,lon reached by moving *distance_m* at *bearing_deg* from (lat,lon)."""
-    bearing = math.radians(bearing_deg)
-    lat1 = math.radians(lat)
-    lon1 = math.radians(lon)
-    ang_dist = distance_m / EARTH_RADIUS_M
-    lat2 = math.asin(math.sin(lat1) * math.cos(ang_dist) + math.cos(lat1) * math.sin(ang_dist) * math.cos(bearing))
-    lon2 = lon1 + math.atan2(math.sin(bearing) * math.sin(ang_dist) * math.cos(lat1),
-                             math.cos(ang_dist) - math.sin(lat1) * math.sin(lat2))
-    return math.degrees(lat2), math.degrees(lon2)
+    lat2, lon2 = geodesy.destination_points(lat, lon, bearing_deg, distance_m)
+    return float(lat2), float(lon2)
 
 
 def build_circle(lat: float, lon: float, radius_m: float, segments: int = 36) -> list[tuple[float, float]]:
     """円を構成する座標のリストを返す。始点と終点を一致させて円を閉じる。"""
-    points = [destination_point(lat, lon, b, radius_m)[::-1] for b in np.linspace(0, 360, segments, endpoint=True)]
-    # endpoint=Trueにすることで、始点と終点が同じになり円が閉じる
-    return points
+    ring = geodesy.rings([lat], [lon], [radius_m], segments)[0, 0]
+    return [tuple(p) for p in ring.tolist()]
+
+def declare_styles(kw: kml_stream.KmlWriter, n_radii: int) -> None:
+    """スタイルは文書の先頭で1回だけ定義し，各ピン・円からは参照する。"""
+    # 駅のピン
+    kw.icon_style("station", STATION_ICON, scale=0.1)
+    # 学校のピン
+    kw.icon_style("school", SCHOOL_ICON, scale=0.1)
+    # 複数の円は薄めにして，重なりで内側ほど濃く見えるようにする
+    kw.poly_style("ring", kml_stream.kml_color(60 if n_radii == 1 else 40, "0000ff"))
+
+# ---------------------------------------------------------------------------
+# Region / Lod tiling
+# ---------------------------------------------------------------------------
+
+def tile_index(lat: np.ndarray, lon: np.ndarray, tile_deg: float) -> dict[tuple[int, int], np.ndarray]:
+    """(row, col) → 駅の行番号。tile_deg 度四方の格子で駅を分ける。"""
+    rows = np.floor(lat / tile_deg).astype(int)
+    cols = np.floor(lon / tile_deg).astype(int)
+    keys = pd.MultiIndex.from_arrays([rows, cols])
+    return pd.Series(np.arange(len(lat))).groupby(keys, sort=True).indices
+
+
+def write_tiled(
+    outfile: Path,
+    add_station: Callable[[kml_stream.KmlWriter, int, np.ndarray], None],
+    st_names: list[str],
+    st_lat: np.ndarray,
+    st_lon: np.ndarray,
+    school_bounds: np.ndarray,
+    radii: list[float],
+    *,
+    segments: int,
+    tile_deg: float,
+    lod_pixels: int,
+) -> tuple[int, int]:
+    """Region/Lod で分割した KML を書き出し，(タイル数, ピン・円の総数) を返す。
+
+    ルート文書には
+      • タイルごとの簡易駅レイヤ（ラベルなし，Region が lod_pixels 未満の遠景で表示）
+      • タイルごとの NetworkLink（Region が lod_pixels 以上になったら
+        tiles/<row>_<col>.kml の駅・円・学校を読み込む）
+    を置く。出力名が .kmz ならルートを doc.kml とし，タイルごと1つの KMZ にまとめる。
+    """
+    kmz = outfile.suffix.lower() == ".kmz"
+    # KMZ の中身は一時ディレクトリに書いてから1つの ZIP にまとめる（例外時も削除する）
+    with (tempfile.TemporaryDirectory() if kmz else contextlib.nullcontext()) as tmp:
+        if kmz:
+            root_path = Path(tmp) / "doc.kml"
+            tile_dir, tile_href = Path(tmp) / "tiles", "tiles"
+        else:
+            root_path = outfile
+            tile_dir = outfile.with_name(f"{outfile.stem}_tiles")
+            tile_href = tile_dir.name
+        tile_dir.mkdir(parents=True, exist_ok=True)
+
+        tiles = tile_index(st_lat, st_lon, tile_deg)
+        extents: dict[tuple[int, int], tuple[float, float, float, float]] = {}
+        placemarks = 0
+        for (row, col), idx in tiles.items():
+            rings = geodesy.rings(st_lat[idx], st_lon[idx], radii, segments)
+            # 外側の円と圏内の学校をすべて含む範囲（school_bounds: 緯度 min/max, 経度 min/max）
+            lats = np.concatenate([rings[..., 1].ravel(), school_bounds[idx, :2].ravel()])
+            lons = np.concatenate([rings[..., 0].ravel(), school_bounds[idx, 2:].ravel()])
+            extents[row, col] = (float(np.nanmin(lats)), float(np.nanmin(lons)), float(np.nanmax(lats)), float(np.nanmax(lons)))
+
+            with kml_stream.KmlWriter(tile_dir / f"{row}_{col}.kml", name=f"tile {row}_{col}") as kw:
+                declare_styles(kw, len(radii))
+                for n, i in enumerate(idx):
+                    add_station(kw, i, rings[n])
+            placemarks += kw.placemarks
+
+        with kml_stream.KmlWriter(root_path, name=outfile.stem) as kw:
+            kw.icon_style("station_far", STATION_ICON, scale=0.1, label_scale=0)
+
+            kw.begin_folder("Stations (overview)")
+            for key, idx in tiles.items():
+                kw.begin_folder(f"tile {key[0]}_{key[1]}",
+                                extra=kml_stream.region(*extents[key], min_lod=0, max_lod=lod_pixels))
+                for i in idx:
+                    kw.point(st_names[i], st_lon[i], st_lat[i], style="station_far")
+                kw.end_folder()
+            kw.end_folder()
+
+            kw.begin_folder("Stations, rings and schools")
+            for key in tiles:
+                kw.network_link(f"tile {key[0]}_{key[1]}", f"{tile_href}/{key[0]}_{key[1]}.kml",
+                                region=kml_stream.region(*extents[key], min_lod=lod_pixels))
+            kw.end_folder()
+        placemarks += kw.placemarks
+
+        if kmz:
+            with zipfile.ZipFile(outfile, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                zf.write(root_path, "doc.kml")
+                for key in tiles:
+                    zf.write(tile_dir / f"{key[0]}_{key[1]}.kml", f"{tile_href}/{key[0]}_{key[1]}.kml")
+    return len(tiles), placemarks
 
 # ---------------------------------------------------------------------------
 # Main
@@ -48,9 +162,19 @@ def main() -> None:
     ap = argparse.ArgumentParser(description="Create KML with station circles and schools")
     ap.add_argument("-s", "--stations", default="station_coordinates_157.csv", help="CSV with station coordinates")
     ap.add_argument("-w", "--within", default="schools_within_800m.csv", help="CSV output from find_schools_within_radius.py")
-    ap.add_argument("-o", "--outfile",  default="stations_schools_800m.kml", help="Output KML filename")
+    ap.add_argument("-o", "--outfile",  default="stations_schools_800m.kml", help="Output KML filename (.kmz for compressed)")
     ap.add_argument("-r", "--radius",   type=float, default=800.0, help="Circle radius in metres (default 800)")
+    ap.add_argument("--radii", default=None, help="Comma-separated ring radii (default: radius_m values in --within, else --radius)")
+    ap.add_argument("--segments", type=int, default=36, help="Segments per ring (default 36; e.g. 360 for smooth circles)")
+    ap.add_argument("--tiles", action="store_true", help="Split into Region/Lod tiles loaded on zoom (NetworkLinks)")
+    ap.add_argument("--tile-deg", type=float, default=0.1, help="Tile size in degrees for --tiles (default 0.1)")
+    ap.add_argument("--lod-pixels", type=int, default=128,
+                    help="On-screen tile size (px) at which rings and schools load for --tiles (default 128)")
+    ap.add_argument("--export", action="append", default=[],
+                    help="Also write stations, rings and schools to this .geojson / .fgb (repeatable)")
     args = ap.parse_args()
+    for path in args.export:
+        geo_export.export_format(path)  # fail before any work on a bad suffix
 
     try:
         st_df = pd.read_csv(args.stations)
@@ -85,55 +209,71 @@ def main() -> None:
         return
     # --- 自動判定ここまで ---
 
-    kml = simplekml.Kml()
-
-    # スタイルの事前定義
-    # ★駅のピンを見やすいアイコンに変更
-    # station_style = simplekml.Style()
-    # station_style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/red-circle.png'
-    # station_style.iconstyle.scale = 1.2 # アイコンサイズを少し大きくする
-
-    # # ★学校用のピンのスタイルを定義
-    # school_style = simplekml.Style()
-    # school_style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/paddle/ylw-blank.png'
-    # school_style.iconstyle.scale = 0.8 # アイコンサイズを少し小さくする
-
-    # 駅のピンを「赤い点」に
-    station_style = simplekml.Style()
-    station_style.iconstyle.icon.href = 'https://maps.google.com/mapfiles/kml/paddle/blu-circle-lv.png'
-    station_style.iconstyle.scale = 0.1
-
-    # 学校のピンを「青い点」に
-    school_style = simplekml.Style()
-    school_style.iconstyle.icon.href = 'https://maps.google.com/mapfiles/kml/paddle/red-circle-lv.png'
-    school_style.iconstyle.scale = 0.1
-
-    poly_style = simplekml.Style()
-    poly_style.polystyle.color = simplekml.Color.changealphaint(60, simplekml.Color.blue)
-
-    for _, row in st_df.iterrows():
-        st_name = str(row[st_col])
-        lat = float(row[lat_col])
-        lon = float(row[lon_col])
-
-        # 駅のピンをKMLに直接追加
-        pnt = kml.newpoint(name=st_name, coords=[(lon, lat)])
-        pnt.style = station_style
-
-        # 円をKMLに直接追加
-        circle_coords = build_circle(lat, lon, args.radius)
-        pol = kml.newpolygon(name=f"{st_name} {int(args.radius)}m radius", outerboundaryis=circle_coords)
-        pol.style = poly_style
-
-        # ★学校のピンを表示する処理を復元
-        subset = sc_df[sc_df[sc_col] == st_name]
-        for _, sc in subset.iterrows():
-            p_school = kml.newpoint(name=sc["school"], coords=[(sc["school_lon"], sc["school_lat"])])
-            p_school.description = f"{sc['distance_m']} m from {st_name}"
-            p_school.style = school_style
-
-    kml.save(args.outfile)
-    print(f"✅ KML written to {args.outfile}")
+    # 描画する円の半径（複数半径の表なら radius_m 列の値をすべて使う）
+    if args.radii:
+        radii = sorted({float(r) for r in args.radii.split(",") if r.strip()})
+    elif "radius_m" in sc_df.columns and not sc_df.empty:
+        radii = sorted(sc_df["radius_m"].astype(float).unique())
+    else:
+        radii = [args.radius]
+    if "radius_m" in sc_df.columns:
+        sc_df = sc_df[sc_df["radius_m"] <= radii[-1]]
+
+    # 駅ごとの学校の行番号を一度だけ求める（駅ごとに全件を絞り込まない）
+    sc_key = sc_df[sc_col].astype(str)
+    school_rows = sc_df.groupby(sc_key, sort=False).indices
+    sc_name = sc_df["school"].astype(str).tolist()
+    sc_lon = sc_df["school_lon"].tolist()
+    sc_lat = sc_df["school_lat"].tolist()
+    sc_dist = sc_df["distance_m"].tolist()
+    sc_band = sc_df["radius_m"].tolist() if "radius_m" in sc_df.columns else None
+
+    st_names = st_df[st_col].astype(str).tolist()
+    st_lat = st_df[lat_col].to_numpy(dtype=float)
+    st_lon = st_df[lon_col].to_numpy(dtype=float)
+
+    def add_station(kw: kml_stream.KmlWriter, i: int, st_rings) -> None:
+        """駅 i のピン・円（st_rings: 半径, 点, (lon, lat)）・圏内の学校を書き出す。"""
+        st_name = st_names[i]
+        kw.point(st_name, st_lon[i], st_lat[i], style="station")
+
+        # 外側の円から順に
+        for k in reversed(range(len(radii))):
+            kw.polygon(f"{st_name} {int(radii[k])}m radius", st_rings[k], style="ring")
+
+        for j in school_rows.get(st_name, ()):
+            desc = f"{sc_dist[j]} m from {st_name}"
+            if sc_band is not None:
+                desc += f" (within {int(sc_band[j])} m)"
+            kw.point(sc_name[j], sc_lon[j], sc_lat[j], style="school", description=desc)
+
+    # KML と同じ駅・円・学校を GeoJSON / FlatGeobuf にも書き出す
+    for path in args.export:
+        n = geo_export.export(Path(path), geo_export.station_features(
+            st_names, st_lat, st_lon, sc_df, radii, station_col=sc_col, segments=args.segments,
+        ))
+        print(f"✅ {n} features written to {path}")
+
+    if args.tiles:
+        # 駅ごとの学校の範囲（タイルの Region を円の外側まで広げるため）
+        bounds = (sc_df.groupby(sc_key)[["school_lat", "school_lon"]].agg(["min", "max"])
+                  .reindex(st_names).to_numpy(dtype=float))
+        n_tiles, n_marks = write_tiled(
+            Path(args.outfile), add_station, st_names, st_lat, st_lon, bounds, radii,
+            segments=args.segments, tile_deg=args.tile_deg, lod_pixels=args.lod_pixels,
+        )
+        print(f"✅ tiled {'KMZ' if Path(args.outfile).suffix.lower() == '.kmz' else 'KML'} written to "
+              f"{args.outfile} ({n_tiles} tiles, {n_marks} placemarks)")
+        return
+
+    with kml_stream.KmlWriter(args.outfile) as kw:
+        declare_styles(kw, len(radii))
+
+        # 円は geodesy.RING_CHUNK 駅ずつ計算（shape: 半径, 点, (lon, lat)）してメモリを一定に保つ
+        for i, st_rings in geodesy.iter_rings(st_lat, st_lon, radii, args.segments):
+            add_station(kw, i, st_rings)
+
+    print(f"✅ {'KMZ' if kw.kmz else 'KML'} written to {args.outfile} ({kw.placemarks} placemarks)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
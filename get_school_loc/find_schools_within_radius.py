@@ -14,22 +14,49 @@ Strategy
 --------
 * **Live mode:** Overpass query filters `amenity=school` and
   `name~"中学校|高等学校"`.  The name check is repeated locally to be safe.
-* **Offline mode:** Loaded CSV rows are filtered with the same regex.
+  Stations are grouped into ``--tile-deg`` tiles and each tile is fetched
+  with one bounding-box query (a few requests instead of one per station);
+  schools are then matched to stations locally, exactly as in offline mode.
+  ``--per-station`` keeps the old one-``around``-query-per-station loop and
+  ``--overpass-url`` points either at a mirror or a local stand-in server.
+  Replies go through the shared SQLite cache in ``overpass_cache.py``
+  (``--offline`` answers from it only, ``--no-cache`` bypasses it).
+* **Offline mode:** Loaded CSV rows are filtered with the same regex.  The
+  table may have name/lat/lon columns or WKT ``POINT`` geometry (e.g.
+  ``school_loc.csv``); see ``school_table.py``.
 * **Common helper `is_target_name()`** centralises the rule.
+* **Multi-radius mode** (``--radii 400,800,1200``): distances are computed
+  once up to the largest radius and each pair is tagged with the smallest
+  requested radius that contains it (``radius_m``), so every catchment is a
+  filter on one table.
+* **GIS export** (``--export out.geojson`` / ``out.fgb``): stations,
+  catchment rings and schools for web maps; see ``geo_export.py``.
+
+Usage
+-----
+    python find_schools_within_radius.py -r 800
+    python find_schools_within_radius.py --radii 400,800,1200            # one long table
+    python find_schools_within_radius.py --radii 400,800,1200 --split    # one CSV per radius
+    python find_schools_within_radius.py -c school_loc.csv                # WKT export
+    python find_schools_within_radius.py --radii 400,800 --export catchments.fgb
+    python find_schools_within_radius.py --live --overpass-url http://localhost:8000/api/interpreter
 """
 from __future__ import annotations
 
 import argparse
 import math
 import re
-import sys
 import time
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
-import requests
+
+import geo_export
+import overpass_cache
+import school_table
+import spatial_index
 
 EARTH_RADIUS_M = 6_371_000.0  # metres, WGS‑84 mean radius
 OVERPASS_URL = "https://overpass-api.de/api/interpreter"
@@ -94,29 +121,27 @@ def haversine_np(lat1: float, lon1: float, lats2: np.ndarray, lons2: np.ndarray)
 # Overpass helpers
 # ---------------------------------------------------------------------------
 
-def _run_overpass(query: str) -> dict:
-    """Execute raw Overpass QL query and return parsed JSON."""
+def _run_overpass_status(
+    query: str,
+    url: str = OVERPASS_URL,
+    cache: Optional[overpass_cache.OverpassCache] = None,
+) -> Tuple[dict, bool]:
+    """Execute raw Overpass QL query (through *cache*); (parsed JSON, served from cache)."""
     try:
-        resp = requests.post(OVERPASS_URL, data=query.encode("utf-8"), timeout=90)
-        resp.raise_for_status()
-        return resp.json()
-    except requests.RequestException as e:
-        print(f"⚠️  Overpass error: {e}", file=sys.stderr)
-        return {"elements": []}
-
+        return overpass_cache.fetch_with_status(query, url=url, cache=cache)
+    except overpass_cache.OverpassError as e:
+        # an empty reply would silently drop schools from the output
+        raise SystemExit(f"❌ {e}")
 
-def fetch_schools_live(lat: float, lon: float, radius: float) -> List[Dict[str, float]]:
-    """Query Overpass for *target* schools within *radius* of (lat, lon)."""
 
-    query = f"""
-[out:json][timeout:60];
-// Only amenity=school and name contains 中学校 or 高等学校
-nwr["amenity"="school"]["name"~"中学校|高等学校"](around:{int(radius)},{lat},{lon});
-out center;"""
+def _run_overpass(query: str, url: str = OVERPASS_URL, cache: Optional[overpass_cache.OverpassCache] = None) -> dict:
+    """Execute raw Overpass QL query (through *cache*) and return parsed JSON."""
+    return _run_overpass_status(query, url, cache)[0]
 
-    js = _run_overpass(query)
 
-    results: List[Dict[str, float]] = []
+def parse_school_elements(js: dict) -> List[Dict[str, object]]:
+    """Target schools (name, lat, lon, osm key) from an Overpass ``out center`` reply."""
+    results: List[Dict[str, object]] = []
     for el in js.get("elements", []):
         name = el.get("tags", {}).get("name")
         if not is_target_name(name):
@@ -130,43 +155,166 @@ out center;"""
                 continue
             lat_s, lon_s = center["lat"], center["lon"]
 
-        results.append({"name": name, "lat": lat_s, "lon": lon_s})
+        results.append({"name": name, "lat": lat_s, "lon": lon_s, "osm": f"{el['type']}/{el.get('id')}"})
 
     return results
 
+
+def around_query(lat: float, lon: float, radius: float) -> str:
+    """Overpass QL for *target* schools within *radius* of (lat, lon)."""
+    return f"""
+[out:json][timeout:60];
+// Only amenity=school and name contains 中学校 or 高等学校
+nwr["amenity"="school"]["name"~"中学校|高等学校"](around:{int(radius)},{lat},{lon});
+out center;"""
+
+
+def fetch_schools_live(
+    lat: float,
+    lon: float,
+    radius: float,
+    *,
+    url: str = OVERPASS_URL,
+    cache: Optional[overpass_cache.OverpassCache] = None,
+) -> List[Dict[str, float]]:
+    """Query Overpass for *target* schools within *radius* of (lat, lon)."""
+    return parse_school_elements(_run_overpass(around_query(lat, lon, radius), url, cache))
+
+# ---------------------------------------------------------------------------
+# Batched live mode
+# ---------------------------------------------------------------------------
+
+def station_tiles(st_df: pd.DataFrame, radius: float, tile_deg: float) -> List[Tuple[float, float, float, float]]:
+    """(south, west, north, east) boxes covering every station's *radius* circle.
+
+    Stations are grouped by a *tile_deg* grid; each occupied cell yields the
+    bounding box of its stations padded by *radius* (plus a small margin), so
+    a handful of queries replaces one query per station.
+    """
+    lat = st_df["lat"].to_numpy(dtype=float)
+    lon = st_df["lon"].to_numpy(dtype=float)
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon = lat[ok], lon[ok]
+    if not len(lat):
+        return []
+
+    pad_lat = np.degrees(radius * 1.1 / EARTH_RADIUS_M)
+    cells = pd.DataFrame({
+        "lat": lat,
+        "lon": lon,
+        "cy": np.floor(lat / tile_deg).astype(int),
+        "cx": np.floor(lon / tile_deg).astype(int),
+    })
+    tiles = []
+    for _, g in cells.groupby(["cy", "cx"], sort=True):
+        south, north = g["lat"].min() - pad_lat, g["lat"].max() + pad_lat
+        pad_lon = pad_lat / max(math.cos(math.radians(max(abs(south), abs(north)))), 1e-6)
+        tiles.append((
+            round(max(south, -90.0), 6),
+            round(g["lon"].min() - pad_lon, 6),
+            round(min(north, 90.0), 6),
+            round(g["lon"].max() + pad_lon, 6),
+        ))
+    return tiles
+
+
+def fetch_schools_batched(
+    st_df: pd.DataFrame,
+    radius: float,
+    *,
+    url: str = OVERPASS_URL,
+    tile_deg: float = 0.25,
+    delay: float = 1.0,
+    cache: Optional[overpass_cache.OverpassCache] = None,
+) -> pd.DataFrame:
+    """All target schools near any station, fetched in bounding-box tiles.
+
+    Returns name, lat, lon (one row per OSM element, de-duplicated across
+    overlapping tiles); matching against stations is left to
+    :func:`build_within_radii`.
+    """
+    tiles = station_tiles(st_df, radius, tile_deg)
+    rows: List[Dict[str, object]] = []
+    for i, (south, west, north, east) in enumerate(tiles):
+        query = f"""
+[out:json][timeout:180];
+// Only amenity=school and name contains 中学校 or 高等学校
+nwr["amenity"="school"]["name"~"中学校|高等学校"]({south},{west},{north},{east});
+out center;"""
+        js, cached = _run_overpass_status(query, url, cache)
+        found = parse_school_elements(js)
+        rows.extend(found)
+        print(f"  · tile {i + 1}/{len(tiles)} ({south},{west},{north},{east}) – {len(found)} schools ✓"
+              + (" (cached)" if cached else ""))
+        if i < len(tiles) - 1 and not cached:
+            time.sleep(delay)
+
+    df = pd.DataFrame(rows, columns=["name", "lat", "lon", "osm"])
+    return df.drop_duplicates("osm").drop(columns="osm").reset_index(drop=True)
+
 # ---------------------------------------------------------------------------
 # Distance assembly helpers
 # ---------------------------------------------------------------------------
 
-def build_within_radius(st_df: pd.DataFrame, sc_df: pd.DataFrame, radius: float) -> pd.DataFrame:
-    """Return DataFrame of schools within *radius* metres of each station."""
-    records: List[pd.DataFrame] = []
-    sc_lats = sc_df["lat"].to_numpy()
-    sc_lons = sc_df["lon"].to_numpy()
-
-    for _, st in st_df.iterrows():
-        dists = haversine_np(st["lat"], st["lon"], sc_lats, sc_lons)
-        mask = dists <= radius
-        if not np.any(mask):
-            continue
-        subset = sc_df[mask].copy()
-        subset["distance_m"] = dists[mask].round(1)
-        subset["station"] = st["station"]
-        records.append(subset[["station", "name", "distance_m", "lat", "lon"]])
-
-    if not records:
-        return pd.DataFrame(
-            columns=["station", "school", "distance_m", "school_lat", "school_lon"]
-        )
+OUT_COLUMNS = ["station", "school", "distance_m", "school_lat", "school_lon"]
+
 
-    df_out = pd.concat(records, ignore_index=True)
-    df_out.rename(
-        columns={"name": "school", "lat": "school_lat", "lon": "school_lon"},
-        inplace=True,
+def parse_radii(text: str) -> List[float]:
+    """``"400,800,1200"`` → ``[400.0, 800.0, 1200.0]`` (sorted, unique)."""
+    try:
+        radii = sorted({float(r) for r in text.split(",") if r.strip()})
+    except ValueError:
+        raise SystemExit(f"❌ --radii must be comma-separated metres, got {text!r}")
+    if not radii or radii[0] <= 0:
+        raise SystemExit(f"❌ --radii must list positive radii, got {text!r}")
+    return radii
+
+
+def radius_band(dists: np.ndarray, radii: Sequence[float]) -> np.ndarray:
+    """Smallest radius in sorted *radii* that contains each distance."""
+    radii = np.asarray(radii, dtype=float)
+    return radii[np.searchsorted(radii, dists, side="left")]
+
+
+def build_within_radii(st_df: pd.DataFrame, sc_df: pd.DataFrame, radii: Sequence[float]) -> pd.DataFrame:
+    """Schools within ``max(radii)`` of each station, tagged with ``radius_m``.
+
+    Candidate pairs come from a grid index (``spatial_index.py``); exact
+    haversine distances are computed only for those, in a single pass for
+    all radii.  ``radius_m`` is the smallest of *radii* the school lies in.
+    """
+    radii = sorted(radii)
+    st_idx, sc_idx, dists = spatial_index.pairs_within(
+        st_df["lat"].to_numpy(dtype=float),
+        st_df["lon"].to_numpy(dtype=float),
+        sc_df["lat"].to_numpy(dtype=float),
+        sc_df["lon"].to_numpy(dtype=float),
+        radii[-1],
     )
+    if not len(st_idx):
+        return pd.DataFrame(columns=OUT_COLUMNS + ["radius_m"])
+
+    df_out = pd.DataFrame({
+        "station": st_df["station"].to_numpy()[st_idx],
+        "school": sc_df["name"].to_numpy()[sc_idx],
+        "distance_m": dists.round(1),
+        "school_lat": sc_df["lat"].to_numpy()[sc_idx],
+        "school_lon": sc_df["lon"].to_numpy()[sc_idx],
+        "radius_m": radius_band(dists, radii),
+    })
     df_out.sort_values(["station", "distance_m"], inplace=True)
     return df_out
 
+
+def build_within_radius(st_df: pd.DataFrame, sc_df: pd.DataFrame, radius: float) -> pd.DataFrame:
+    """Return DataFrame of schools within *radius* metres of each station."""
+    return build_within_radii(st_df, sc_df, [radius])[OUT_COLUMNS]
+
+
+def within(df_out: pd.DataFrame, radius: float) -> pd.DataFrame:
+    """Rows of a multi-radius table that fall inside *radius* (single-radius layout)."""
+    return df_out.loc[df_out["radius_m"] <= radius, OUT_COLUMNS]
+
 # ---------------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------------
@@ -178,10 +326,21 @@ def main() -> None:
     p.add_argument("-s", "--stations", default="station_coordinates_157.csv", help="CSV with station coordinates")
     p.add_argument("-c", "--schools",  default="school_coordinates_kansai.csv", help="CSV with school coordinates (offline mode)")
     p.add_argument("-r", "--radius",   type=float, default=800.0, help="Radius in metres (default 800)")
+    p.add_argument("--radii", default=None, help="Comma-separated radii, e.g. 400,800,1200 (one distance pass; overrides --radius)")
+    p.add_argument("--split", action="store_true", help="With --radii: write one CSV per radius (schools_within_<r>m.csv, or <stem>_<r>m.csv next to -o)")
     p.add_argument("-o", "--outfile",  default=None, help="Output CSV filename")
     p.add_argument("--live", action="store_true", help="Fetch schools on‑the‑fly via Overpass (ignore --schools)")
     p.add_argument("-d", "--delay", type=float, default=1.0, help="Delay between Overpass calls in live mode (s)")
+    p.add_argument("--overpass-url", default=OVERPASS_URL, help="Overpass interpreter endpoint (e.g. a local mirror)")
+    p.add_argument("--tile-deg", type=float, default=0.25, help="Live mode: stations are queried in tiles of this many degrees")
+    p.add_argument("--per-station", action="store_true", help="Live mode: one around-query per station (old behaviour)")
+    p.add_argument("--export", type=Path, action="append", default=[],
+                   help="Also write stations, catchment rings and schools to this .geojson / .fgb (repeatable)")
+    p.add_argument("--segments", type=int, default=36, help="Segments per catchment ring for --export (default 36)")
+    overpass_cache.add_cache_args(p)
     args = p.parse_args()
+    for path in args.export:
+        geo_export.export_format(path)  # fail before any work on a bad suffix
 
     # -------------------------------------------------------------------
     # Load stations CSV & normalise
@@ -195,36 +354,49 @@ def main() -> None:
         raise SystemExit(f"❌ failed to read station CSV: {e}")
 
     st_df = normalise_station_df(st_df_raw)
+    radii = parse_radii(args.radii) if args.radii else [args.radius]
+    max_radius = radii[-1]
 
     # -------------------------------------------------------------------
     # Live mode
     # -------------------------------------------------------------------
     if args.live or not Path(args.schools).exists():
         print("🛰  Live Overpass mode – this may take a few minutes…")
-        rows: List[Dict[str, object]] = []
-        for idx, st in st_df.iterrows():
-            schools = fetch_schools_live(float(st["lat"]), float(st["lon"]), args.radius)
-            for sc in schools:
-                dist = haversine_np(
-                    st["lat"],
-                    st["lon"],
-                    np.array([sc["lat"]]),
-                    np.array([sc["lon"]]),
-                )[0]
-                if dist <= args.radius:
-                    rows.append({
+        cache = overpass_cache.cache_from_args(args)
+        if not args.per_station:
+            sc_df = fetch_schools_batched(
+                st_df, max_radius, url=args.overpass_url, tile_deg=args.tile_deg, delay=args.delay, cache=cache
+            )
+            df_out = build_within_radii(st_df, sc_df, radii)
+        else:
+            rows: List[Dict[str, object]] = []
+            for idx, st in st_df.iterrows():
+                js, cached = _run_overpass_status(
+                    around_query(float(st["lat"]), float(st["lon"]), max_radius), args.overpass_url, cache
+                )
+                schools = parse_school_elements(js)
+                if schools:
+                    sc = pd.DataFrame(schools)
+                    dist = haversine_np(st["lat"], st["lon"], sc["lat"].to_numpy(), sc["lon"].to_numpy())
+                    keep = dist <= max_radius
+                    rows.extend({
                         "station": st["station"],
-                        "school": sc["name"],
-                        "distance_m": round(dist, 1),
-                        "school_lat": sc["lat"],
-                        "school_lon": sc["lon"],
-                    })
-            print(f"  · {idx + 1}/{len(st_df)} {st['station']} – {len(schools)} schools ✓")
-            if idx < len(st_df) - 1:
-                time.sleep(args.delay)
-
-        df_out = pd.DataFrame(rows)
-        df_out.sort_values(["station", "distance_m"], inplace=True)
+                        "school": name,
+                        "distance_m": round(d, 1),
+                        "school_lat": lat_s,
+                        "school_lon": lon_s,
+                        "radius_m": band,
+                    } for name, d, lat_s, lon_s, band in zip(
+                        sc["name"][keep], dist[keep], sc["lat"][keep], sc["lon"][keep],
+                        radius_band(dist[keep], radii),
+                    ))
+                print(f"  · {idx + 1}/{len(st_df)} {st['station']} – {len(schools)} schools ✓"
+                      + (" (cached)" if cached else ""))
+                if idx < len(st_df) - 1 and not cached:
+                    time.sleep(args.delay)
+
+            df_out = pd.DataFrame(rows, columns=OUT_COLUMNS + ["radius_m"])
+            df_out.sort_values(["station", "distance_m"], inplace=True)
 
     # -------------------------------------------------------------------
     # Offline mode
@@ -232,29 +404,41 @@ def main() -> None:
     else:
         sc_path = Path(args.schools)
         try:
-            sc_df_raw = pd.read_csv(sc_path)
+            sc_df = school_table.read_school_table(sc_path, name_filter=TARGET_RE)
         except Exception as e:
             raise SystemExit(f"❌ failed to read school CSV: {e}")
 
-        try:
-            sc_df = sc_df_raw.rename(columns={
-                "latitude": "lat", "Latitude": "lat", "緯度": "lat",
-                "longitude": "lon", "Longitude": "lon", "経度": "lon",
-            })[["name", "lat", "lon"]].dropna()
-        except KeyError as e:
-            raise SystemExit(
-                "❌ school CSV must contain columns for name, lat, lon. "
-                f"Missing {e}."
-            )
-
-        df_out = build_within_radius(st_df, sc_df, args.radius)
+        df_out = build_within_radii(st_df, sc_df, radii)
 
     # -------------------------------------------------------------------
     # Save results
     # -------------------------------------------------------------------
-    out_path = args.outfile or f"schools_within_{int(args.radius)}m.csv"
-    df_out.to_csv(out_path, index=False, encoding="utf-8-sig")
-    print(f"✅ {len(df_out)} pairs written to {out_path} (radius {args.radius} m)")
+    if not args.radii:
+        out_path = args.outfile or f"schools_within_{int(args.radius)}m.csv"
+        df_out = df_out[OUT_COLUMNS]
+        df_out.to_csv(out_path, index=False, encoding="utf-8-sig")
+        print(f"✅ {len(df_out)} pairs written to {out_path} (radius {args.radius} m)")
+    elif args.split:
+        for r in radii:
+            if args.outfile:
+                base = Path(args.outfile)
+                out_path = base.with_name(f"{base.stem}_{int(r)}m{base.suffix or '.csv'}")
+            else:
+                out_path = f"schools_within_{int(r)}m.csv"
+            part = within(df_out, r)
+            part.to_csv(out_path, index=False, encoding="utf-8-sig")
+            print(f"✅ {len(part)} pairs written to {out_path} (radius {r} m)")
+    else:
+        out_path = args.outfile or f"schools_within_{'_'.join(str(int(r)) for r in radii)}m.csv"
+        df_out.to_csv(out_path, index=False, encoding="utf-8-sig")
+        print(f"✅ {len(df_out)} pairs written to {out_path} (radii {', '.join(f'{r:g}' for r in radii)} m)")
+
+    for path in args.export:
+        n = geo_export.export(path, geo_export.station_features(
+            st_df["station"].tolist(), st_df["lat"].to_numpy(), st_df["lon"].to_numpy(), df_out, radii,
+            segments=args.segments,
+        ))
+        print(f"✅ {n} features written to {path}")
 
 
 if __name__ == "__main__":
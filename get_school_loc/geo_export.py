@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+geo_export.py
+=============
+Export station points, catchment rings and school points as GeoJSON or
+FlatGeobuf, for web maps and GIS tools that read only the features inside a
+bounding box.
+
+* ``.geojson`` / ``.json`` – one ``FeatureCollection`` streamed feature by
+  feature (no document tree is built, memory stays flat).
+* ``.fgb`` – FlatGeobuf with its packed Hilbert R-tree spatial index, written
+  through GDAL by the optional ``pyogrio`` (or ``fiona``) package.
+
+Every feature has the same properties so both formats share one schema:
+
+    kind        "station" | "catchment" | "school"
+    name        station or school name
+    station     station the feature belongs to
+    radius_m    ring radius (catchments) / smallest radius containing the school
+    distance_m  school → station distance (schools only)
+
+Usage
+-----
+    python geo_export.py -w schools_within_400_800_1200m.csv -o catchments.fgb
+    python find_schools_within_radius.py --radii 400,800 --export catchments.geojson
+    python build_station_school_kml.py --export catchments.fgb
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import geodesy
+
+FIELDS = ("kind", "name", "station", "radius_m", "distance_m")
+GEOJSON_SUFFIXES = (".geojson", ".json")
+FLATGEOBUF_SUFFIXES = (".fgb",)
+
+Feature = Tuple[Dict[str, object], Dict[str, object]]   # (properties, GeoJSON geometry)
+
+# ---------------------------------------------------------------------------
+# Features
+# ---------------------------------------------------------------------------
+
+def _num(value) -> Optional[float]:
+    """float, or None for missing values (JSON ``null``)."""
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def station_features(
+    st_names: Sequence[str],
+    st_lat: np.ndarray,
+    st_lon: np.ndarray,
+    within: pd.DataFrame,
+    radii: Sequence[float],
+    *,
+    station_col: str = "station",
+    segments: int = 36,
+) -> Iterator[Feature]:
+    """Station point, rings (outer first) and schools, station by station.
+
+    *within* is a ``find_schools_within_radius.py`` table (``school``,
+    ``distance_m``, ``school_lat``, ``school_lon`` and optionally ``radius_m``).
+    """
+    school_rows = within.groupby(within[station_col].astype(str), sort=False).indices
+    sc_name = within["school"].astype(str).tolist()
+    sc_lon = within["school_lon"].tolist()
+    sc_lat = within["school_lat"].tolist()
+    sc_dist = within["distance_m"].tolist()
+    sc_band = within["radius_m"].tolist() if "radius_m" in within.columns else [None] * len(within)
+
+    st_lat = np.asarray(st_lat, dtype=float)
+    st_lon = np.asarray(st_lon, dtype=float)
+    for i, st_rings in geodesy.iter_rings(st_lat, st_lon, radii, segments):
+        st = str(st_names[i])
+        yield ({"kind": "station", "name": st, "station": st, "radius_m": None, "distance_m": None},
+               {"type": "Point", "coordinates": [float(st_lon[i]), float(st_lat[i])]})
+        for k in reversed(range(len(radii))):
+            yield ({"kind": "catchment", "name": f"{st} {int(radii[k])}m", "station": st,
+                    "radius_m": float(radii[k]), "distance_m": None},
+                   {"type": "Polygon", "coordinates": [st_rings[k].tolist()]})
+        for j in school_rows.get(st, ()):
+            yield ({"kind": "school", "name": sc_name[j], "station": st,
+                    "radius_m": _num(sc_band[j]), "distance_m": _num(sc_dist[j])},
+                   {"type": "Point", "coordinates": [float(sc_lon[j]), float(sc_lat[j])]})
+
+# ---------------------------------------------------------------------------
+# Writers
+# ---------------------------------------------------------------------------
+
+def write_geojson(path: Path, features: Iterable[Feature]) -> int:
+    """Stream *features* to a GeoJSON ``FeatureCollection``; returns the count."""
+    n = 0
+    with open(path, "w", encoding="utf-8", buffering=1 << 20) as fh:
+        fh.write('{"type":"FeatureCollection","features":[\n')
+        for props, geom in features:
+            if n:
+                fh.write(",\n")
+            fh.write(json.dumps({"type": "Feature", "properties": props, "geometry": geom},
+                                ensure_ascii=False, separators=(",", ":")))
+            n += 1
+        fh.write("\n]}\n")
+    return n
+
+
+def _wkb(geom: Dict[str, object]) -> bytes:
+    """Little-endian WKB for the Point / Polygon geometries produced above."""
+    if geom["type"] == "Point":
+        return struct.pack("<BIdd", 1, 1, *geom["coordinates"])
+    parts = [struct.pack("<BII", 1, 3, len(geom["coordinates"]))]
+    for ring in geom["coordinates"]:
+        xy = np.asarray(ring, dtype="<f8")
+        parts.append(struct.pack("<I", len(xy)) + xy.tobytes())
+    return b"".join(parts)
+
+
+def write_flatgeobuf(path: Path, features: Iterable[Feature]) -> int:
+    """Write *features* to FlatGeobuf with a spatial index; returns the count.
+
+    Needs ``pyogrio`` (preferred) or ``fiona``.  GDAL sorts the features along
+    a Hilbert curve and builds the packed R-tree when the file is closed.
+    """
+    try:
+        from pyogrio.raw import write as ogr_write
+    except ImportError:
+        ogr_write = None
+    if ogr_write is None:
+        try:
+            import fiona
+        except ImportError:
+            raise SystemExit("❌ FlatGeobuf export needs pyogrio or fiona  (pip install pyogrio)")
+        schema = {"geometry": "Unknown", "properties": {"kind": "str", "name": "str", "station": "str",
+                                                        "radius_m": "float", "distance_m": "float"}}
+        n = 0
+        with fiona.open(path, "w", driver="FlatGeobuf", schema=schema, crs="EPSG:4326") as dst:
+            for props, geom in features:
+                dst.write({"type": "Feature", "properties": props, "geometry": geom})
+                n += 1
+        return n
+
+    geometry: List[bytes] = []
+    columns: Dict[str, list] = {f: [] for f in FIELDS}
+    for props, geom in features:
+        geometry.append(_wkb(geom))
+        for f in FIELDS:
+            columns[f].append(props[f])
+    field_data = [np.array(columns[f], dtype=object) for f in ("kind", "name", "station")]
+    field_data += [np.array([np.nan if v is None else v for v in columns[f]], dtype=float)
+                   for f in ("radius_m", "distance_m")]
+    ogr_write(
+        str(path), np.array(geometry, dtype=object), field_data, list(FIELDS),
+        driver="FlatGeobuf", geometry_type="Unknown", crs="EPSG:4326", SPATIAL_INDEX="YES",
+    )
+    return len(geometry)
+
+
+def export_format(path: Path) -> str:
+    """``"geojson"`` or ``"flatgeobuf"`` from the suffix of *path* (SystemExit otherwise)."""
+    suffix = Path(path).suffix.lower()
+    if suffix in GEOJSON_SUFFIXES:
+        return "geojson"
+    if suffix in FLATGEOBUF_SUFFIXES:
+        return "flatgeobuf"
+    raise SystemExit(f"❌ unknown export format: {path} (use .geojson or .fgb)")
+
+
+def export(path: Path, features: Iterable[Feature]) -> int:
+    """Write *features* in the format given by the suffix of *path*."""
+    path = Path(path)
+    if export_format(path) == "geojson":
+        return write_geojson(path, features)
+    return write_flatgeobuf(path, features)
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    from find_schools_within_radius import normalise_station_df, parse_radii
+
+    p = argparse.ArgumentParser(description="Export stations, catchment rings and schools as GeoJSON / FlatGeobuf")
+    p.add_argument("-s", "--stations", default="station_coordinates_157.csv", help="CSV with station coordinates")
+    p.add_argument("-w", "--within", default="schools_within_800m.csv", help="CSV output from find_schools_within_radius.py")
+    p.add_argument("-o", "--outfile", type=Path, action="append", required=True,
+                   help="Output .geojson or .fgb (repeatable)")
+    p.add_argument("-r", "--radius", type=float, default=800.0, help="Ring radius in metres (default 800)")
+    p.add_argument("--radii", default=None, help="Comma-separated ring radii (default: radius_m values in --within, else --radius)")
+    p.add_argument("--segments", type=int, default=36, help="Segments per ring (default 36)")
+    args = p.parse_args()
+
+    for out in args.outfile:
+        export_format(out)
+    for path in (args.stations, args.within):
+        if not Path(path).exists():
+            raise SystemExit(f"❌ file not found: {path}")
+    st_df = normalise_station_df(pd.read_csv(args.stations))
+    within = pd.read_csv(args.within)
+    if args.radii:
+        radii = parse_radii(args.radii)
+    elif "radius_m" in within.columns and not within.empty:
+        radii = sorted(within["radius_m"].astype(float).unique())
+    else:
+        radii = [args.radius]
+    if "radius_m" in within.columns:
+        within = within[within["radius_m"] <= radii[-1]]
+
+    for out in args.outfile:
+        n = export(out, station_features(st_df["station"].tolist(), st_df["lat"].to_numpy(), st_df["lon"].to_numpy(),
+                                         within, radii, segments=args.segments))
+        print(f"✅ {n} features written to {out}")
+
+
+if __name__ == "__main__":
+    main()
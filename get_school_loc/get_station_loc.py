@@ -1,14 +1,21 @@
 from __future__ import annotations
 
+import argparse
+import csv
+import os
+import re
 import sys
+import threading
 import time
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Tuple, List, Optional
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import pandas as pd
 import requests
 
+import overpass_cache
+
 # ---------------------------------------------------------------------------
 # Configuration -------------------------------------------------------------
 # ---------------------------------------------------------------------------
@@ -57,31 +64,201 @@ def overpass_query_for(name: str) -> str:
     )
 
 
-def query_station(name: str) -> Tuple[Optional[float], Optional[float]]:
-    """Return (lat, lon) for *name* or (None, None) if not found."""
+def _element_coords(el: dict) -> Tuple[float, float]:
+    if el["type"] == "node":
+        lat, lon = el["lat"], el["lon"]
+    else:  # relation or way with center
+        lat, lon = el["center"]["lat"], el["center"]["lon"]
+    return round(lat, 6), round(lon, 6)
+
+
+def query_station(
+    name: str,
+    cache: Optional[overpass_cache.OverpassCache] = None,
+    url: str = OVERPASS_URL,
+) -> Tuple[Optional[float], Optional[float]]:
+    """Return (lat, lon) for a single *name* or (None, None) if not found.
+
+    ``main`` resolves names with :func:`resolve_names`; this is the one-off
+    lookup for interactive use.
+    """
     q = overpass_query_for(name)
     try:
-        r = requests.get(OVERPASS_URL, params={"data": q})
-        r.raise_for_status()
-    except requests.RequestException as e:
-        print(f"⚠️  network error for {name!r}: {e}", file=sys.stderr)
+        data = overpass_cache.fetch(q, url=url, cache=cache, method="get", timeout=TIMEOUT + 15)
+    except overpass_cache.OverpassError as e:
+        # not cached, so the next run asks again
+        print(f"⚠️  {name!r}: {e}", file=sys.stderr)
         return None, None
 
-    try:
-        data = r.json()
-    except json.JSONDecodeError:
-        print(f"⚠️  JSON parse error for {name!r}", file=sys.stderr)
-        return None, None
+    elements = data.get("elements")
+    return _element_coords(elements[0]) if elements else (None, None)
 
-    if not data.get("elements"):
-        return None, None
 
-    el = data["elements"][0]
-    if el["type"] == "node":
-        lat, lon = el["lat"], el["lon"]
-    else:  # relation or way with center
-        lat, lon = el["center"]["lat"], el["center"]["lon"]
-    return round(lat, 6), round(lon, 6)
+# ---------------------------------------------------------------------------
+# Batched / concurrent lookup -----------------------------------------------
+# ---------------------------------------------------------------------------
+# One query per name re-evaluates the prefecture union and pays a round trip
+# each time.  A batch query matches many names with one anchored regex; the
+# first element per name is the same one ``out center 1`` would return for
+# the single-name query (nodes by id, then relations).
+
+BATCH_SIZE     = 40
+BATCH_TIMEOUT  = 120     # seconds, Overpass-side limit for one batch query
+_ERE_SPECIAL   = re.compile(r"([.\[\]()*+?{}|^$\\])")
+
+
+def _ere_literal(name: str) -> str:
+    """*name* as a POSIX ERE literal inside an Overpass QL string."""
+    return _ERE_SPECIAL.sub(r"\\\\\1", name).replace("\"", "\\\"")
+
+
+def overpass_query_for_batch(names: Sequence[str]) -> str:
+    """One Overpass query resolving every name in *names*."""
+    pattern = "^(" + "|".join(_ere_literal(n) for n in names) + ")$"
+    return (
+        f"[out:json][timeout:{BATCH_TIMEOUT}];\n"
+        f"{PREF_UNION_Q}\n"
+        "(\n"
+        f"  node[\"railway\"=\"station\"][\"name\"~\"{pattern}\"](area.searchArea);\n"
+        f"  relation[\"railway\"=\"station\"][\"name\"~\"{pattern}\"](area.searchArea);\n"
+        ");\n"
+        "out center;"
+    )
+
+
+def parse_batch(names: Sequence[str], data: dict) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """(lat, lon) per name – first matching element – or (None, None)."""
+    found: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+    for el in data.get("elements", []):
+        name = el.get("tags", {}).get("name")
+        if name in found:
+            continue
+        if el["type"] != "node" and "center" not in el:
+            continue
+        found[name] = _element_coords(el)
+    return {n: found.get(n, (None, None)) for n in names}
+
+
+class RateLimiter:
+    """Spaces request starts at least *interval* seconds apart across threads."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _fetch_batch(query: str, url: str, session: requests.Session, limiter: RateLimiter) -> dict:
+    limiter.wait()
+    return overpass_cache.fetch(query, url=url, method="post", session=session, timeout=BATCH_TIMEOUT + 15)
+
+
+def resolve_names(
+    names: Sequence[str],
+    *,
+    url: str = OVERPASS_URL,
+    cache: Optional[overpass_cache.OverpassCache] = None,
+    batch_size: int = BATCH_SIZE,
+    workers: int = 4,
+    throttle: float = THROTTLE,
+) -> Iterator[Tuple[List[str], Optional[Dict[str, Tuple[Optional[float], Optional[float]]]]]]:
+    """Yield ``(batch, {name: (lat, lon)})`` as batches complete.
+
+    Cache lookups and writes stay on the calling thread (SQLite connections
+    are per-thread); only the HTTP requests run in the pool, over one pooled
+    session and a shared :class:`RateLimiter`.  A batch that keeps failing
+    yields ``(batch, None)`` and is not cached.
+    """
+    batches = [list(names[i:i + batch_size]) for i in range(0, len(names), batch_size)]
+    pending = []
+    for batch in batches:
+        query = overpass_query_for_batch(batch)
+        hit = cache.get(url, query) if cache is not None else None
+        if hit is not None:
+            yield batch, parse_batch(batch, hit)
+        elif cache is not None and cache.offline:
+            print(f"⚠️  batch starting {batch[0]!r} is not cached (offline mode)", file=sys.stderr)
+            yield batch, None
+        else:
+            pending.append((batch, query))
+    if not pending:
+        return
+
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 1)))
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 1)))
+    limiter = RateLimiter(throttle)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as ex:
+        futures = {ex.submit(_fetch_batch, query, url, session, limiter): (batch, query) for batch, query in pending}
+        for fut in as_completed(futures):
+            batch, query = futures[fut]
+            try:
+                data = fut.result()
+            except overpass_cache.OverpassError as e:
+                print(f"⚠️  batch starting {batch[0]!r}: {e}", file=sys.stderr)
+                yield batch, None
+                continue
+            if cache is not None:
+                cache.put(url, query, data)
+            yield batch, parse_batch(batch, data)
+    session.close()
+
+def resolve_from_table(names: Sequence[str], table: Path) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """(lat, lon) per name from a local station table (``osm_extract.py`` output).
+
+    The table is in Overpass order (by OSM id), so the first exactly matching
+    row is the element a live query would return.
+    """
+    df = pd.read_csv(table, encoding="utf-8-sig").rename(columns={"latitude": "lat", "longitude": "lon"})
+    df = df.drop_duplicates("name")
+    lookup = {
+        str(n): (round(float(lat), 6), round(float(lon), 6))
+        for n, lat, lon in zip(df["name"], df["lat"], df["lon"])
+    }
+    return {n: lookup.get(n, (None, None)) for n in names}
+
+# ---------------------------------------------------------------------------
+# Incremental output ---------------------------------------------------------
+# ---------------------------------------------------------------------------
+# Resolved names are appended to ``<output>.partial`` as batches finish, so an
+# interrupted run resumes with the names still missing.  Names whose query
+# failed are not recorded and are retried by the next run.
+
+COLUMNS = ["name", "latitude", "longitude"]
+
+
+def partial_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + ".partial")
+
+
+def read_partial(path: Path) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    if not path.exists():
+        return {}
+    df = pd.read_csv(path, encoding="utf-8")
+    return {
+        str(n): (None if pd.isna(lat) else float(lat), None if pd.isna(lon) else float(lon))
+        for n, lat, lon in zip(df["name"], df["latitude"], df["longitude"])
+    }
+
+
+def append_partial(path: Path, rows: Dict[str, Tuple[Optional[float], Optional[float]]]) -> None:
+    new = not path.exists()
+    with path.open("a", encoding="utf-8", newline="") as fh:
+        w = csv.writer(fh)
+        if new:
+            w.writerow(COLUMNS)
+        for name, (lat, lon) in rows.items():
+            w.writerow([name, "" if lat is None else lat, "" if lon is None else lon])
+        fh.flush()
+        os.fsync(fh.fileno())
 
 
 # ---------------------------------------------------------------------------
@@ -89,9 +266,20 @@ def query_station(name: str) -> Tuple[Optional[float], Optional[float]]:
 # ---------------------------------------------------------------------------
 
 def main(argv: List[str] | None = None) -> None:
-    argv = argv if argv is not None else sys.argv[1:]
-    input_path  = Path(argv[0]) if argv else Path("駅名.txt")
-    output_path = Path(argv[1]) if len(argv) > 1 else Path("station_coordinates_157.csv")
+    p = argparse.ArgumentParser(description="Resolve station names to coordinates via Overpass")
+    p.add_argument("input", nargs="?", type=Path, default=Path("駅名.txt"), help="Station names, one per line")
+    p.add_argument("output", nargs="?", type=Path, default=Path("station_coordinates_157.csv"), help="Output CSV")
+    p.add_argument("--overpass-url", default=OVERPASS_URL, help="Overpass interpreter endpoint")
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Station names per Overpass query")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent Overpass requests")
+    p.add_argument("--throttle", type=float, default=THROTTLE, help="Minimum seconds between request starts")
+    p.add_argument("--restart", action="store_true", help="Ignore names resolved by an interrupted earlier run")
+    p.add_argument("--stations-table", type=Path, default=None,
+                   help="Resolve names from a local station table (osm_extract.py) instead of Overpass")
+    overpass_cache.add_cache_args(p)
+    args = p.parse_args(argv)
+    input_path, output_path = args.input, args.output
+    cache = overpass_cache.cache_from_args(args)
 
     if not input_path.exists():
         sys.exit(f"❌ station name file not found: {input_path}")
@@ -99,25 +287,57 @@ def main(argv: List[str] | None = None) -> None:
     names = [line.strip() for line in input_path.read_text(encoding="utf-8").splitlines() if line.strip()]
     print(f"▶️  Fetching coordinates for {len(names)} stations within {', '.join(PREFECTURES)}…\n")
 
-    records = []
-    for idx, name in enumerate(names, 1):
-        lat, lon = query_station(name)
-        records.append({"name": name, "latitude": lat, "longitude": lon})
-        status = "OK" if lat is not None else "MISS"
-        print(f"{idx:3}/{len(names)}  {name:<20} : {status}")
-        time.sleep(THROTTLE)
+    if args.stations_table is not None and not args.stations_table.exists():
+        sys.exit(f"❌ station table not found: {args.stations_table}")
+
+    part = partial_path(output_path)
+    if args.restart:
+        part.unlink(missing_ok=True)
+    resolved = read_partial(part)
+    if resolved:
+        print(f"↩️  resuming: {len(resolved)} names already resolved in {part}")
+    todo = list(dict.fromkeys(n for n in names if n not in resolved))
 
-    df = pd.DataFrame(records)
+    if args.stations_table is not None:
+        print(f"📂 Resolving from the local table {args.stations_table} (no network)\n")
+        batches = iter([(todo, resolve_from_table(todo, args.stations_table))])
+    else:
+        batches = resolve_names(
+            todo, url=args.overpass_url, cache=cache,
+            batch_size=args.batch_size, workers=args.workers, throttle=args.throttle,
+        )
+
+    failed: List[str] = []
+    for batch, coords in batches:
+        if coords is None:
+            failed.extend(batch)
+            continue
+        append_partial(part, coords)
+        for name, (lat, lon) in coords.items():
+            resolved[name] = (lat, lon)
+            status = "OK" if lat is not None else "MISS"
+            print(f"{len(resolved):3}/{len(set(names))}  {name:<20} : {status}")
+
+    records = [
+        {"name": name, "latitude": resolved.get(name, (None, None))[0], "longitude": resolved.get(name, (None, None))[1]}
+        for name in names
+    ]
+    df = pd.DataFrame(records, columns=COLUMNS)
     df.to_csv(output_path, index=False, encoding="utf-8-sig")
 
-    missing = df[df["latitude"].isna()]
+    missing = df[df["latitude"].isna() & ~df["name"].isin(failed)]
     if not missing.empty:
         print("\n⚠️  Stations NOT found (please verify names or check if they lie outside the target prefectures):")
         for n in missing["name"]:
             print("  -", n)
-    else:
+    elif not failed:
         print("\n✅ All stations resolved successfully!")
 
+    if failed:
+        print(f"\n⚠️  {len(failed)} names could not be queried; rerun to retry only those")
+    else:
+        part.unlink(missing_ok=True)
+
     print(f"\n📄 CSV written to: {output_path.resolve()}")
 
 
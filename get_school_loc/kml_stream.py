@@ -0,0 +1,151 @@
+"""
+kml_stream.py
+=============
+Minimal streaming KML / KMZ writer for ``build_station_school_kml.py``.
+
+``simplekml`` builds the whole document as an object tree (one object per
+placemark, geometry, style and icon) and serialises it on ``save``, so memory
+grows with the map.  :class:`KmlWriter` writes each placemark to the file as
+soon as it is added; styles are declared once in the document header and
+placemarks only refer to them (``<styleUrl>#id</styleUrl>``).
+
+A path ending in ``.kmz`` is written as a zip archive whose ``doc.kml`` entry
+is streamed through the deflate compressor.  :func:`region` and
+:meth:`KmlWriter.network_link` support level-of-detail tiling (features that
+load only once their ``<Region>`` is large enough on screen).
+
+    with KmlWriter("map.kmz") as kw:
+        kw.icon_style("station", href, scale=0.1)
+        kw.point("江坂", 135.497, 34.758, style="station")
+"""
+from __future__ import annotations
+
+import io
+import zipfile
+from pathlib import Path
+from typing import Optional
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+KML_NS = "http://www.opengis.net/kml/2.2"
+_BUFFER = 1 << 20
+
+
+def kml_color(alpha: int, rgb: str) -> str:
+    """KML ``aabbggrr`` colour from an alpha (0–255) and an ``rrggbb`` hex string."""
+    rgb = rgb.lstrip("#")
+    return f"{alpha:02x}{rgb[4:6]}{rgb[2:4]}{rgb[0:2]}"
+
+
+def coords_text(coords: np.ndarray) -> str:
+    """``lon,lat,0 lon,lat,0 …`` for an ``(n, 2)`` array of (lon, lat)."""
+    return " ".join(f"{lon},{lat},0" for lon, lat in np.asarray(coords, dtype=float).tolist())
+
+
+class KmlWriter:
+    """Writes a KML document incrementally to *path* (``.kml`` or ``.kmz``)."""
+
+    def __init__(self, path: Path, *, name: Optional[str] = None) -> None:
+        self.path = Path(path)
+        self.kmz = self.path.suffix.lower() == ".kmz"
+        self._zip: Optional[zipfile.ZipFile] = None
+        if self.kmz:
+            self._zip = zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED)
+            self._fh = io.TextIOWrapper(self._zip.open("doc.kml", "w"), encoding="utf-8", write_through=False)
+        else:
+            self._fh = open(self.path, "w", encoding="utf-8", buffering=_BUFFER)
+        self._depth = 0
+        self.placemarks = 0
+        self._fh.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="{KML_NS}">\n<Document>\n')
+        if name:
+            self._fh.write(f"<name>{escape(name)}</name>\n")
+
+    # -- context manager ----------------------------------------------------
+    def __enter__(self) -> "KmlWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._fh.closed:
+            return
+        while self._depth:
+            self.end_folder()
+        self._fh.write("</Document>\n</kml>\n")
+        self._fh.close()
+        if self._zip is not None:
+            self._zip.close()
+
+    def write(self, xml: str) -> None:
+        """Raw KML fragment (for elements this class has no helper for)."""
+        self._fh.write(xml)
+
+    # -- styles -------------------------------------------------------------
+    def icon_style(self, style_id: str, href: str, *, scale: float = 1.0, label_scale: Optional[float] = None) -> None:
+        label = f"<LabelStyle><scale>{label_scale}</scale></LabelStyle>" if label_scale is not None else ""
+        self._fh.write(
+            f'<Style id="{style_id}"><IconStyle><scale>{scale}</scale>'
+            f"<Icon><href>{escape(href)}</href></Icon></IconStyle>{label}</Style>\n"
+        )
+
+    def poly_style(self, style_id: str, color: str, *, outline: bool = True) -> None:
+        self._fh.write(
+            f'<Style id="{style_id}"><PolyStyle><color>{color}</color>'
+            f"<outline>{int(outline)}</outline></PolyStyle></Style>\n"
+        )
+
+    # -- containers ---------------------------------------------------------
+    def begin_folder(self, name: str, *, extra: str = "") -> None:
+        self._fh.write(f"<Folder><name>{escape(name)}</name>{extra}\n")
+        self._depth += 1
+
+    def end_folder(self) -> None:
+        self._fh.write("</Folder>\n")
+        self._depth -= 1
+
+    def network_link(self, name: str, href: str, *, region: str = "") -> None:
+        """Link to another KML file, fetched when *region* becomes active."""
+        self._fh.write(
+            f"<NetworkLink><name>{escape(name)}</name>{region}"
+            f"<Link><href>{escape(href)}</href><viewRefreshMode>onRegion</viewRefreshMode></Link></NetworkLink>\n"
+        )
+
+    # -- placemarks ---------------------------------------------------------
+    def point(
+        self,
+        name: str,
+        lon: float,
+        lat: float,
+        *,
+        style: Optional[str] = None,
+        description: Optional[str] = None,
+    ) -> None:
+        parts = [f"<Placemark><name>{escape(str(name))}</name>"]
+        if description is not None:
+            parts.append(f"<description>{escape(description)}</description>")
+        if style:
+            parts.append(f"<styleUrl>#{style}</styleUrl>")
+        parts.append(f"<Point><coordinates>{lon},{lat},0</coordinates></Point></Placemark>\n")
+        self._fh.write("".join(parts))
+        self.placemarks += 1
+
+    def polygon(self, name: str, ring: np.ndarray, *, style: Optional[str] = None) -> None:
+        """Polygon placemark from a closed ``(n, 2)`` (lon, lat) ring."""
+        style_xml = f"<styleUrl>#{style}</styleUrl>" if style else ""
+        self._fh.write(
+            f"<Placemark><name>{escape(str(name))}</name>{style_xml}"
+            f"<Polygon><outerBoundaryIs><LinearRing><coordinates>{coords_text(ring)}"
+            "</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>\n"
+        )
+        self.placemarks += 1
+
+
+def region(south: float, west: float, north: float, east: float, *, min_lod: int = 0, max_lod: int = -1) -> str:
+    """``<Region>`` active while its box spans *min_lod* … *max_lod* screen pixels."""
+    return (
+        f"<Region><LatLonAltBox><north>{north}</north><south>{south}</south>"
+        f"<east>{east}</east><west>{west}</west></LatLonAltBox>"
+        f"<Lod><minLodPixels>{min_lod}</minLodPixels><maxLodPixels>{max_lod}</maxLodPixels></Lod></Region>"
+    )
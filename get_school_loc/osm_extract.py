@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+osm_extract.py
+==============
+Offline station and school tables from a local OpenStreetMap ``.osm.pbf``
+extract (e.g. Geofabrik's ``kansai-latest.osm.pbf``).
+
+``get_station_loc.py`` and ``find_schools_within_radius.py`` otherwise need
+the public Overpass API (and the offline default
+``school_coordinates_kansai.csv`` is not shipped).  The main streaming pass
+over the PBF collects
+
+* ``railway=station`` nodes and relations → ``osm_stations.csv``
+  (name, lat, lon, osm) — the same element types as the live query in
+  ``get_station_loc.py``
+* ``amenity=school`` nodes, ways and multipolygons whose name passes
+  :func:`find_schools_within_radius.is_target_name` →
+  ``school_coordinates_kansai.csv`` (name, lat, lon, osm)
+
+Ways and relations are reduced to the centre of their bounding box, the same
+point Overpass returns for ``out center``; for a station relation that box
+spans its member nodes and the nodes of its member ways.  The region is whatever the
+extract covers (there is no prefecture filter as in the live queries).
+
+The file is read three times, but only once in full:
+
+1. relations only – the members of named station relations (relations come
+   after nodes and ways in a PBF, so they must be known beforehand);
+2. relations only – pyosmium's own multipolygon pass for ``area()``;
+3. everything, with a node location index – stations, member locations and
+   schools.
+
+The relation-only reads skip decoding node and way blocks, so they cost a
+small fraction of the main pass.
+
+The tables are read by the existing CLIs:
+
+    python get_station_loc.py --stations-table osm_stations.csv
+    python find_schools_within_radius.py -c school_coordinates_kansai.csv
+
+Requires pyosmium ≥ 3.7 (``pip install osmium``), which is only needed here.
+``tests/data/mini.osm`` is a tiny extract for ``tests/test_osm_extract.py``.
+
+Usage
+-----
+    python osm_extract.py kansai-latest.osm.pbf
+    python osm_extract.py kansai-latest.osm.pbf --stations osm_stations.csv --schools school_coordinates_kansai.csv
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from find_schools_within_radius import is_target_name
+
+try:
+    import osmium
+except ImportError:  # optional: only this extractor needs it
+    osmium = None
+
+COLUMNS = ["name", "lat", "lon", "osm"]
+
+# ---------------------------------------------------------------------------
+# Handler
+# ---------------------------------------------------------------------------
+
+def _bbox_center(locations) -> Optional[Tuple[float, float]]:
+    lats: List[float] = []
+    lons: List[float] = []
+    for loc in locations:
+        if loc.valid():
+            lats.append(loc.lat)
+            lons.append(loc.lon)
+    if not lats:
+        return None
+    return (min(lats) + max(lats)) / 2, (min(lons) + max(lons)) / 2
+
+
+def station_relations(pbf: Path) -> Dict[int, Tuple[str, List[int], List[int]]]:
+    """Named ``railway=station`` relations → (name, member nodes, member ways).
+
+    Reads relations only; node and way blocks are not decoded.
+    """
+    relations: Dict[int, Tuple[str, List[int], List[int]]] = {}
+    for r in osmium.FileProcessor(str(pbf), osmium.osm.RELATION):
+        if r.tags.get("railway") != "station" or "name" not in r.tags:
+            continue
+        nodes = [m.ref for m in r.members if m.type == "n"]
+        ways = [m.ref for m in r.members if m.type == "w"]
+        relations[r.id] = (r.tags["name"], nodes, ways)
+    return relations
+
+
+class _Collector(osmium.SimpleHandler if osmium is not None else object):
+    """Collects station nodes, station-relation members and target-school features."""
+
+    def __init__(self, station_relations: Optional[Dict[int, Tuple[str, List[int], List[int]]]] = None) -> None:
+        super().__init__()
+        self.stations: List[Dict[str, object]] = []
+        self.schools: List[Dict[str, object]] = []
+        self.station_relations = station_relations or {}
+        self._member_nodes = {n for _, nodes, _ in self.station_relations.values() for n in nodes}
+        self._member_ways = {w for _, _, ways in self.station_relations.values() for w in ways}
+        self._node_locs: Dict[int, Tuple[float, float]] = {}
+        self._way_locs: Dict[int, List[Tuple[float, float]]] = {}
+
+    def _school(self, tags, center: Optional[Tuple[float, float]], osm: str) -> None:
+        if center is None or tags.get("amenity") != "school":
+            return
+        name = tags.get("name")
+        if is_target_name(name):
+            self.schools.append({"name": name, "lat": center[0], "lon": center[1], "osm": osm})
+
+    def node(self, n) -> None:
+        if n.tags.get("railway") == "station" and "name" in n.tags and n.location.valid():
+            self.stations.append({"name": n.tags["name"], "lat": n.location.lat, "lon": n.location.lon,
+                                  "osm": f"node/{n.id}"})
+        if n.id in self._member_nodes and n.location.valid():
+            self._node_locs[n.id] = (n.location.lat, n.location.lon)
+        if "amenity" in n.tags and n.location.valid():
+            self._school(n.tags, (n.location.lat, n.location.lon), f"node/{n.id}")
+
+    def way(self, w) -> None:
+        if w.id in self._member_ways:
+            self._way_locs[w.id] = [(nd.location.lat, nd.location.lon) for nd in w.nodes if nd.location.valid()]
+        # closed ways come back through area(); only open ones are handled here
+        if "amenity" in w.tags and not w.is_closed():
+            self._school(w.tags, _bbox_center(nd.location for nd in w.nodes), f"way/{w.id}")
+
+    def area(self, a) -> None:
+        if "amenity" not in a.tags:
+            return
+        locs = [nd.location for ring in a.outer_rings() for nd in ring]
+        osm = f"way/{a.orig_id()}" if a.from_way() else f"relation/{a.orig_id()}"
+        self._school(a.tags, _bbox_center(locs), osm)
+
+    def finish_station_relations(self) -> None:
+        """Add one row per station relation at the centre of its members' bounding box."""
+        for rid, (name, nodes, ways) in self.station_relations.items():
+            pts = [self._node_locs[n] for n in nodes if n in self._node_locs]
+            for w in ways:
+                pts.extend(self._way_locs.get(w, ()))
+            if not pts:
+                continue  # members outside the extract
+            lats = [p[0] for p in pts]
+            lons = [p[1] for p in pts]
+            self.stations.append({"name": name, "lat": (min(lats) + max(lats)) / 2,
+                                  "lon": (min(lons) + max(lons)) / 2, "osm": f"relation/{rid}"})
+
+
+def extract(pbf: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(stations, schools) tables from *pbf* (one full pass plus two relation-only passes)."""
+    if osmium is None:
+        raise SystemExit("❌ pyosmium is required for PBF extraction: pip install osmium")
+    handler = _Collector(station_relations(pbf))
+    # locations=True keeps a node location index so ways/areas get geometry;
+    # the area() callback makes pyosmium read the relations once more first
+    handler.apply_file(str(pbf), locations=True)
+    handler.finish_station_relations()
+
+    def _table(rows: List[Dict[str, object]]) -> pd.DataFrame:
+        df = pd.DataFrame(rows, columns=COLUMNS)
+        # same order as an Overpass reply: nodes, ways, relations, each by id
+        kind = df["osm"].str.split("/").str[0].map({"node": 0, "way": 1, "relation": 2})
+        ident = df["osm"].str.split("/").str[1].astype("int64")
+        df = df.assign(_k=kind, _i=ident).sort_values(["_k", "_i"]).drop(columns=["_k", "_i"])
+        df["lat"] = df["lat"].round(7)
+        df["lon"] = df["lon"].round(7)
+        return df.drop_duplicates("osm").reset_index(drop=True)
+
+    return _table(handler.stations), _table(handler.schools)
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Extract station and school tables from a local .osm.pbf file")
+    p.add_argument("pbf", type=Path, help="OSM PBF extract, e.g. kansai-latest.osm.pbf")
+    p.add_argument("--stations", type=Path, default=Path("osm_stations.csv"), help="Output station table")
+    p.add_argument("--schools", type=Path, default=Path("school_coordinates_kansai.csv"), help="Output school table")
+    args = p.parse_args()
+
+    if not args.pbf.exists():
+        raise SystemExit(f"❌ PBF file not found: {args.pbf}")
+
+    stations, schools = extract(args.pbf)
+    stations.to_csv(args.stations, index=False, encoding="utf-8-sig")
+    schools.to_csv(args.schools, index=False, encoding="utf-8-sig")
+    print(f"✅ {len(stations)} stations → {args.stations}")
+    print(f"✅ {len(schools)} target schools → {args.schools}")
+
+
+if __name__ == "__main__":
+    main()
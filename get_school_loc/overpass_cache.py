@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+overpass_cache.py
+=================
+Persistent SQLite cache for Overpass API responses, shared by
+``get_station_loc.py`` and ``find_schools_within_radius.py``.
+
+Both scripts used to POST/GET every query afresh, so each rerun during
+development re-downloaded identical data from the public instance, and a
+transient failure quietly became ``{"elements": []}``.  :func:`fetch` now
+
+* looks the query up by a hash of (endpoint, normalised query) — comments and
+  whitespace outside quoted strings do not change the key;
+* retries transient failures (connection errors, HTTP 429/5xx, Overpass
+  ``runtime error`` remarks) with exponential backoff and raises
+  :class:`OverpassError` once retries are exhausted;
+* stores only successful replies, with a TTL (``--cache-ttl`` hours) and
+  least-recently-used eviction once the database exceeds ``max_mb``;
+* in *offline* mode answers from the cache only (stale entries included) and
+  raises :class:`CacheMiss` for anything not cached.
+
+The database lives at ``$METRO_CACHE_DIR/overpass.sqlite`` (default
+``~/.cache/metro``).
+
+Usage
+-----
+    python overpass_cache.py info
+    python overpass_cache.py purge          # drop expired entries
+    python overpass_cache.py clear
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import requests
+
+DEFAULT_TTL_HOURS = 24 * 7
+DEFAULT_MAX_MB = 256
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key      TEXT PRIMARY KEY,
+    url      TEXT NOT NULL,
+    query    TEXT NOT NULL,
+    body     BLOB NOT NULL,
+    size     INTEGER NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+class OverpassError(RuntimeError):
+    """The Overpass request still failed after all retries."""
+
+
+class CacheMiss(OverpassError):
+    """Offline mode and the query is not cached."""
+
+
+def default_path() -> Path:
+    base = os.environ.get("METRO_CACHE_DIR") or Path.home() / ".cache" / "metro"
+    return Path(base) / "overpass.sqlite"
+
+# ---------------------------------------------------------------------------
+# Keys
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(
+    r'"(?:[^"\\\n]|\\.)*"'            # double-quoted string
+    r"|'(?:[^'\\\n]|\\.)*'"           # single-quoted string
+    r"|(?:\s|//[^\n]*|/\*.*?\*/)+",  # run of whitespace and comments
+    re.S,
+)
+
+
+def normalise_query(query: str) -> str:
+    """Overpass QL without comments, with runs of whitespace collapsed.
+
+    Quoted strings are copied verbatim, so ``"a  b"`` and ``"http://x"`` keep
+    their exact text (and their own cache key).
+    """
+    def repl(m: re.Match) -> str:
+        tok = m.group(0)
+        return tok if tok[0] in "\"'" else " "
+
+    return _TOKEN_RE.sub(repl, query).strip()
+
+
+def query_key(url: str, query: str) -> str:
+    return hashlib.sha256(f"{url}\n{normalise_query(query)}".encode("utf-8")).hexdigest()
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+class OverpassCache:
+    """SQLite-backed response store with TTL and size-based LRU eviction."""
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        *,
+        ttl_hours: float = DEFAULT_TTL_HOURS,
+        max_mb: float = DEFAULT_MAX_MB,
+        offline: bool = False,
+    ) -> None:
+        self.path = Path(path) if path else default_path()
+        self.ttl = ttl_hours * 3600.0
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.offline = offline
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(_SCHEMA)
+
+    def get(self, url: str, query: str) -> Optional[dict]:
+        """Cached reply, or None if absent or (when online) expired."""
+        key = query_key(url, query)
+        row = self.db.execute("SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        body, created = row
+        if not self.offline and time.time() - created > self.ttl:
+            return None
+        with self.db:
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(body)
+
+    def put(self, url: str, query: str, data: dict) -> None:
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query_key(url, query), url, normalise_query(query), body, len(body), now, now),
+            )
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop least-recently-used entries until the cache fits ``max_bytes``."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        removed = 0
+        if total <= self.max_bytes:
+            return removed
+        with self.db:
+            for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        return removed
+
+    def purge_expired(self) -> int:
+        with self.db:
+            cur = self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        return cur.rowcount
+
+    def clear(self) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM responses")
+        self.db.execute("VACUUM")
+
+    def stats(self) -> dict:
+        n, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        expired = self.db.execute(
+            "SELECT COUNT(*) FROM responses WHERE created < ?", (time.time() - self.ttl,)
+        ).fetchone()[0]
+        return {"entries": n, "bytes": size, "expired": expired}
+
+    def close(self) -> None:
+        self.db.close()
+
+# ---------------------------------------------------------------------------
+# Fetching
+# ---------------------------------------------------------------------------
+
+def _error_text(body: str, limit: int = 300) -> str:
+    """Overpass's HTML error page reduced to its message text."""
+    text = " ".join(re.sub(r"<[^>]+>", " ", body).split())
+    return text[:limit] or "(empty response)"
+
+
+def fetch_with_status(
+    query: str,
+    *,
+    url: str,
+    cache: Optional[OverpassCache] = None,
+    method: str = "post",
+    session: Optional[requests.Session] = None,
+    timeout: float = 90,
+    retries: int = 3,
+    backoff: float = 2.0,
+) -> Tuple[dict, bool]:
+    """(Overpass JSON for *query*, whether it came from *cache*).
+
+    Raises :class:`CacheMiss` in offline mode and :class:`OverpassError` when
+    the request keeps failing; failures are never cached.
+    """
+    if cache is not None:
+        hit = cache.get(url, query)
+        if hit is not None:
+            return hit, True
+        if cache.offline:
+            raise CacheMiss(f"not in the Overpass cache (offline mode): {normalise_query(query)[:120]}")
+
+    http = session or requests
+    last: Optional[str] = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            if method == "get":
+                resp = http.get(url, params={"data": query}, timeout=timeout)
+            else:
+                resp = http.post(url, data=query.encode("utf-8"), timeout=timeout)
+            if resp.status_code in RETRY_STATUS:
+                last = f"HTTP {resp.status_code}"
+                continue
+            if 400 <= resp.status_code < 500:
+                # bad query / forbidden: retrying cannot help
+                raise OverpassError(f"HTTP {resp.status_code}: {_error_text(resp.text)}")
+            resp.raise_for_status()
+            data = resp.json()
+        except (requests.RequestException, ValueError) as e:
+            last = str(e)
+            continue
+        # Overpass reports timeouts / memory exhaustion as a 200 with a remark
+        remark = data.get("remark", "")
+        if "runtime error" in remark:
+            last = remark
+            continue
+        if cache is not None:
+            cache.put(url, query, data)
+        return data, False
+    raise OverpassError(f"Overpass request failed after {retries + 1} attempt(s): {last}")
+
+def fetch(query: str, *, url: str, cache: Optional[OverpassCache] = None, **kwargs) -> dict:
+    """Overpass JSON for *query*, from *cache* when possible (see :func:`fetch_with_status`)."""
+    return fetch_with_status(query, url=url, cache=cache, **kwargs)[0]
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def add_cache_args(p: argparse.ArgumentParser) -> None:
+    """The ``--cache`` / ``--no-cache`` / ``--offline`` / ``--cache-ttl`` options."""
+    p.add_argument("--cache", type=Path, default=None, help=f"Overpass cache database (default {default_path()})")
+    p.add_argument("--no-cache", action="store_true", help="Do not read or write the Overpass cache")
+    p.add_argument("--offline", action="store_true", help="Answer Overpass queries from the cache only")
+    p.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, help="Hours before a cached reply is refetched")
+    p.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_MB, help="Evict least-recently-used replies beyond this size")
+
+
+def cache_from_args(args: argparse.Namespace) -> Optional[OverpassCache]:
+    if args.no_cache:
+        if args.offline:
+            raise SystemExit("❌ --offline needs the cache (drop --no-cache)")
+        return None
+    return OverpassCache(args.cache, ttl_hours=args.cache_ttl, max_mb=args.cache_max_mb, offline=args.offline)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Inspect or clean the Overpass response cache")
+    p.add_argument("command", choices=("info", "purge", "clear"))
+    p.add_argument("--cache", type=Path, default=None, help=f"Cache database (default {default_path()})")
+    p.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, help="Hours before an entry expires")
+    args = p.parse_args()
+
+    cache = OverpassCache(args.cache, ttl_hours=args.cache_ttl)
+    if args.command == "purge":
+        print(f"✅ {cache.purge_expired()} expired entries removed")
+    elif args.command == "clear":
+        cache.clear()
+        print(f"✅ cache cleared: {cache.path}")
+    st = cache.stats()
+    print(f"{cache.path}: {st['entries']} entries, {st['bytes'] / 1e6:.1f} MB, {st['expired']} expired")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
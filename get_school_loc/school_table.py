@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+school_table.py
+===============
+Load a school location table for the offline mode of
+``find_schools_within_radius.py`` – either plain ``name, lat, lon`` columns
+or a WKT export such as ``school_loc.csv``.
+
+``school_loc.csv`` (a My Maps / Power Query export) is cp932, has a
+placeholder header ``Column1,Column2,Column3`` with the real one
+(``WKT,名前,説明``) on the next line, and mixes station points, school points
+and catchment ``POLYGON``s.  :func:`read_school_table`
+
+* detects the encoding with the shared ``csv_encoding.detect_encoding``
+  (cached per file) and promotes the real header when the first one is
+  only ``Column1…``;
+* finds the geometry column (``WKT``/``geometry``/… or the first column whose
+  values look like WKT) and the name column;
+* applies the name filter first, then pulls ``POINT (lon lat [z])``
+  coordinates out of the remaining rows with one vectorised regex – no
+  per-row geometry objects; non-point geometries are dropped.
+
+Usage
+-----
+    python school_table.py school_loc.csv -o school_coordinates_kansai.csv
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+from pathlib import Path
+from typing import List, Optional, Pattern, Sequence
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import csv_encoding  # noqa: E402
+
+NAME_COLUMNS = ("name", "Name", "名前", "名称", "施設名", "学校名")
+LAT_COLUMNS = ("lat", "latitude", "Latitude", "緯度")
+LON_COLUMNS = ("lon", "lng", "longitude", "Longitude", "経度")
+WKT_COLUMNS = ("WKT", "wkt", "geometry", "geom", "the_geom", "Geometry")
+
+_PLACEHOLDER_RE = re.compile(r"^Column\d+$")
+_WKT_RE = re.compile(r"^\s*(?:MULTI)?(?:POINT|LINESTRING|POLYGON|GEOMETRYCOLLECTION)\b", re.I)
+_NUM = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+POINT_RE = re.compile(rf"^\s*POINT\s*(?:Z|M|ZM)?\s*\(\s*(?P<lon>{_NUM})\s+(?P<lat>{_NUM})", re.I)
+
+# ---------------------------------------------------------------------------
+# Detection
+# ---------------------------------------------------------------------------
+
+def _pick(columns: Sequence[str], candidates: Sequence[str]) -> Optional[str]:
+    return next((c for c in candidates if c in columns), None)
+
+
+def _header(path: Path, encoding: str) -> tuple[int, List[str]]:
+    """(rows to skip, column names), promoting the real header row if needed."""
+    head = pd.read_csv(path, encoding=encoding, nrows=2, header=None, dtype=str)
+    first = [str(c) for c in head.iloc[0]]
+    if all(_PLACEHOLDER_RE.match(c) for c in first) and len(head) > 1:
+        return 1, [str(c) for c in head.iloc[1]]
+    return 0, first
+
+
+def wkt_column(df: pd.DataFrame) -> Optional[str]:
+    col = _pick(df.columns, WKT_COLUMNS)
+    if col is not None:
+        return col
+    for c in df.columns:
+        values = df[c].dropna().astype(str).head(20)
+        if len(values) and values.str.match(_WKT_RE).all():
+            return c
+    return None
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+def points_from_wkt(wkt: pd.Series) -> pd.DataFrame:
+    """``lat``/``lon`` float columns for ``POINT`` rows (NaN elsewhere)."""
+    xy = wkt.astype(str).str.extract(POINT_RE)
+    return pd.DataFrame({"lat": pd.to_numeric(xy["lat"]), "lon": pd.to_numeric(xy["lon"])}, index=wkt.index)
+
+
+def read_school_table(
+    path: Path,
+    *,
+    name_filter: Optional[Pattern[str]] = None,
+    encoding: Optional[str] = None,
+) -> pd.DataFrame:
+    """``name, lat, lon`` rows from a lat/lon or WKT table.
+
+    Rows whose name does not match *name_filter* are dropped before any
+    coordinates are parsed.  Raises ``SystemExit`` when no name column or no
+    coordinates can be found.
+    """
+    path = Path(path)
+    encoding = encoding or csv_encoding.detect_encoding(path)
+    skip, columns = _header(path, encoding)
+    name_col = _pick(columns, NAME_COLUMNS)
+    if name_col is None:
+        raise SystemExit(f"❌ {path}: no name column (one of {', '.join(NAME_COLUMNS)}); columns: {columns}")
+    df = pd.read_csv(path, encoding=encoding, skiprows=skip + 1, header=None, names=columns,
+                     dtype={name_col: str})
+
+    if name_filter is not None:
+        # str.count instead of str.contains: the filter may have groups
+        df = df[df[name_col].str.count(name_filter).gt(0)]
+
+    lat_col, lon_col = _pick(df.columns, LAT_COLUMNS), _pick(df.columns, LON_COLUMNS)
+    if lat_col is not None and lon_col is not None:
+        coords = pd.DataFrame({"lat": pd.to_numeric(df[lat_col], errors="coerce"),
+                               "lon": pd.to_numeric(df[lon_col], errors="coerce")}, index=df.index)
+    else:
+        geom = wkt_column(df)
+        if geom is None:
+            raise SystemExit(f"❌ {path}: needs lat/lon columns or a WKT geometry column; columns: {columns}")
+        coords = points_from_wkt(df[geom])
+
+    out = pd.DataFrame({"name": df[name_col], "lat": coords["lat"], "lon": coords["lon"]})
+    return out.dropna().reset_index(drop=True)
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    from find_schools_within_radius import TARGET_RE
+
+    p = argparse.ArgumentParser(description="Convert a WKT or lat/lon school table to name,lat,lon")
+    p.add_argument("table", type=Path, help="School table, e.g. school_loc.csv")
+    p.add_argument("-o", "--outfile", type=Path, default=Path("school_coordinates_kansai.csv"), help="Output CSV")
+    p.add_argument("--encoding", default=None, help="Input encoding (default: detect)")
+    p.add_argument("--all-names", action="store_true", help="Keep every point (skip the 中学校/高等学校 filter)")
+    args = p.parse_args()
+
+    if not args.table.exists():
+        raise SystemExit(f"❌ table not found: {args.table}")
+    df = read_school_table(args.table, name_filter=None if args.all_names else TARGET_RE, encoding=args.encoding)
+    df.to_csv(args.outfile, index=False, encoding="utf-8-sig")
+    print(f"✅ {len(df)} schools written to {args.outfile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+spatial_index.py
+================
+Bulk "all points within *radius*" join on the sphere.
+
+``build_within_radius`` used to compute the haversine distance from every
+station to every school (O(stations × schools)).  Here both sets are mapped to
+unit vectors and the schools are bucketed into a regular 3-D grid whose cell
+edge is the chord length of *radius*.  Any school within *radius* of a
+station then lies in one of the 27 cells around the station's cell, so one
+sorted lookup per neighbour offset yields every candidate pair at once; the
+exact haversine distance is computed only for those candidates.
+
+No third-party spatial library is needed and the grid works anywhere on the
+globe (no projection, no dateline/pole special cases).
+"""
+from __future__ import annotations
+
+import math
+from typing import Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6_371_000.0  # metres, WGS‑84 mean radius
+
+# cells never get smaller than this (unit-sphere units, ≈ 64 m) so that the
+# packed int64 cell key cannot overflow for tiny radii
+_MIN_CELL = 1e-5
+
+# ---------------------------------------------------------------------------
+# Geometry
+# ---------------------------------------------------------------------------
+
+def unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """(n, 3) unit vectors for latitude/longitude in degrees."""
+    lat_r = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_r = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+
+def haversine_pairs(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Element-wise haversine distance in metres (same formula as ``haversine_np``)."""
+    lat1_rad, lon1_rad = np.radians(lat1), np.radians(lon1)
+    lats2_rad, lons2_rad = np.radians(lat2), np.radians(lon2)
+
+    dlat = lats2_rad - lat1_rad
+    dlon = lons2_rad - lon1_rad
+
+    a = (
+        np.sin(dlat / 2) ** 2
+        + np.cos(lat1_rad) * np.cos(lats2_rad) * np.sin(dlon / 2) ** 2
+    )
+    c = 2 * np.arcsin(np.sqrt(a))
+    return EARTH_RADIUS_M * c
+
+
+def chord_for(radius_m: float) -> float:
+    """Straight-line (unit sphere) distance matching great-circle *radius_m*."""
+    return 2.0 * math.sin(min(radius_m / EARTH_RADIUS_M, math.pi) / 2.0)
+
+# ---------------------------------------------------------------------------
+# Grid index
+# ---------------------------------------------------------------------------
+
+class SphereGrid:
+    """Points bucketed into cubic cells of edge ``chord_for(radius_m)``."""
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, radius_m: float) -> None:
+        self.cell = max(chord_for(radius_m) * (1 + 1e-9), _MIN_CELL)
+        self._k = int(math.ceil(1.0 / self.cell)) + 2   # |cell index| bound
+        self._w = 2 * self._k + 1
+        keys = self._keys(self._cells(unit_vectors(lat, lon)))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _cells(self, xyz: np.ndarray) -> np.ndarray:
+        return np.floor(xyz / self.cell).astype(np.int64)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        c = cells + self._k
+        return (c[:, 0] * self._w + c[:, 1]) * self._w + c[:, 2]
+
+    def candidates(self, lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(query index, point index) for every point in the 27 cells around each query."""
+        cells = self._cells(unit_vectors(lat, lon))
+        q_parts, p_parts = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    keys = self._keys(cells + np.array([dx, dy, dz]))
+                    lo = np.searchsorted(self.sorted_keys, keys, side="left")
+                    hi = np.searchsorted(self.sorted_keys, keys, side="right")
+                    counts = hi - lo
+                    if not counts.any():
+                        continue
+                    q = np.repeat(np.arange(len(keys)), counts)
+                    # positions lo[q] .. hi[q]-1 for every query, flattened
+                    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                    q_parts.append(q)
+                    p_parts.append(self.order[np.repeat(lo, counts) + offsets])
+        if not q_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(q_parts), np.concatenate(p_parts)
+
+
+def pairs_within(
+    q_lat: np.ndarray,
+    q_lon: np.ndarray,
+    p_lat: np.ndarray,
+    p_lon: np.ndarray,
+    radius_m: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """All (query, point, distance_m) with haversine distance ≤ *radius_m*.
+
+    Pairs are ordered by query index, then point index.
+    """
+    q_lat, q_lon = np.asarray(q_lat, dtype=np.float64), np.asarray(q_lon, dtype=np.float64)
+    p_lat, p_lon = np.asarray(p_lat, dtype=np.float64), np.asarray(p_lon, dtype=np.float64)
+    if not len(q_lat) or not len(p_lat):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+
+    # rows without coordinates never match (their haversine distance is NaN)
+    q_ok = np.flatnonzero(np.isfinite(q_lat) & np.isfinite(q_lon))
+    p_ok = np.flatnonzero(np.isfinite(p_lat) & np.isfinite(p_lon))
+    qi, pj = SphereGrid(p_lat[p_ok], p_lon[p_ok], radius_m).candidates(q_lat[q_ok], q_lon[q_ok])
+    qi, pj = q_ok[qi], p_ok[pj]
+    dist = haversine_pairs(q_lat[qi], q_lon[qi], p_lat[pj], p_lon[pj])
+    keep = dist <= radius_m
+    qi, pj, dist = qi[keep], pj[keep], dist[keep]
+    order = np.lexsort((pj, qi))
+    return qi[order], pj[order], dist[order]
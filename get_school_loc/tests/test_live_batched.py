@@ -0,0 +1,70 @@
+"""Batched live mode against a local stand-in for the Overpass API."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("requests")
+
+import find_schools_within_radius as fs  # noqa: E402
+import overpass_cache  # noqa: E402
+
+DATA = Path(__file__).resolve().parent / "data"
+RECORDED = (DATA / "overpass_schools.json").read_bytes()
+
+# A and B share a 0.25° tile, C is in the next one to the north
+STATIONS = pd.DataFrame({
+    "station": ["A", "B", "C"],
+    "lat": [34.55, 34.56, 34.80],
+    "lon": [135.50, 135.51, 135.50],
+})
+
+
+@pytest.fixture
+def overpass():
+    """Serve the recorded reply on 127.0.0.1; yields (url, list of received queries)."""
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            queries.append(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(RECORDED)))
+            self.end_headers()
+            self.wfile.write(RECORDED)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api/interpreter", queries
+    server.shutdown()
+    server.server_close()
+
+
+def test_batched_tiles_pairs_and_cache(overpass, tmp_path):
+    url, queries = overpass
+    cache = overpass_cache.OverpassCache(tmp_path / "overpass.sqlite")
+
+    tiles = fs.station_tiles(STATIONS, 800.0, 0.25)
+    assert len(tiles) == 2
+
+    schools = fs.fetch_schools_batched(STATIONS, 800.0, url=url, tile_deg=0.25, delay=0, cache=cache)
+    assert len(queries) == 2
+    # both tiles return the same elements; non-target names and elements without a centre are dropped
+    assert sorted(schools["name"]) == ["堺市立テスト中学校", "大阪府立テスト高等学校"]
+
+    pairs = fs.build_within_radius(STATIONS, schools, 800.0)
+    assert sorted(zip(pairs["station"], pairs["school"])) == [("A", "堺市立テスト中学校"), ("C", "大阪府立テスト高等学校")]
+    assert (pairs["distance_m"] <= 800.0).all()
+
+    # the rerun is answered from the cache
+    again = fs.fetch_schools_batched(STATIONS, 800.0, url=url, tile_deg=0.25, delay=0, cache=cache)
+    assert len(queries) == 2
+    pd.testing.assert_frame_equal(again, schools)
+    cache.close()
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("osmium")
+
+import osm_extract  # noqa: E402
+
+DATA = Path(__file__).resolve().parent / "data"
+
+
+def test_station_relations_lists_named_relations_only():
+    rels = osm_extract.station_relations(DATA / "mini.osm")
+    assert rels == {100: ("梅田", [4], [10])}
+
+
+def test_extract_stations_and_schools():
+    stations, schools = osm_extract.extract(DATA / "mini.osm")
+
+    assert stations["osm"].tolist() == ["node/1", "relation/100"]
+    assert stations["name"].tolist() == ["なかもず", "梅田"]
+    # relation: centre of the bbox of node 4 and the nodes of way 10
+    assert stations["lat"].tolist() == pytest.approx([34.55, 34.61])
+    assert stations["lon"].tolist() == pytest.approx([135.50, 135.41])
+
+    assert schools["osm"].tolist() == ["node/5", "way/20"]
+    assert schools["name"].tolist() == ["堺市立テスト中学校", "大阪府立テスト高等学校"]
+    assert schools["lat"].tolist() == pytest.approx([34.56, 34.575])
+    assert schools["lon"].tolist() == pytest.approx([135.51, 135.525])
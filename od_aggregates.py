@@ -0,0 +1,282 @@
+"""
+od_aggregates.py
+================
+Append-only store of daily / hourly OD aggregates, refreshed month by month.
+
+Every analysis used to start from the raw OD file, so adding May and June
+data would mean re-reading April as well.  ``ingest`` takes one new monthly
+OD CSV, checks its header against the columns recorded in the store's
+``manifest.json``, aggregates it in one streaming pass and writes only the
+month partitions its dates fall into:
+
+    <store>/manifest.json
+    <store>/daily_departures/2025-04.parquet    data_date, station, departures
+    <store>/daily_arrivals/2025-04.parquet      data_date, station, arrivals
+    <store>/daily_pairs/2025-04.parquet         data_date, origin, dest, trips
+    <store>/hourly_departures/2025-04.parquet   data_date, time_bin, station, departures
+    <store>/hourly_arrivals/2025-04.parquet     data_date, time_bin, station, arrivals
+
+Dates already in the store are rejected (``--replace`` overwrites them), so
+refresh cost follows the size of the new file, not the whole history.
+
+Readers: ``--rides <store>`` in the ``analyze_school`` scripts and
+``--source <store>`` in the ``analyze_banpaku`` scripts (via
+:func:`od_cube.cube_for`).
+
+Usage
+-----
+    python od_aggregates.py ingest 202504-Nakamozu-OD.csv --store od_aggregates
+    python od_aggregates.py ingest 202505-Nakamozu-OD.csv --store od_aggregates
+    python od_aggregates.py info --store od_aggregates
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import csv_encoding
+import od_bins
+import od_store
+
+MANIFEST = "manifest.json"
+DEFAULT_STORE = "od_aggregates"
+REQUIRED_COLUMNS = (od_store.DATE_COLUMN, *od_store.STATION_COLUMNS, *od_store.TIME_COLUMNS)
+
+# table name → (od_bins grouping, bin minutes, value column)
+TABLES = {
+    "daily_departures": ("departure", None, "departures"),
+    "daily_arrivals": ("arrival", None, "arrivals"),
+    "daily_pairs": ("pair", None, "trips"),
+    "hourly_departures": ("departure", 60, "departures"),
+    "hourly_arrivals": ("arrival", 60, "arrivals"),
+}
+
+# ---------------------------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------------------------
+
+def is_store(path: Path) -> bool:
+    return (Path(path) / MANIFEST).is_file()
+
+
+def read_manifest(store: Path) -> dict:
+    path = Path(store) / MANIFEST
+    if not path.exists():
+        return {"columns": None, "ingests": []}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _write_manifest(store: Path, manifest: dict) -> None:
+    path = Path(store) / MANIFEST
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+
+def stored_dates(manifest: dict) -> pd.DatetimeIndex:
+    dates = [d for ingest in manifest["ingests"] for d in ingest["dates"]]
+    return pd.DatetimeIndex(pd.to_datetime(dates)).unique().sort_values()
+
+# ---------------------------------------------------------------------------
+# Ingest
+# ---------------------------------------------------------------------------
+
+def read_header(csv_path: Path, *, encoding: str) -> List[str]:
+    return list(pd.read_csv(csv_path, encoding=encoding, nrows=0).columns)
+
+
+def validate_schema(columns: Sequence[str], manifest: dict, csv_path: Path) -> None:
+    """Raise ``SystemExit`` if *columns* lack OD columns or differ from the store."""
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise SystemExit(f"❌ {csv_path}: missing column(s) {', '.join(missing)}")
+    expected = manifest.get("columns")
+    if expected is not None and list(columns) != list(expected):
+        raise SystemExit(f"❌ {csv_path}: columns {list(columns)} do not match the store {expected}")
+
+
+def _combine(parts: List[pd.DataFrame], name: str) -> pd.DataFrame:
+    """Sum per-chunk aggregates (a day may span chunks)."""
+    _, bin_minutes, value = TABLES[name]
+    df = pd.concat(parts, ignore_index=True)
+    keys = [c for c in df.columns if c != value]
+    for col in keys:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df.groupby(keys, sort=True)[value].sum().reset_index()
+
+
+def aggregate_source(
+    csv_path: Path,
+    *,
+    encoding: str,
+    chunksize: int = od_store.DEFAULT_CHUNKSIZE,
+) -> Dict[str, pd.DataFrame]:
+    """All :data:`TABLES` for one OD CSV, in a single streaming pass."""
+    parts: Dict[str, List[pd.DataFrame]] = {name: [] for name in TABLES}
+    for chunk in od_store.read_od_csv_chunks(csv_path, encoding=encoding, columns=REQUIRED_COLUMNS, chunksize=chunksize):
+        for name, (by, bin_minutes, value) in TABLES.items():
+            parts[name].append(od_bins.aggregate_bins(chunk, by=by, bin_minutes=bin_minutes, value_name=value))
+    if not parts["daily_departures"]:
+        raise SystemExit(f"❌ no rows found in {csv_path}")
+    return {name: _combine(p, name) for name, p in parts.items()}
+
+
+def _partition_path(store: Path, name: str, month: str) -> Path:
+    return Path(store) / name / f"{month}{od_store.COLUMNAR_SUFFIX}"
+
+
+def _write_partition(df: pd.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression="zstd")
+    tmp.replace(path)
+
+
+def ingest(
+    csv_path: Path,
+    store: Path = Path(DEFAULT_STORE),
+    *,
+    encoding: Optional[str] = None,
+    chunksize: int = od_store.DEFAULT_CHUNKSIZE,
+    replace: bool = False,
+) -> dict:
+    """Add one OD CSV to *store*; returns the manifest entry of this ingest."""
+    csv_path, store = Path(csv_path), Path(store)
+    encoding = encoding or csv_encoding.detect_encoding(csv_path)
+    manifest = read_manifest(store)
+    columns = read_header(csv_path, encoding=encoding)
+    validate_schema(columns, manifest, csv_path)
+
+    tables = aggregate_source(csv_path, encoding=encoding, chunksize=chunksize)
+    new_dates = pd.DatetimeIndex(tables["daily_departures"][od_store.DATE_COLUMN]).union(
+        pd.DatetimeIndex(tables["daily_arrivals"][od_store.DATE_COLUMN])
+    ).unique().sort_values()
+    overlap = new_dates.intersection(stored_dates(manifest))
+    if len(overlap) and not replace:
+        raise SystemExit(
+            f"❌ {csv_path}: {len(overlap)} date(s) already in {store} "
+            f"({overlap[0].date()} … {overlap[-1].date()}); use --replace to overwrite them"
+        )
+
+    months = sorted(set(new_dates.strftime("%Y-%m")))
+    for name, df in tables.items():
+        df_month = df[od_store.DATE_COLUMN].dt.strftime("%Y-%m")
+        for month in months:
+            part = df[df_month == month]
+            path = _partition_path(store, name, month)
+            if path.exists():
+                old = pq.read_table(path).to_pandas()
+                old = old[~old[od_store.DATE_COLUMN].isin(new_dates)]
+                part = pd.concat([old, part], ignore_index=True)
+                part = part.sort_values([c for c in part.columns if c != TABLES[name][2]], kind="stable")
+            _write_partition(part.reset_index(drop=True), path)
+
+    new_strs = set(new_dates.strftime("%Y-%m-%d"))
+    for old_ingest in manifest["ingests"]:
+        old_ingest["dates"] = [d for d in old_ingest["dates"] if d not in new_strs]
+    st = csv_path.stat()
+    entry = {
+        "source": str(csv_path.resolve()),
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "encoding": encoding,
+        "ingested_at": datetime.now().isoformat(timespec="seconds"),
+        "months": months,
+        "dates": sorted(new_strs),
+    }
+    manifest["columns"] = columns
+    manifest["ingests"] = [i for i in manifest["ingests"] if i["dates"]] + [entry]
+    _write_manifest(store, manifest)
+    return entry
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+def load_table(
+    store: Path,
+    name: str,
+    *,
+    start: Optional[pd.Timestamp] = None,
+    end: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """Read one aggregate table, touching only the months in [*start*, *end*]."""
+    if name not in TABLES:
+        raise ValueError(f"table must be one of {sorted(TABLES)}, got {name!r}")
+    lo = pd.Timestamp(start).strftime("%Y-%m") if start is not None else None
+    hi = pd.Timestamp(end).strftime("%Y-%m") if end is not None else None
+    files = sorted(p for p in (Path(store) / name).glob(f"*{od_store.COLUMNAR_SUFFIX}")
+                   if (lo is None or p.stem >= lo) and (hi is None or p.stem <= hi))
+    if not files:
+        raise FileNotFoundError(f"no {name} partitions in {store}")
+    df = pd.concat([pq.read_table(p, memory_map=True).to_pandas() for p in files], ignore_index=True)
+    df[od_store.DATE_COLUMN] = df[od_store.DATE_COLUMN].astype("datetime64[ns]")
+    if start is not None:
+        df = df[df[od_store.DATE_COLUMN] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df[od_store.DATE_COLUMN] <= pd.Timestamp(end)]
+    for col in ("station", "origin", "dest"):
+        if col in df.columns:
+            df[col] = pd.Categorical(df[col], categories=sorted(df[col].unique()))
+    return df.reset_index(drop=True)
+
+
+def departures(store: Path, *, bin_minutes: Optional[int] = None) -> pd.DataFrame:
+    """Per-station departures (daily, or hourly with ``bin_minutes=60``)."""
+    if bin_minutes is None:
+        return load_table(store, "daily_departures")
+    if bin_minutes != TABLES["hourly_departures"][1]:
+        raise ValueError(f"the aggregate store keeps {TABLES['hourly_departures'][1]}-minute bins only")
+    return load_table(store, "hourly_departures")
+
+
+def store_mtime(store: Path) -> float:
+    return (Path(store) / MANIFEST).stat().st_mtime
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Maintain the append-only OD aggregate store")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    pi = sub.add_parser("ingest", help="Add one monthly OD CSV")
+    pi.add_argument("csv", type=Path)
+    pi.add_argument("--store", type=Path, default=Path(DEFAULT_STORE))
+    pi.add_argument("--encoding", default=None, help="CSV encoding (default: detect)")
+    pi.add_argument("--chunksize", type=int, default=od_store.DEFAULT_CHUNKSIZE)
+    pi.add_argument("--replace", action="store_true", help="Overwrite dates that are already stored")
+
+    pn = sub.add_parser("info", help="Show what the store contains")
+    pn.add_argument("--store", type=Path, default=Path(DEFAULT_STORE))
+    args = p.parse_args()
+
+    if args.command == "ingest":
+        if not args.csv.exists():
+            raise SystemExit(f"❌ OD CSV not found: {args.csv}")
+        entry = ingest(args.csv, args.store, encoding=args.encoding, chunksize=args.chunksize, replace=args.replace)
+        print(f"✅ {len(entry['dates'])} day(s) from {args.csv} added to {args.store} "
+              f"(months: {', '.join(entry['months'])})")
+    else:
+        if not is_store(args.store):
+            raise SystemExit(f"❌ not an aggregate store: {args.store}")
+        manifest = read_manifest(args.store)
+        for entry in manifest["ingests"]:
+            print(f"{os.path.basename(entry['source'])}: {entry['dates'][0]} … {entry['dates'][-1]} "
+                  f"({len(entry['dates'])} days, ingested {entry['ingested_at']})")
+        dates = stored_dates(manifest)
+        print(f"{len(dates)} days in total")
+
+
+if __name__ == "__main__":
+    main()
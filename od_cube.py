@@ -0,0 +1,283 @@
+"""
+od_cube.py
+==========
+Dense trip-count cube indexed by ``[day, origin_id, dest_id]``.
+
+Per-pair charts used to scan the whole OD table with two boolean masks for
+every station.  The cube is built in **one** grouped pass (``np.bincount`` on a
+flattened index) and saved as a plain ``.npy`` file plus a small JSON sidecar,
+so it can be re-opened with ``mmap`` and any directional daily series becomes
+an array slice:
+
+    cube = cube_for("sorted_output.csv")
+    cube.pair_series("なかもず", "夢洲")      # → pd.Series indexed by date
+    cube.pair_table(hubs=["梅田", "なんば"])   # → tidy data_date/origin/dest/trips
+
+With ``bin_minutes`` the cube gets an extra time-of-day axis
+(``[day, bin, origin_id, dest_id]``) keyed on ``depature_station_time``.
+That axis multiplies the size, so cubes above :data:`MAX_CUBE_CELLS` are
+refused with a pointer to the sparse ``od_bins`` pair counts.
+
+Usage
+-----
+    python od_cube.py sorted_output.csv                    # → sorted_output_cube.npy/.json
+    python od_cube.py sorted_output.csv --bin-minutes 60   # → sorted_output_cube_60min.npy
+    python od_cube.py od_aggregates                        # → od_aggregates/daily_pairs_cube.npy
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import od_aggregates
+import od_bins
+import od_store
+
+CUBE_SUFFIX = "_cube"
+
+# a dense cube larger than this (int32 cells, ~2 GB) is refused; sparse
+# per-bin counts come from od_bins.aggregate_bins(..., by="pair") instead
+MAX_CUBE_CELLS = 500_000_000
+
+# ---------------------------------------------------------------------------
+# Cube container
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ODCube:
+    """Trip counts ``counts[day, (bin,) origin, dest]`` starting at *start*."""
+
+    counts: np.ndarray
+    start: pd.Timestamp
+    stations: List[str]
+    bin_minutes: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        self._ids: Dict[str, int] = {s: i for i, s in enumerate(self.stations)}
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start, periods=self.counts.shape[0], freq="D")
+
+    def station_id(self, name: str) -> int:
+        try:
+            return self._ids[name]
+        except KeyError:
+            raise KeyError(f"station not in cube: {name!r}") from None
+
+    def daily(self) -> np.ndarray:
+        """Return ``[day, origin, dest]`` counts (bins summed if present)."""
+        if self.bin_minutes is None:
+            return self.counts
+        return self.counts.sum(axis=1)
+
+    def pair_series(self, origin: str, dest: str) -> pd.Series:
+        """Daily trips from *origin* to *dest* (0 on days without trips)."""
+        o, d = self.station_id(origin), self.station_id(dest)
+        if self.bin_minutes is None:
+            values = self.counts[:, o, d]
+        else:
+            values = self.counts[:, :, o, d].sum(axis=1)
+        return pd.Series(np.asarray(values), index=self.dates, name=f"{origin}→{dest}")
+
+    def pair_table(self, hubs: Optional[Iterable[str]] = None, *, drop_zeros: bool = True) -> pd.DataFrame:
+        """Tidy ``data_date, origin, dest, trips`` table.
+
+        With *hubs* only pairs that start or end at one of the hubs are kept;
+        otherwise every origin/destination pair is listed.
+        """
+        counts = np.asarray(self.daily())
+        n = len(self.stations)
+        if hubs is None:
+            pair_mask = np.ones((n, n), dtype=bool)
+        else:
+            ids = [self.station_id(h) for h in hubs]
+            pair_mask = np.zeros((n, n), dtype=bool)
+            pair_mask[ids, :] = True
+            pair_mask[:, ids] = True
+        keep = pair_mask[None, :, :] & (counts > 0) if drop_zeros else np.broadcast_to(pair_mask, counts.shape)
+        day, origin, dest = np.nonzero(keep)
+        return pd.DataFrame({
+            "data_date": self.dates[day],
+            "origin": pd.Categorical.from_codes(origin, categories=self.stations),
+            "dest": pd.Categorical.from_codes(dest, categories=self.stations),
+            "trips": counts[day, origin, dest],
+        })
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def build_cube(df: pd.DataFrame, *, bin_minutes: Optional[int] = None, weight_col: Optional[str] = None) -> ODCube:
+    """Count trips per (day, [bin,] origin, dest) in a single pass over *df*.
+
+    *df* needs ``data_date``, ``depature_station`` and ``arrival_station``
+    (plus ``depature_station_time`` in seconds when *bin_minutes* is set, as
+    returned by :func:`od_store.load_od`).  Rows without a departure time are
+    left out of a binned cube.  With *weight_col* each row counts that many
+    trips (pre-aggregated input such as ``od_aggregates`` daily pairs).
+
+    Raises ``ValueError`` when the cube would exceed :data:`MAX_CUBE_CELLS`.
+    """
+    dep_col, arr_col = od_store.STATION_COLUMNS
+    if bin_minutes is not None:
+        bin_ = od_bins.bin_index(df[od_store.TIME_COLUMNS[0]], bin_minutes)
+        df = df[bin_ >= 0]
+        bin_ = bin_[bin_ >= 0]
+
+    stations = sorted(set(df[dep_col].dropna().unique()) | set(df[arr_col].dropna().unique()))
+    if df.empty or not stations:
+        raise ValueError("no OD rows to build a cube from")
+    n = len(stations)
+    origin = pd.Categorical(df[dep_col], categories=stations).codes.astype(np.int64)
+    dest = pd.Categorical(df[arr_col], categories=stations).codes.astype(np.int64)
+
+    dates = df[od_store.DATE_COLUMN].to_numpy(dtype="datetime64[D]")
+    start = dates.min()
+    day = (dates - start).astype(np.int64)
+    n_days = int(day.max()) + 1
+
+    valid = (origin >= 0) & (dest >= 0)
+    if bin_minutes is None:
+        shape = (n_days, n, n)
+        flat = (day * n + origin) * n + dest
+    else:
+        n_bins = od_bins.n_bins_for(bin_, bin_minutes)
+        shape = (n_days, n_bins, n, n)
+        flat = ((day * n_bins + bin_) * n + origin) * n + dest
+
+    cells = int(np.prod(shape))
+    if cells > MAX_CUBE_CELLS:
+        raise ValueError(
+            f"a {' × '.join(map(str, shape))} cube would need {cells * 4 / 2**30:.1f} GB; "
+            "use a wider --bin-minutes or a shorter date range, or sparse per-bin pair counts "
+            "(python od_bins.py SOURCE --bin-minutes N --by pair)"
+        )
+    flat = flat[valid]
+    weights = None if weight_col is None else df[weight_col].to_numpy(dtype=np.float64)[valid]
+    if cells <= max(od_bins._DENSE_LIMIT, 4 * len(flat)):
+        counts = np.bincount(flat, weights=weights, minlength=cells).astype(np.int32)
+    else:
+        # large and sparse: count the occupied cells only and scatter them into
+        # the int32 cube, so no int64/float64 cube-sized temporary is allocated
+        occupied, inverse = np.unique(flat, return_inverse=True)
+        counts = np.zeros(cells, dtype=np.int32)
+        counts[occupied] = np.bincount(inverse, weights=weights, minlength=len(occupied))
+    counts = counts.reshape(shape)
+    return ODCube(counts=counts, start=pd.Timestamp(start), stations=stations, bin_minutes=bin_minutes)
+
+# ---------------------------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------------------------
+
+def cube_path_for(source: Path, bin_minutes: Optional[int] = None) -> Path:
+    """Default cube location for the OD file at *source*."""
+    source = Path(source)
+    if od_aggregates.is_store(source):
+        return source / f"daily_pairs{CUBE_SUFFIX}.npy"
+    suffix = CUBE_SUFFIX if bin_minutes is None else f"{CUBE_SUFFIX}_{bin_minutes}min"
+    return source.with_name(source.stem + suffix + ".npy")
+
+
+def save_cube(cube: ODCube, path: Path) -> Path:
+    """Write ``<path>.npy`` (counts) and ``<path>.json`` (dates, stations).
+
+    Files are replaced atomically so cubes already memory-mapped by another
+    reader keep seeing the old data.
+    """
+    path = Path(path).with_suffix(".npy")
+    meta = {
+        "start": cube.start.strftime("%Y-%m-%d"),
+        "stations": list(cube.stations),
+        "bin_minutes": cube.bin_minutes,
+    }
+    tmp = path.with_name(path.stem + ".tmp.npy")
+    np.save(tmp, np.ascontiguousarray(cube.counts))
+    tmp_meta = tmp.with_suffix(".json")
+    tmp_meta.write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+    tmp_meta.replace(path.with_suffix(".json"))
+    return path
+
+
+def load_cube(path: Path, *, mmap: bool = True) -> ODCube:
+    """Open a cube written by :func:`save_cube` (memory-mapped by default)."""
+    path = Path(path).with_suffix(".npy")
+    meta = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+    counts = np.load(path, mmap_mode="r" if mmap else None)
+    return ODCube(
+        counts=counts,
+        start=pd.Timestamp(meta["start"]),
+        stations=list(meta["stations"]),
+        bin_minutes=meta.get("bin_minutes"),
+    )
+
+
+def _source_mtime(source: Path) -> float:
+    if od_aggregates.is_store(source):
+        return od_aggregates.store_mtime(source)
+    candidates = [p for p in (source, od_store.columnar_source(source)) if p is not None and p.exists()]
+    if not candidates:
+        raise FileNotFoundError(source)
+    return max(p.stat().st_mtime for p in candidates)
+
+
+def cube_for(
+    source: Path,
+    *,
+    cube_path: Optional[Path] = None,
+    bin_minutes: Optional[int] = None,
+    rebuild: bool = False,
+) -> ODCube:
+    """Load the cube for *source*, (re)building it when missing or stale."""
+    source = Path(source)
+    cube_path = Path(cube_path) if cube_path else cube_path_for(source, bin_minutes)
+    meta_path = cube_path.with_suffix(".json")
+
+    if not rebuild and cube_path.exists() and meta_path.exists():
+        fresh = cube_path.stat().st_mtime >= _source_mtime(source)
+        if fresh and json.loads(meta_path.read_text(encoding="utf-8")).get("bin_minutes") == bin_minutes:
+            return load_cube(cube_path)
+
+    if od_aggregates.is_store(source):
+        # built from the stored daily pair counts; raw OD rows are not read
+        if bin_minutes is not None:
+            raise ValueError("the aggregate store keeps daily pair counts only; bin_minutes is not supported")
+        pairs = od_aggregates.load_table(source, "daily_pairs")
+        pairs = pairs.rename(columns=dict(zip(("origin", "dest"), od_store.STATION_COLUMNS)))
+        cube = build_cube(pairs, weight_col="trips")
+    else:
+        columns = [od_store.DATE_COLUMN, *od_store.STATION_COLUMNS]
+        if bin_minutes is not None:
+            columns.append(od_store.TIME_COLUMNS[0])
+        cube = build_cube(od_store.load_od(source, columns=columns), bin_minutes=bin_minutes)
+    save_cube(cube, cube_path)
+    return load_cube(cube_path)
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Build a date × origin × destination trip-count cube from OD data")
+    p.add_argument("source", type=Path, help="OD CSV, Parquet or od_aggregates store (e.g. sorted_output.csv)")
+    p.add_argument("-o", "--outfile", type=Path, default=None, help="Cube .npy path (default: <source>_cube.npy)")
+    p.add_argument("--bin-minutes", type=int, default=None, help="Add a time-of-day axis with this bin width")
+    args = p.parse_args()
+
+    try:
+        cube = cube_for(args.source, cube_path=args.outfile, bin_minutes=args.bin_minutes, rebuild=True)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    out = args.outfile or cube_path_for(args.source, args.bin_minutes)
+    print(f"✅ cube {cube.counts.shape} ({len(cube.dates)} days × {len(cube.stations)} stations) written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+od_store.py
+===========
+Columnar cache for the OD (origin–destination) ridership file.
+
+Every analysis script starts from the cp932 ``202504-Nakamozu-OD.csv`` /
+``sorted_output.csv``.  Decoding Shift-JIS text dominates their run time, so
+this module converts the CSV **once** into a Parquet file and lets the
+loaders read it back with memory mapping:
+
+  • ``depature_station`` / ``arrival_station`` → dictionary (categorical)
+  • ``data_date``                              → date32
+  • ``*_time``                                 → int32 seconds since midnight
+
+:func:`load_od` reads only the requested columns and pushes date-range and
+station filters down to the Parquet row groups.  A CSV path is accepted as
+well; if ``<name>.parquet`` sits next to it, is newer and was written with the
+current :data:`CACHE_VERSION`, the cache is used.
+
+Usage
+-----
+    python od_store.py 202504-Nakamozu-OD.csv        # → 202504-Nakamozu-OD.parquet
+    python od_store.py sorted_output.csv -o sorted_output.parquet
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import station_master
+
+DATE_COLUMN = "data_date"
+STATION_COLUMNS = ("depature_station", "arrival_station")
+TIME_COLUMNS = ("depature_station_time", "arrival_station_time")
+
+DEFAULT_ENCODING = "cp932"
+DEFAULT_CHUNKSIZE = 1_000_000
+COLUMNAR_SUFFIX = ".parquet"
+
+# stored in the Parquet schema metadata; bump whenever normalise_od_frame (or
+# the station_master canonicalisation it relies on) changes, so older caches
+# are ignored instead of returning stale station names
+CACHE_VERSION = 2
+VERSION_KEY = b"metro_od_version"
+
+# ---------------------------------------------------------------------------
+# Column conversions
+# ---------------------------------------------------------------------------
+
+def normalise_station(values: pd.Series) -> pd.Series:
+    """Canonical station names (spaces stripped, aliases resolved; see station_master.py).
+
+    Categorical over the names present, sorted like ``astype("category")``.
+    """
+    return station_master.canonical(values).cat.remove_unused_categories()
+
+
+def time_to_seconds(values: pd.Series) -> pd.Series:
+    """Vectorised ``"HH:MM:SS"`` → seconds since midnight (nullable Int32).
+
+    A day has at most 86 400 distinct time strings, so only the unique
+    values are parsed and the result is gathered back by code.
+    """
+    values = pd.Series(values, copy=False)
+    codes, uniques = pd.factorize(values)
+    secs = pd.to_timedelta(pd.Series(uniques), errors="coerce").dt.total_seconds().round()
+    parsed = np.append(secs.to_numpy(dtype="float64", na_value=np.nan), np.nan)[codes]
+    return pd.Series(parsed, index=values.index).astype("Int32")
+
+
+_MMSS_TABLE = np.array([f":{m:02}:{x:02}" for m in range(60) for x in range(60)], dtype=object)
+
+
+def seconds_to_hms(seconds: pd.Series) -> pd.Series:
+    """Vectorised seconds → ``"HH:MM:SS"`` (hours may exceed 24, missing → "")."""
+    secs = pd.Series(seconds, copy=False)
+    values = secs.to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(values)
+    values = np.where(missing, 0, values).astype(np.int64)
+    hours = values // 3600
+    hour_table = np.array([f"{h:02}" for h in range(int(hours.max(initial=0)) + 1)], dtype=object)
+    out = hour_table[hours] + _MMSS_TABLE[values % 3600]
+    out[missing] = ""
+    return pd.Series(out, index=secs.index, dtype=object)
+
+
+def normalise_od_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert raw OD CSV columns to their canonical in-memory dtypes."""
+    df = df.copy()
+    if DATE_COLUMN in df.columns:
+        df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN]).astype("datetime64[ns]")
+    for col in STATION_COLUMNS:
+        if col in df.columns:
+            df[col] = normalise_station(df[col]).astype("category")
+    for col in TIME_COLUMNS:
+        if col in df.columns:
+            df[col] = time_to_seconds(df[col])
+    return df
+
+
+def read_od_csv_chunks(
+    path: Path,
+    *,
+    encoding: str = DEFAULT_ENCODING,
+    columns: Optional[Sequence[str]] = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> Iterator[pd.DataFrame]:
+    """Stream the OD CSV in normalised chunks of *chunksize* rows."""
+    reader = pd.read_csv(
+        path,
+        encoding=encoding,
+        usecols=list(columns) if columns else None,
+        dtype="string",
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            yield normalise_od_frame(chunk)
+
+# ---------------------------------------------------------------------------
+# Arrow conversion
+# ---------------------------------------------------------------------------
+
+def _arrow_type(col: str) -> pa.DataType:
+    if col == DATE_COLUMN:
+        return pa.date32()
+    if col in STATION_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if col in TIME_COLUMNS:
+        return pa.int32()
+    return pa.string()
+
+
+def _to_arrow(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    arrays = []
+    for field in schema:
+        s = df[field.name]
+        if field.name == DATE_COLUMN:
+            arr = pa.array(s.dt.date, type=pa.date32())
+        elif field.name in STATION_COLUMNS:
+            arr = pa.array(s.astype("string"), type=pa.string()).dictionary_encode()
+        elif field.name in TIME_COLUMNS:
+            arr = pa.array(s, type=pa.int32())
+        else:
+            arr = pa.array(s.astype("string"), type=pa.string())
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+# ---------------------------------------------------------------------------
+# Ingest
+# ---------------------------------------------------------------------------
+
+def columnar_path_for(path: Path) -> Path:
+    """Return the cache location used for the CSV at *path*."""
+    return Path(path).with_suffix(COLUMNAR_SUFFIX)
+
+
+def ingest(
+    csv_path: Path,
+    out_path: Optional[Path] = None,
+    *,
+    encoding: str = DEFAULT_ENCODING,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> Path:
+    """Convert the OD CSV at *csv_path* into a Parquet file (one row group per chunk)."""
+    csv_path = Path(csv_path)
+    out_path = Path(out_path) if out_path else columnar_path_for(csv_path)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+
+    writer: Optional[pq.ParquetWriter] = None
+    schema: Optional[pa.Schema] = None
+    try:
+        for chunk in read_od_csv_chunks(csv_path, encoding=encoding, chunksize=chunksize):
+            if schema is None:
+                schema = pa.schema([(c, _arrow_type(c)) for c in chunk.columns],
+                                   metadata={VERSION_KEY: str(CACHE_VERSION).encode()})
+                writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+            writer.write_table(_to_arrow(chunk, schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if schema is None:
+        raise SystemExit(f"❌ no rows found in {csv_path}")
+    tmp_path.replace(out_path)
+    return out_path
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+_warned: Set[Path] = set()
+
+
+def cache_version(path: Path) -> Optional[int]:
+    """The :data:`CACHE_VERSION` a Parquet file was written with (``None`` if unknown)."""
+    value = (pq.read_schema(path).metadata or {}).get(VERSION_KEY)
+    return int(value) if value else None
+
+
+def columnar_source(path: Path) -> Optional[Path]:
+    """Return the Parquet file to read for *path*, or ``None`` if only CSV exists.
+
+    *path* may be the Parquet file itself or a CSV with an up-to-date cache
+    next to it.  A cache from another :data:`CACHE_VERSION` is ignored (the
+    CSV is read instead); a Parquet file given directly must match it.
+    """
+    path = Path(path)
+    if path.suffix == COLUMNAR_SUFFIX:
+        if cache_version(path) != CACHE_VERSION:
+            raise SystemExit(f"❌ {path} was written by an older od_store.py; rebuild it: python od_store.py <csv>")
+        return path
+    cache = columnar_path_for(path)
+    if not cache.exists() or (path.exists() and cache.stat().st_mtime < path.stat().st_mtime):
+        return None
+    if cache_version(cache) != CACHE_VERSION:
+        if cache not in _warned:
+            _warned.add(cache)
+            print(f"⚠️  ignoring outdated cache {cache} (rebuild with: python od_store.py {path})")
+        return None
+    return cache
+
+
+def _parquet_filters(
+    start: Optional[pd.Timestamp],
+    end: Optional[pd.Timestamp],
+    origins: Optional[Iterable[str]],
+    destinations: Optional[Iterable[str]],
+) -> Optional[List[tuple]]:
+    filters: List[tuple] = []
+    if start is not None:
+        filters.append((DATE_COLUMN, ">=", pd.Timestamp(start).date()))
+    if end is not None:
+        filters.append((DATE_COLUMN, "<=", pd.Timestamp(end).date()))
+    if origins is not None:
+        filters.append((STATION_COLUMNS[0], "in", list(origins)))
+    if destinations is not None:
+        filters.append((STATION_COLUMNS[1], "in", list(destinations)))
+    return filters or None
+
+
+def _apply_filters(
+    df: pd.DataFrame,
+    start: Optional[pd.Timestamp],
+    end: Optional[pd.Timestamp],
+    origins: Optional[Iterable[str]],
+    destinations: Optional[Iterable[str]],
+) -> pd.DataFrame:
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= df[DATE_COLUMN] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= df[DATE_COLUMN] <= pd.Timestamp(end)
+    if origins is not None:
+        mask &= df[STATION_COLUMNS[0]].isin(list(origins))
+    if destinations is not None:
+        mask &= df[STATION_COLUMNS[1]].isin(list(destinations))
+    return df if mask.all() else df[mask].reset_index(drop=True)
+
+
+def load_od(
+    path: Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    start: Optional[pd.Timestamp] = None,
+    end: Optional[pd.Timestamp] = None,
+    origins: Optional[Iterable[str]] = None,
+    destinations: Optional[Iterable[str]] = None,
+    encoding: str = DEFAULT_ENCODING,
+) -> pd.DataFrame:
+    """Load OD rows as a DataFrame in canonical dtypes.
+
+    Reads from the Parquet cache when available (memory-mapped, only
+    *columns*, filters pushed down); otherwise parses the CSV and applies the
+    same filters in memory.  *start* / *end* are inclusive dates;
+    *origins* / *destinations* restrict the station columns.
+    """
+    columns = list(columns) if columns else None
+    needed = columns
+    if columns is not None:
+        # filter columns must be read even if the caller does not want them
+        needed = list(columns)
+        for col, value in ((DATE_COLUMN, start if start is not None else end),
+                           (STATION_COLUMNS[0], origins),
+                           (STATION_COLUMNS[1], destinations)):
+            if value is not None and col not in needed:
+                needed.append(col)
+
+    src = columnar_source(Path(path))
+    if src is None:
+        df = pd.read_csv(path, encoding=encoding, usecols=needed, dtype="string")
+        df = _apply_filters(normalise_od_frame(df), start, end, origins, destinations)
+        return df[columns] if columns is not None else df
+
+    table = pq.read_table(
+        src,
+        columns=needed,
+        filters=_parquet_filters(start, end, origins, destinations),
+        memory_map=True,
+    )
+    df = _from_arrow(table)
+    return df[columns] if columns is not None else df
+
+
+def iter_od_chunks(
+    path: Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    encoding: str = DEFAULT_ENCODING,
+) -> Iterator[pd.DataFrame]:
+    """Stream OD rows in chunks of at most *chunksize* rows (Parquet cache or CSV)."""
+    src = columnar_source(Path(path))
+    if src is None:
+        yield from read_od_csv_chunks(path, encoding=encoding, columns=columns, chunksize=chunksize)
+        return
+    pf = pq.ParquetFile(src, memory_map=True)
+    for batch in pf.iter_batches(batch_size=chunksize, columns=list(columns) if columns else None):
+        yield _from_arrow(pa.Table.from_batches([batch]))
+
+
+def _from_arrow(table: pa.Table) -> pd.DataFrame:
+    df = table.to_pandas(date_as_object=False)
+    if DATE_COLUMN in df.columns:
+        df[DATE_COLUMN] = df[DATE_COLUMN].astype("datetime64[ns]")
+    for col in STATION_COLUMNS:
+        if col in df.columns:
+            # dictionary order depends on the file; keep categories sorted like the CSV path
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    for col in TIME_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("Int32")
+    return df
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Convert an OD ridership CSV into a columnar Parquet cache")
+    p.add_argument("csv", type=Path, help="OD CSV (e.g. 202504-Nakamozu-OD.csv or sorted_output.csv)")
+    p.add_argument("-o", "--outfile", type=Path, default=None, help="Output Parquet (default: <csv>.parquet)")
+    p.add_argument("--encoding", default=DEFAULT_ENCODING)
+    p.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows per row group")
+    args = p.parse_args()
+
+    if not args.csv.exists():
+        raise SystemExit(f"❌ OD CSV not found: {args.csv}")
+    out = ingest(args.csv, args.outfile, encoding=args.encoding, chunksize=args.chunksize)
+    meta = pq.ParquetFile(out).metadata
+    print(f"✅ {meta.num_rows} rows ({meta.num_row_groups} row groups) written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
+import argparse
+import csv
+import heapq
 import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 
+import od_store
+
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -13,16 +21,115 @@ input_csv = os.path.join(script_dir, input_filename)
 output_csv = os.path.join(script_dir, output_filename)
 
 
-df = pd.read_csv(input_csv, encoding="cp932")
+# ソートキー: data_date の日数 * 10**6 + depature_station_time の秒数
+KEY_WIDTH = 12
+MISSING_TIME = 999_999  # 時刻が欠損している行はその日の最後に並べる
+MISSING_DAY = 999_999   # 日付が読めない行は最後に並べる
+
+
+def read_raw(path, *, encoding='cp932', chunksize=None):
+    """OD CSV を文字列のまま読む（駅名や到着時刻は元の値のまま出力するため）．"""
+    return pd.read_csv(path, encoding=encoding, dtype=str, na_filter=False, chunksize=chunksize)
+
+
+def prepare(df):
+    """(ソートキー, 出力用の DataFrame) を返す．
+
+    出力では data_date を YYYY/MM/DD，depature_station_time を HH:MM:SS に
+    そろえ，それ以外の列は入力の文字列をそのまま残す．
+    """
+    # 日付の種類は少ないので，ユニーク値だけを変換して codes で引き戻す
+    codes, uniques = pd.factorize(df['data_date'])
+    dates = pd.to_datetime(pd.Series(uniques, dtype=object), errors='coerce')
+    days = np.where(dates.isna(), MISSING_DAY,
+                    dates.to_numpy(dtype='datetime64[D]').astype(np.int64))
+    text = dates.dt.strftime('%Y/%m/%d').fillna('').to_numpy(dtype=object)
+    secs = od_store.time_to_seconds(df['depature_station_time'])
+
+    keys = (np.append(days, MISSING_DAY)[codes] * 1_000_000
+            + secs.fillna(MISSING_TIME).to_numpy(dtype=np.int64))
+    out = df.copy()
+    out['data_date'] = np.append(text, '')[codes]
+    out['depature_station_time'] = od_store.seconds_to_hms(secs)
+    return keys, out
+
+
+def sort_in_memory(input_csv, output_csv, *, encoding='cp932'):
+    df = read_raw(input_csv, encoding=encoding)
+    keys, out = prepare(df)
+    order = np.argsort(keys, kind='stable')
+    # --external と同じバイト列になるよう改行は常に \n
+    out.iloc[order].to_csv(output_csv, index=False, encoding=encoding, lineterminator='\n')
+
+
+def _check_no_newlines(chunk):
+    """ランは1行1レコードとしてマージするので，改行を含むフィールドは扱えない．"""
+    for col in chunk.columns:
+        if chunk[col].str.contains('[\r\n]', regex=True).any():
+            raise SystemExit(f'❌ column {col!r} has a value with an embedded newline; '
+                             'use the in-memory sort (without --external)')
+
+
+def _write_run(chunk, run_dir, run_no, encoding):
+    """チャンクをソートし，キーを先頭列に付けた一時ファイル（ラン）として書き出す．"""
+    _check_no_newlines(chunk)
+    keys, run = prepare(chunk)
+    order = np.argsort(keys, kind='stable')
+    run = run.iloc[order]
+    run.insert(0, '_key', pd.Series(keys[order], index=run.index).astype(str).str.zfill(KEY_WIDTH))
+    path = os.path.join(run_dir, f'run_{run_no:05d}.csv')
+    run.to_csv(path, index=False, header=False, encoding=encoding, lineterminator='\n')
+    return path, list(run.columns[1:])
+
+
+def sort_external(input_csv, output_csv, *, encoding='cp932', chunksize=1_000_000, tmpdir=None):
+    """メモリ使用量をチャンクサイズで抑えた外部マージソート．
+
+    入力を chunksize 行ずつ読み込んでソート済みランを一時ディレクトリに書き，
+    最後に全ランを heapq.merge で k-way マージして出力する．
+    同じキーの行は入力順を保つ（sort_in_memory と同じバイト列になる）．
+    マージは行単位なので，改行を含むフィールドがあればエラーにする．
+    """
+    with tempfile.TemporaryDirectory(prefix='od_sort_', dir=tmpdir) as run_dir:
+        runs = []
+        header = None
+        with read_raw(input_csv, encoding=encoding, chunksize=chunksize) as reader:
+            for run_no, chunk in enumerate(reader):
+                path, header = _write_run(chunk, run_dir, run_no, encoding)
+                runs.append(path)
+                print(f'  run {run_no + 1}: {len(chunk)} rows')
+
+        if header is None:
+            raise SystemExit(f'❌ no rows found in {input_csv}')
+
+        files = [open(path, encoding=encoding, newline='') for path in runs]
+        try:
+            with open(output_csv, 'w', encoding=encoding, newline='') as out:
+                csv.writer(out, lineterminator='\n').writerow(header)
+                # キーは固定幅のゼロ埋め文字列なので文字列比較で数値順になる
+                for line in heapq.merge(*files, key=lambda line: line[:KEY_WIDTH]):
+                    out.write(line[KEY_WIDTH + 1:])
+        finally:
+            for f in files:
+                f.close()
+
 
-df['data_date'] = pd.to_datetime(df['data_date'])
-df['depature_station_time'] = pd.to_timedelta(df['depature_station_time'])
+def main():
+    p = argparse.ArgumentParser(description='Sort the OD ridership CSV by data_date and depature_station_time')
+    p.add_argument('-i', '--input', default=input_csv, help=f'Input OD CSV (default: {input_filename})')
+    p.add_argument('-o', '--output', default=output_csv, help=f'Output CSV (default: {output_filename})')
+    p.add_argument('--encoding', default='cp932')
+    p.add_argument('--external', action='store_true', help='Out-of-core external merge sort (bounded memory)')
+    p.add_argument('--chunksize', type=int, default=1_000_000, help='Rows per sorted run in --external mode')
+    p.add_argument('--tmpdir', default=None, help='Directory for temporary runs in --external mode')
+    args = p.parse_args()
 
-df_sorted = df.sort_values(['data_date', 'depature_station_time'])
+    if args.external:
+        sort_external(args.input, args.output, encoding=args.encoding, chunksize=args.chunksize, tmpdir=args.tmpdir)
+    else:
+        sort_in_memory(args.input, args.output, encoding=args.encoding)
+    print(f'✅ sorted rows written to {args.output}')
 
-df_sorted['data_date'] = df_sorted['data_date'].dt.strftime('%Y/%m/%d')
-df_sorted['depature_station_time'] = df_sorted['depature_station_time'].apply(
-    lambda x: '{:02}:{:02}:{:02}'.format(x.components.hours, x.components.minutes, x.components.seconds)
-)
 
-df_sorted.to_csv(output_csv, index=False, encoding="cp932")
+if __name__ == '__main__':
+    main()
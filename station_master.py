@@ -0,0 +1,256 @@
+"""
+station_master.py
+=================
+Canonical station table shared by the analysis scripts.
+
+Station handling used to be string based everywhere: every loader stripped
+full-width spaces on its own (``.str.replace("　", "")``), the 13 stations of
+the OD data that are not on the Osaka Metro route map (``大阪梅田``,
+``大阪難波``, ``学園前``, … – see ``report/report.md``) were picked out by
+hand, and every filter compared Python strings.  This module keeps one table
+
+    station_id  name  aliases  operator  lines  latitude  longitude  on_route_map
+
+built from ``get_school_loc/station_coordinates_157.csv`` (IDs 1–157 in the
+order of that file, which follows the route map) plus the 13 extra stations
+(IDs 158–170, no coordinates).  Names are resolved once per *distinct* value:
+
+  • :func:`canonical` – normalised / de-aliased names as a categorical whose
+    categories are the sorted master names, so ``isin``, ``groupby`` and
+    merges work on small integer codes (and keep the sorted order the
+    scripts already produce);
+  • :func:`resolve`   – ``station_id`` (``Int16``, ``<NA>`` for unknown names).
+
+Usage
+-----
+    python station_master.py                              # summary
+    python station_master.py -o station_master.csv        # dump the table
+    python station_master.py --check 202504-Nakamozu-OD.csv
+"""
+from __future__ import annotations
+
+import argparse
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_COORDINATES = Path(__file__).resolve().parent / "get_school_loc" / "station_coordinates_157.csv"
+
+# ---------------------------------------------------------------------------
+# Reference data
+# ---------------------------------------------------------------------------
+
+# line → (operator, stations in route order); includes the through-service
+# lines drawn on the Osaka Metro route map
+LINES: Dict[str, Tuple[str, str]] = {
+    "御堂筋線": ("大阪メトロ", "江坂 東三国 新大阪 西中島南方 中津 梅田 淀屋橋 本町 心斎橋 なんば 大国町 動物園前 "
+                        "天王寺 昭和町 西田辺 長居 あびこ 北花田 新金岡 なかもず"),
+    "谷町線": ("大阪メトロ", "大日 守口 太子橋今市 千林大宮 関目高殿 野江内代 都島 天神橋筋六丁目 中崎町 東梅田 南森町 "
+                       "天満橋 谷町四丁目 谷町六丁目 谷町九丁目 四天王寺前夕陽ヶ丘 天王寺 阿倍野 文の里 田辺 "
+                       "駒川中野 平野 喜連瓜破 出戸 長原 八尾南"),
+    "四つ橋線": ("大阪メトロ", "西梅田 肥後橋 本町 四ツ橋 なんば 大国町 花園町 岸里 玉出 北加賀屋 住之江公園"),
+    "中央線": ("大阪メトロ", "夢洲 コスモスクエア 大阪港 朝潮橋 弁天町 九条 阿波座 本町 堺筋本町 谷町四丁目 森ノ宮 "
+                       "緑橋 深江橋 高井田 長田"),
+    "千日前線": ("大阪メトロ", "野田阪神 玉川 阿波座 西長堀 桜川 なんば 日本橋 谷町九丁目 鶴橋 今里 新深江 小路 "
+                         "北巽 南巽"),
+    "堺筋線": ("大阪メトロ", "天神橋筋六丁目 扇町 南森町 北浜 堺筋本町 長堀橋 日本橋 恵美須町 動物園前 天下茶屋"),
+    "長堀鶴見緑地線": ("大阪メトロ", "大正 ドーム前千代崎 西長堀 西大橋 心斎橋 長堀橋 松屋町 谷町六丁目 玉造 森ノ宮 "
+                              "大阪ビジネスパーク 京橋 蒲生四丁目 鴫野 今福鶴見 横堤 鶴見緑地 門真南"),
+    "今里筋線": ("大阪メトロ", "井高野 瑞光四丁目 だいどう豊里 太子橋今市 清水 新森古市 関目成育 蒲生四丁目 鴫野 "
+                         "緑橋 今里"),
+    "南港ポートタウン線": ("大阪メトロ", "コスモスクエア トレードセンター前 中ふ頭 ポートタウン西 ポートタウン東 "
+                                "フェリーターミナル 南港東 南港口 平林 住之江公園"),
+    "北大阪急行線": ("北大阪急行電鉄", "江坂 緑地公園 桃山台 千里中央 箕面船場阪大前 箕面萱野"),
+    "阪急千里線": ("阪急電鉄", "天神橋筋六丁目 柴島 淡路 下新庄 吹田 豊津 関大前 千里山 南千里 山田 北千里"),
+    "阪急京都線": ("阪急電鉄", "淡路 上新庄 相川 正雀 摂津市 南茨木 茨木市 総持寺 富田 高槻市 上牧 水無瀬 大山崎 "
+                          "西山天王山 長岡天神 西向日 東向日 洛西口 桂 西京極 西院 大宮 烏丸 京都河原町"),
+    "阪急嵐山線": ("阪急電鉄", "桂 上桂 松尾大社 嵐山"),
+    "近鉄けいはんな線": ("近畿日本鉄道", "長田 荒本 吉田 新石切 生駒 白庭台 学研北生駒 学研奈良登美ヶ丘"),
+}
+
+# stations in the OD data that are not on the route map (report/report.md, §2)
+OFF_MAP_STATIONS: Dict[str, Tuple[str, ...]] = {
+    "一分": ("近鉄生駒線",),
+    "南方": ("阪急京都線",),
+    "大阪梅田": ("阪急京都線", "阪急宝塚線", "阪急神戸線"),
+    "大阪難波": ("近鉄難波線", "阪神なんば線"),
+    "学園前": ("近鉄奈良線",),
+    "宝塚": ("阪急宝塚線", "阪急今津線"),
+    "富雄": ("近鉄奈良線",),
+    "崇禅寺": ("阪急京都線",),
+    "新祝園": ("近鉄京都線",),
+    "東山": ("近鉄生駒線",),
+    "菖蒲池": ("近鉄奈良線",),
+    "萩の台": ("近鉄生駒線",),
+    "高の原": ("近鉄京都線",),
+}
+_LINE_OPERATORS = {"近鉄": "近畿日本鉄道", "阪急": "阪急電鉄", "阪神": "阪神電気鉄道"}
+
+# canonical name → other spellings seen in hand-made tables
+ALIASES: Dict[str, Tuple[str, ...]] = {
+    "なんば": ("難波",),
+    "天神橋筋六丁目": ("天六", "天神橋筋6丁目"),
+    "谷町四丁目": ("谷四", "谷町4丁目"),
+    "谷町六丁目": ("谷六", "谷町6丁目"),
+    "谷町九丁目": ("谷九", "谷町9丁目"),
+    "蒲生四丁目": ("蒲生4丁目",),
+    "瑞光四丁目": ("瑞光4丁目",),
+    "四天王寺前夕陽ヶ丘": ("四天王寺前夕陽ケ丘", "四天王寺前"),
+    "学研奈良登美ヶ丘": ("学研奈良登美ケ丘",),
+    "ドーム前千代崎": ("ドーム前",),
+    "大阪ビジネスパーク": ("OBP",),
+    "箕面船場阪大前": ("箕面船場",),
+    "京都河原町": ("河原町",),
+}
+
+# ---------------------------------------------------------------------------
+# Names
+# ---------------------------------------------------------------------------
+
+def normalise_name(name: str) -> str:
+    """NFKC-normalise and drop all (full-width) spaces: ``"なかもず　"`` → ``"なかもず"``."""
+    return "".join(unicodedata.normalize("NFKC", str(name)).split())
+
+
+def _operators(lines: Iterable[str]) -> Tuple[str, ...]:
+    ops: List[str] = []
+    for line in lines:
+        op = LINES[line][0] if line in LINES else _LINE_OPERATORS.get(line[:2], "")
+        if op and op not in ops:
+            ops.append(op)
+    return tuple(ops)
+
+# ---------------------------------------------------------------------------
+# Master table
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=4)
+def load_master(path: Optional[Path] = None) -> pd.DataFrame:
+    """The station table (cached).  *path* defaults to ``station_coordinates_157.csv``."""
+    coords = pd.read_csv(path or DEFAULT_COORDINATES, encoding="utf-8-sig")
+    names = [normalise_name(n) for n in coords["name"]]
+
+    lines_of: Dict[str, List[str]] = {}
+    for line, (_, stations) in LINES.items():
+        for st in stations.split():
+            lines_of.setdefault(st, []).append(line)
+    for st, lines in OFF_MAP_STATIONS.items():
+        lines_of.setdefault(st, []).extend(lines)
+
+    extra = [st for st in OFF_MAP_STATIONS if st not in names]
+    all_names = names + extra
+    n_map = len(names)
+    df = pd.DataFrame({
+        "station_id": np.arange(1, len(all_names) + 1, dtype=np.int16),
+        "name": all_names,
+        "aliases": [ALIASES.get(st, ()) for st in all_names],
+        "operator": [_operators(lines_of.get(st, ())) for st in all_names],
+        "lines": [tuple(lines_of.get(st, ())) for st in all_names],
+        "latitude": np.append(coords["latitude"].to_numpy(dtype=float), np.full(len(extra), np.nan)),
+        "longitude": np.append(coords["longitude"].to_numpy(dtype=float), np.full(len(extra), np.nan)),
+        "on_route_map": np.arange(len(all_names)) < n_map,
+    })
+    return df
+
+
+@lru_cache(maxsize=4)
+def _lookup(path: Optional[Path] = None) -> Dict[str, int]:
+    """Normalised name or alias → station_id."""
+    master = load_master(path)
+    table: Dict[str, int] = {}
+    for sid, name, aliases in zip(master["station_id"], master["name"], master["aliases"]):
+        for key in (name, *aliases):
+            table.setdefault(normalise_name(key), int(sid))
+    return table
+
+
+def station_dtype(extra: Iterable[str] = (), *, path: Optional[Path] = None) -> pd.CategoricalDtype:
+    """Categorical dtype over the sorted master names (plus *extra* unknown names)."""
+    names = set(load_master(path)["name"])
+    return pd.CategoricalDtype(sorted(names.union(extra)))
+
+
+def _distinct(values) -> Tuple[pd.Series, np.ndarray, list]:
+    values = pd.Series(values, copy=False)
+    codes, uniques = pd.factorize(values)
+    return values, codes, [normalise_name(u) for u in uniques]
+
+
+def canonical(values, *, path: Optional[Path] = None) -> pd.Series:
+    """Station names normalised and de-aliased, as a master-categorical Series.
+
+    Names that are not in the master table are kept (normalised) as extra
+    categories; missing values stay missing.
+    """
+    values, codes, uniques = _distinct(values)
+    lookup = _lookup(path)
+    names = load_master(path)["name"].to_numpy()
+    resolved = [names[lookup[u] - 1] if u in lookup else u for u in uniques]
+    dtype = station_dtype(set(resolved), path=path)
+    new_codes = np.append(dtype.categories.get_indexer(resolved), -1)[codes]
+    return pd.Series(pd.Categorical.from_codes(new_codes, dtype=dtype), index=values.index, name=values.name)
+
+
+def resolve(values, *, path: Optional[Path] = None) -> pd.Series:
+    """``station_id`` for every name (``Int16``; ``<NA>`` for unknown or missing names)."""
+    values, codes, uniques = _distinct(values)
+    lookup = _lookup(path)
+    ids = np.array([lookup.get(u, -1) for u in uniques] + [-1], dtype=np.int16)[codes]
+    out = pd.array(ids, dtype="Int16")
+    out[ids < 0] = pd.NA
+    return pd.Series(out, index=values.index, name="station_id")
+
+
+def names_for(ids, *, path: Optional[Path] = None) -> pd.Series:
+    """Inverse of :func:`resolve`."""
+    ids = pd.Series(ids, copy=False)
+    names = pd.Series(load_master(path)["name"].to_numpy(), index=load_master(path)["station_id"])
+    return pd.Series(names.reindex(ids.astype("Int16")).to_numpy(), index=ids.index, name="station")
+
+
+def on_route_map(values, *, path: Optional[Path] = None) -> np.ndarray:
+    """True for stations on the Osaka Metro route map (the 157 analysed stations)."""
+    ids = resolve(values, path=path)
+    flags = np.append(False, load_master(path)["on_route_map"].to_numpy())
+    return flags[ids.fillna(0).to_numpy(dtype=np.int64)]
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Show, dump or check against the station master table")
+    p.add_argument("--coordinates", type=Path, default=None, help=f"Station coordinates CSV (default: {DEFAULT_COORDINATES.name})")
+    p.add_argument("-o", "--outfile", type=Path, default=None, help="Write the table as CSV")
+    p.add_argument("--check", type=Path, default=None, help="OD CSV / Parquet whose station names are checked")
+    p.add_argument("--encoding", default="cp932", help="Encoding of --check CSV (default cp932)")
+    args = p.parse_args()
+
+    master = load_master(args.coordinates)
+    print(f"{len(master)} stations ({int(master['on_route_map'].sum())} on the route map)")
+    if args.outfile:
+        out = master.copy()
+        for col in ("aliases", "operator", "lines"):
+            out[col] = out[col].map("|".join)
+        out.to_csv(args.outfile, index=False, encoding="utf-8-sig")
+        print(f"✅ table written to {args.outfile}")
+
+    if args.check:
+        import od_store
+
+        df = od_store.load_od(args.check, columns=list(od_store.STATION_COLUMNS), encoding=args.encoding)
+        names = pd.Series(pd.unique(np.concatenate([df[c].astype(str).to_numpy() for c in od_store.STATION_COLUMNS])))
+        ids = resolve(names, path=args.coordinates)
+        unknown = sorted(names[ids.isna()])
+        off_map = sorted(names[ids.notna() & ~on_route_map(names, path=args.coordinates)])
+        print(f"{len(names)} stations in {args.check}")
+        print(f"  not on the route map ({len(off_map)}): {', '.join(off_map) or '-'}")
+        print(f"  unknown ({len(unknown)}): {', '.join(unknown) or '-'}")
+
+
+if __name__ == "__main__":
+    main()